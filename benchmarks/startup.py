@@ -0,0 +1,70 @@
+#!/usr/bin/python
+"""Measures the start-up time of asemd. Each case is run in a fresh
+interpreter, and the median wall time of a number of repeats is reported:
+
+  help:   asemd --help
+  <MODE>: importing everything that is needed to run a mode
+
+Run from the repository root (with asemd installed) using
+
+$ python benchmarks/startup.py (-n 10) (--importtime)
+
+where --importtime lists the slowest imports of each case."""
+
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+
+cases = {
+	'help':'import sys; sys.argv = ["asemd", "--help"]; from asemd.__main__ import main; main()',
+}
+for mode in ['EMIN', 'SP', 'EOS', 'NVE', 'NVT', 'NPT', 'RESPA', 'REMD', 'WORKFLOW']:
+	cases[mode] = f'import asemd.modes as modes; modes.import_mode("{mode}")'
+
+
+def timed(code):
+	"""Wall time (s) of running code in a new interpreter."""
+	start = time.perf_counter()
+	subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, check=True)
+	return time.perf_counter() - start
+
+
+def slowest_imports(code, num=5):
+	"""Returns the slowest imports (cumulative time) of running code."""
+	out = subprocess.run(
+		[sys.executable, '-X', 'importtime', '-c', code],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+		text=True
+	).stderr
+	imports = []
+	for line in out.splitlines()[1:]:
+		if not line.startswith('import time:'):
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		imports.append((int(cumulative), name.rstrip()))
+	return sorted(imports, reverse=True)[:num]
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Start-up benchmark of asemd.')
+	parser.add_argument('-n', type=int, default=5, help='Number of repeats.')
+	parser.add_argument('--importtime', action='store_true', help='List the slowest imports.')
+	args = parser.parse_args()
+
+	baseline = statistics.median(timed('pass') for _ in range(args.n))
+	print(f'{"python":10} {baseline*1000:8.1f} ms')
+
+	for name, code in cases.items():
+		wall = statistics.median(timed(code) for _ in range(args.n))
+		print(f'{name:10} {wall*1000:8.1f} ms')
+		if args.importtime:
+			for cumulative, module in slowest_imports(code):
+				print(f'{"":10} {cumulative/1000:8.1f} ms {module}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,10 @@
+"""Runs ASE simulation modes from the terminal (asemd MODE input.in) or from
+Python using asemd.run(mode, config, atoms=None)."""
+
+
+def __getattr__(name):
+	# The API is imported on first use, so that 'import asemd' stays cheap
+	if name in ('run', 'Results'):
+		import asemd.api as api
+		return getattr(api, name)
+	raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -7,66 +7,57 @@ import time
 import datetime
 import os
 import sys
-import copy
-import pandas as pd
-import numpy as np
-
-import asemd.energy_min as emin
-import asemd.single_point as sp
-import asemd.equation_of_state as eos
-import asemd.md as md
+
 import asemd.parse_func as pf
+import asemd.server as server
+
+# Modes, ASE and pandas are imported in main once the arguments have been
+# parsed, so that --help and --server do not have to load them
 
 
-# Initiate parser using function defined in parse_func.py
-parser = pf.create_parser()
+def main(argv=None):
+	# Initiate parser using function defined in parse_func.py
+	parser = pf.create_parser()
 
-# Collect args using parser
-args = parser.parse_args()
-mode = args.mode
-input_file = args.input
+	# Collect args using parser
+	args = parser.parse_args(argv)
+	mode = args.mode
+	input_file = args.input
 
-# Paths
-path = os.getcwd()+'/'
-sys.path.append(path) # Cannot load external calculator module without this!
+	# Long-lived server that runs jobs submitted by clients using --server
+	if mode == 'SERVE':
+		# Everything a job may need is loaded once by the server
+		import asemd.modes as modes
+		import asemd.api
+		for name in modes.mode_modules:
+			modes.import_mode(name)
+		server.serve(args.socket)
+		sys.exit()
 
-# Read input file
-with open(path+input_file, 'r') as f:
-	inp = yaml.safe_load(f)
+	if input_file is None:
+		parser.error('the following arguments are required: input.in')
 
-mode_input = inp[mode]
-global_input = inp['Global']
+	if args.server:
+		argv = [arg for arg in (sys.argv[1:] if argv is None else argv) if arg != '--server']
+		sys.exit(server.submit(argv, input_file, args.socket))
 
-# Collects- and appends all local variables to the global variables
-# This is used to select arbitrary methods from strings using get(attr)
-# For example, global_vars is a dictionary where all modules imported as
-# 'from x import y' are found as {y:x}. Using global_vars.get(y)() is equivalent
-# to calling 'x.y()'.
-global_vars = globals().copy()
-global_vars.update(locals())
+	import asemd.modes as modes
+	import asemd.api as api
 
-# Mapping between input mode and class name for each relevant ASE-object
-ensemble_methods = {
-	'NVE': 'VelocityVerlet',
-	'NVT': 'Langevin',
-	'NPT': 'NPT'
-}
+	# Paths
+	path = os.getcwd()+'/'
+	sys.path.append(path) # Cannot load external calculator module without this!
 
-modes = {
-	'EMIN':'Energy minimisation',
-	'SP':'Single point energy calculation',
-	'EOS':'Equation of state',
-	'NVE':'Microcanonical ensemble',
-	'NVT':'Canonical ensemble',
-	'NPT':'Isobaric ensemble',
-	'CH':'Changes structure headers',
-}
+	# Read input file
+	with open(path+input_file, 'r') as f:
+		inp = yaml.safe_load(f)
 
-# Removes case-sensitivity from mode-input parameters
-mode_input = {key.lower():val for key, val in mode_input.items()}
+	mode_input = inp[mode]
+	global_input = inp['Global']
 
+	# Removes case-sensitivity from mode-input parameters
+	mode_input = {key.lower():val for key, val in mode_input.items()}
 
-def main():
 	# INITIALISE SHARED VARIABLES #############################################
 	# CLI arguments have priority over the input file as a rule
 	if args.input_structure:
@@ -80,16 +71,24 @@ def main():
 		#print(type(structures))
 		mode_input['structures'] = structures
 
+	if args.resume:
+		mode_input['resume'] = True
 
 	if args.test == False:
 		if args.output:
 			output_structure = args.output
 			mode_input['output'] = output_structure
-		else:
+		elif 'output' in mode_input:
 			output_structure = mode_input['output']
+		else:
+			output_structure = False
 	else:
 		output_structure = False
 
+		# Streaming analysis results are outputs as well
+		if mode_input.get('analysis'):
+			mode_input['analysis']['output'] = False
+
 	if args.STEPS:
 		STEPS = int(args.STEPS)
 		mode_input['steps'] = STEPS
@@ -134,152 +133,33 @@ def main():
 
 
 	# SETUP ###################################################################
-	# ENERGY MINIMISATION
-	if mode == 'EMIN':
-
-		# CLI arguments have priority over the input file as a rule
-		if args.optimiser:
-			optimiser = args.optimiser
-			mode_input['optimiser'] = optimiser
-		elif mode_input['optimiser']:
-			optimiser = mode_input['optimiser']
-		else:
-			print('No optimiser chosen!')
-			print('''Select optimiser by including:\n  optimiser: BFGS/MDMin/GPMin\nin the YAML input file.''')
-
-		if args.FMAX:
-			FMAX = float(args.FMAX)
-			mode_input['fmax'] = FMAX
-		elif 'fmax' in mode_input:
-			FMAX = float(mode_input['fmax'])
-		else:
-			FMAX = None
-
-
-		# Initialise an energy minimisation object
-		setup = emin.EnergyMinimisation(
-			optimiser,
-			STEPS,
-			FMAX,
-			DUMP_INTERVAL,
-			log_file,
-			mode_input,
-			global_input,
-			path+input_structure,
-			output_structure
-		)
-
-
-	# SINGLE POINT EVALUATION
-	elif mode == 'SP':
-		# Initiate a single point caluclation object
-		setup = sp.SinglePoint(
-			log_file,
-			mode_input,
-			global_input,
-			path+input_structure,
-			output_structure
-		)
-
-
-	# EQUATION OF STATE
-	elif mode == 'EOS':
-
-		# Initiate a equation of state object
-		setup = eos.EquationState(
-			log_file,
-			mode_input,
-			global_input,
-			path+input_structure,
-			output_structure
-		)
-
-	
-
-	# INITIALISE ENSEMBLE VARIABLES ###########################################
-	elif mode in ensemble_methods.keys():
-		
-		# CLI arguments have priority over the input file as a rule
-		if args.TEMPERATURE:
-			TEMPERATURE = float(args.TEMPERATURE)
-			mode_input['temperature'] = TEMPERATURE
-		elif 'temperature' in mode_input:
-			TEMPERATURE = float(mode_input['temperature'])
-		else:
-			TEMPERATURE = None
-
-		if args.TIME_STEP:
-			TIME_STEP = float(args.TIME_STEP)
-			mode_input['time step'] = TIME_STEP
-		elif 'time step' in mode_input:
-			TIME_STEP = float(mode_input['time step'])
-		else:
-			TIME_STEP = None
-
-		if args.FRICTION:
-			FRICTION = float(args.FRICTION)
-			mode_input['friction'] = FRICTION
-		elif 'friction' in mode_input:
-			FRICTION = float(mode_input['friction'])
-		else:
-			FRICTION = None
-
-		if args.PFACTOR:
-			PFACTOR = float(args.PFACTOR)
-			mode_input['pfactor'] = PFACTOR
-		elif 'pfactor' in mode_input:
-			PFACTOR = mode_input['pfactor']
-		else:
-			PFACTOR = None
-
-		if args.external_stress is not None:
-			if len(args.external_stress) > 1:
-				external_stress = list(args.external_stress)
-			else:
-				external_stress = float(args.external_stress)
-			mode_input['external stress'] = external_stress
-		elif 'external stress' in mode_input:
-			if len(args.external_stress) > 1:
-				external_stress = list(mode_input['external stress'])
-			else:
-				external_stress = float(mode_input['external stress'])
-		else:
-			external_stress = 0
-
-		if args.CHARACTERSISTIC_TIMESCALE:
-			CHARACTERSISTIC_TIMESCALE = float(args.CHARACTERSISTIC_TIMESCALE)
-			mode_input['thermostat timescale'] = CHARACTERSISTIC_TIMESCALE
-		elif 'thermostat timescale' in mode_input:
-			CHARACTERSISTIC_TIMESCALE = float(mode_input['thermostat timescale'])
-		else:
-			CHARACTERSISTIC_TIMESCALE = None
-
-
-		# Initiate molecular dynamics object
-		setup = md.MolecularDynamics(
-			STEPS,
-			TIME_STEP,
-			TEMPERATURE,
-			FRICTION,
-			PFACTOR,
-			CHARACTERSISTIC_TIMESCALE,
-			DUMP_INTERVAL,
-			external_stress,
-			log_file,
-			mode_input,
-			global_input,
-			path+input_structure,
-			output_structure
-		)
-
-		if mode == 'NVE':
-			setup.nve()
-
-		elif mode == 'NVT':
-			setup.nvt()
-		
-		elif mode == 'NPT':
-			setup.npt()
+	# CLI arguments have priority over the input file as a rule. They are
+	# merged into the mode input, from which the setup object is initialised.
+	cli_input = {
+		'optimiser':args.optimiser,
+		'fmax':args.FMAX,
+		'temperature':args.TEMPERATURE,
+		'time step':args.TIME_STEP,
+		'friction':args.FRICTION,
+		'pfactor':args.PFACTOR,
+		'external stress':args.external_stress,
+		'thermostat timescale':args.CHARACTERSISTIC_TIMESCALE,
+	}
+	for key, val in cli_input.items():
+		if val is not None:
+			mode_input[key] = val
+
+	# Workflows and sweeps are set up in the same way as single modes
+	setup = api.create_setup(
+		mode,
+		inp,
+		mode_input,
+		global_input,
+		path+input_structure,
+		output_structure,
+		log_file,
+		args.test
+	)
 
 
 	# RUN SETUP ###############################################################	
@@ -309,13 +189,15 @@ def main():
 	#print(global_input)
 	# Merge input dictionaries into a single one and generate a dataframe
 	inputs = {**global_input, **mode_input}
+	import pandas as pd
 	param_df = pd.DataFrame.from_dict(inputs, orient='index', columns=[''])
 
 
-	if (mode == 'NPT') and (PFACTOR == None):
+	if (mode == 'NPT') and (mode_input.get('pfactor') is None) and (
+		str(mode_input.get('barostat', 'NPT')).lower() != 'berendsen'):
 		print(f'Mode: NVT (Canonical ensemble using a Nosé-Hoover thermostat.)')
 	else:
-		print(f'Mode: {mode} ({modes[mode]})')
+		print(f'Mode: {mode} ({modes.modes[mode]})')
 	if args.test:
 		print('Running in test mode. No logs or outputs will be saved.')
 	print('\nInput:')
@@ -344,6 +226,8 @@ def main():
 	
 
 	setup.run()
+	if hasattr(setup, 'report_cache'):
+		setup.report_cache()
 
 
 	print('\nFinished!')
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import time
+import numpy as np
+
+from ase import units
+from ase.geometry import find_mic
+
+
+class AdaptiveTimeStep(object):
+	"""Adjusts the time step of a dynamic object during a run.
+
+	The controller is attached to the dynamic object and called after every
+	step. The time step is scaled so that the largest per-atom displacement
+	per step approaches max_displacement (Å), and it is halved whenever the
+	change in total energy over a step exceeds energy_tolerance (eV/atom).
+	The energy criterion is only meaningful for energy conserving dynamics
+	and is skipped if energy_tolerance is None. The time step is always kept
+	within [min_step, max_step] (fs).
+
+	The time step used to reach each configuration is written to
+	atoms.info['time step'] and the elapsed simulated time to
+	atoms.info['time'] (both in fs), so that trajectory frames carry the
+	step actually used."""
+	def __init__(self,
+			dyn,
+			atoms,
+			max_displacement=0.05,
+			energy_tolerance=None,
+			min_step=0.1,
+			max_step=5.0,
+			growth=1.2
+		):
+		self.dyn = dyn
+		self.atoms = atoms
+		self.max_displacement = float(max_displacement)
+		self.energy_tolerance = energy_tolerance
+		self.min_step = float(min_step)
+		self.max_step = float(max_step)
+		self.growth = float(growth)
+
+		self.initial_step = self.dyn.dt/units.fs
+		self.previous_positions = None
+		self.previous_energy = None
+		self.simulated_time = 0
+		self.time_steps = []
+		self.start = time.perf_counter()
+
+		self.atoms.info['time step'] = self.initial_step
+		self.atoms.info['time'] = 0.0
+
+	def __call__(self):
+		"""Records the time step of the last step and selects the next one."""
+		atoms = self.atoms
+		dt = self.dyn.dt/units.fs
+		positions = atoms.get_positions()
+		energy = atoms.get_total_energy()/len(atoms)
+
+		# The first call is made before any step has been taken
+		if self.previous_positions is None:
+			self.previous_positions = positions
+			self.previous_energy = energy
+			return
+
+		self.simulated_time += dt
+		self.time_steps.append(dt)
+		atoms.info['time step'] = dt
+		atoms.info['time'] = self.simulated_time
+
+		displacement = positions - self.previous_positions
+		if atoms.pbc.any():
+			displacement = find_mic(displacement, atoms.cell, atoms.pbc)[0]
+		displacement = np.max(np.linalg.norm(displacement, axis=1))
+
+		# Displacements scale linearly with the time step. The growth factor
+		# limits how fast the step may increase from one step to the next.
+		if displacement > 0:
+			scale = min(self.max_displacement/displacement, self.growth)
+		else:
+			scale = self.growth
+
+		if (self.energy_tolerance is not None) and (
+			abs(energy - self.previous_energy) > self.energy_tolerance):
+			scale = min(scale, 0.5)
+
+		self.set_time_step(min(max(dt*scale, self.min_step), self.max_step))
+		self.previous_positions = positions
+		self.previous_energy = energy
+
+	def set_time_step(self, dt):
+		"""Sets the time step (fs) of the dynamic object. Thermostats that
+		precompute coefficients from the time step provide set_timestep."""
+		if hasattr(self.dyn, 'set_timestep'):
+			self.dyn.set_timestep(dt*units.fs)
+		else:
+			self.dyn.dt = dt*units.fs
+
+	def summary(self):
+		"""Returns a list of lines that summarise the run, including the
+		simulated time per wall-clock hour compared with a fixed-step run
+		with the same number of steps (i.e. calculator calls)."""
+		wall = time.perf_counter() - self.start
+		steps = len(self.time_steps)
+		fixed = steps*self.initial_step
+		out = [
+			f'Simulated time: {self.simulated_time/1000:.4f} ps ({steps} steps)',
+		]
+		if steps > 0:
+			out.append(
+				f'Time step: min {min(self.time_steps):.3f} fs, '
+				f'mean {np.mean(self.time_steps):.3f} fs, '
+				f'max {max(self.time_steps):.3f} fs'
+			)
+		if wall > 0:
+			out.append(
+				f'Simulated time per wall-clock hour: '
+				f'{self.simulated_time/1000/wall*3600:.4f} ps/h '
+				f'(fixed step: {fixed/1000/wall*3600:.4f} ps/h)'
+			)
+		return out
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+
+import json
+import numpy as np
+
+from ase.neighborlist import neighbor_list
+from ase.geometry import find_mic
+
+
+class RadialDistribution(object):
+	"""Streaming radial distribution function.
+
+	Pair distances within rmax are found using the binned (cell-list) neighbour
+	search of ASE and histogrammed in a single vectorised call per frame, so
+	only the histogram is kept in memory."""
+	def __init__(self, rmax=6.0, bins=200):
+		self.rmax = float(rmax)
+		self.bins = int(bins)
+		self.edges = np.linspace(0, self.rmax, self.bins+1)
+		self.counts = np.zeros(self.bins)
+		self.density = 0
+		self.natoms = 0
+		self.frames = 0
+
+	def update(self, atoms):
+		"""Adds the pair distances of a frame to the histogram."""
+		distances = neighbor_list('d', atoms, self.rmax)
+		self.counts += np.histogram(distances, bins=self.edges)[0]
+		self.natoms = len(atoms)
+		if atoms.cell.rank == 3:
+			self.density += len(atoms)/atoms.get_volume()
+		self.frames += 1
+
+	def results(self):
+		"""Returns bin centres, g(r) and the raw pair counts. If the system
+		has no three dimensional cell g(r) cannot be normalised and is
+		returned as NaN."""
+		r = 0.5*(self.edges[1:] + self.edges[:-1])
+		shells = 4/3*np.pi*(self.edges[1:]**3 - self.edges[:-1]**3)
+		if (self.frames > 0) and (self.density > 0):
+			density = self.density/self.frames
+			g = self.counts/(self.frames*self.natoms*density*shells)
+		else:
+			g = np.full(self.bins, np.nan)
+		return {'rdf r':r, 'rdf':g, 'rdf counts':self.counts}
+
+
+class WindowedCorrelation(object):
+	"""Base class for time correlations over a sliding window of time origins.
+
+	Every frame is used as a new time origin and only the last window origins
+	are kept, so memory is bounded by window*atoms*3. The correlation between
+	the current frame and all stored origins is evaluated in one vectorised
+	operation per frame."""
+	def __init__(self, window=100):
+		self.window = int(window)
+		self.origins = None
+		self.stored = 0
+		self.head = 0
+		self.sums = np.zeros(self.window)
+		self.counts = np.zeros(self.window)
+
+	def store(self, values):
+		"""Adds the values of the current frame to the ring of origins."""
+		if self.origins is None:
+			self.origins = np.zeros((self.window,)+values.shape)
+		self.origins[self.head] = values
+		self.head = (self.head + 1) % self.window
+		self.stored = min(self.stored + 1, self.window)
+
+	def accumulate(self, values):
+		"""Stores the current frame as an origin and accumulates the
+		correlation with all stored origins by lag."""
+		self.store(values)
+
+		# Lag k belongs to the origin stored k frames ago
+		lags = np.arange(self.stored)
+		slots = (self.head - 1 - lags) % self.window
+		self.sums[lags] += self.correlate(self.origins[slots], values)
+		self.counts[lags] += 1
+
+	def correlate(self, origins, values):
+		raise NotImplementedError
+
+	def average(self):
+		"""Returns the correlation averaged over all origins for each lag."""
+		with np.errstate(invalid='ignore'):
+			return self.sums/self.counts
+
+
+class MeanSquaredDisplacement(WindowedCorrelation):
+	"""Streaming, windowed mean squared displacement.
+
+	Positions are unwrapped on the fly using minimum image displacements
+	between consecutive frames, which requires that atoms move less than half
+	a box length between updates."""
+	def __init__(self, window=100):
+		super().__init__(window)
+		self.previous = None
+		self.unwrapped = None
+
+	def update(self, atoms):
+		positions = atoms.get_positions()
+		if self.unwrapped is None:
+			self.unwrapped = positions.copy()
+		else:
+			step = positions - self.previous
+			if atoms.pbc.any():
+				step = find_mic(step, atoms.cell, atoms.pbc)[0]
+			self.unwrapped += step
+		self.previous = positions
+		self.accumulate(self.unwrapped)
+
+	def correlate(self, origins, values):
+		return ((values - origins)**2).sum(axis=2).mean(axis=1)
+
+	def results(self):
+		return {'msd':self.average()}
+
+
+class VelocityAutocorrelation(WindowedCorrelation):
+	"""Streaming, windowed velocity autocorrelation function."""
+	def update(self, atoms):
+		self.accumulate(atoms.get_velocities())
+
+	def correlate(self, origins, values):
+		return (origins*values).sum(axis=2).mean(axis=1)
+
+	def results(self):
+		return {'vacf':self.average()}
+
+
+class StreamingAnalysis(object):
+	"""Collection of streaming accumulators that are attached to a dynamic
+	object and updated every interval steps.
+
+	Supported analyses:
+	- rdf: Radial distribution function (settings: rmax, bins)
+	- msd: Mean squared displacement (settings: window)
+	- vacf: Velocity autocorrelation function (settings: window)
+
+	If a clock is given, it is called at every update and returns the elapsed
+	simulated time in fs. The lag times of the correlations are averaged over
+	the time origins, so they are also correct if the time step varies."""
+	accumulators = {
+		'rdf':RadialDistribution,
+		'msd':MeanSquaredDisplacement,
+		'vacf':VelocityAutocorrelation,
+	}
+
+	def __init__(self, settings, atoms, interval=1, clock=None):
+		self.atoms = atoms
+		self.interval = int(interval)
+		self.clock = clock
+
+		self.analyses = {}
+		for name, cls in self.accumulators.items():
+			if name in settings:
+				params = settings[name] or {}
+				params = {key.lower():val for key, val in params.items()}
+				self.analyses[name] = cls(**params)
+
+		# Times of the samples kept as origins and summed lag times, for the
+		# longest correlation window
+		windows = [
+			analysis.window for analysis in self.analyses.values()
+			if isinstance(analysis, WindowedCorrelation)
+		]
+		self.window = max(windows, default=0)
+		self.times = np.zeros(self.window)
+		self.lag_times = np.zeros(self.window)
+		self.samples = 0
+
+	def update(self):
+		"""Updates all accumulators with the current state of the atoms."""
+		for analysis in self.analyses.values():
+			analysis.update(self.atoms)
+
+		if (self.clock is not None) and self.window:
+			# Lag k belongs to the sample taken k updates ago
+			self.times = np.roll(self.times, 1)
+			self.times[0] = self.clock()
+			self.samples += 1
+			stored = min(self.samples, self.window)
+			self.lag_times[:stored] += self.times[0] - self.times[:stored]
+
+	def results(self):
+		"""Collects the results of all accumulators in a single dictionary of
+		arrays. Lag times are given in fs if a clock has been given."""
+		out = {}
+		for name, analysis in self.analyses.items():
+			out.update(analysis.results())
+			if isinstance(analysis, WindowedCorrelation) and (self.clock is not None):
+				with np.errstate(invalid='ignore'):
+					out[f'{name} lag time'] = self.lag_times[:analysis.window]/analysis.counts
+		return out
+
+	def save(self, filename):
+		"""Writes all results to a compressed NumPy archive."""
+		out = {key.replace(' ', '_'):val for key, val in self.results().items()}
+		np.savez_compressed(filename, **out)
+
+
+class StreamingHistogram(object):
+	"""Histogram with a fixed number of bins whose range grows with the data.
+
+	The range is set by the first batch of values. When later values fall
+	outside of it, the range is doubled towards them and pairs of bins are
+	merged, so memory stays constant regardless of the number of values.
+	Percentiles are interpolated within the bins."""
+	def __init__(self, bins=200):
+		# An even number of bins is needed to merge pairs
+		self.bins = int(bins) + int(bins) % 2
+		self.counts = None
+		self.low = None
+		self.width = None
+
+	def update(self, values):
+		"""Adds a batch of values to the histogram. Non-finite values are
+		ignored."""
+		values = np.asarray(values, dtype=float).ravel()
+		values = values[np.isfinite(values)]
+		if len(values) == 0:
+			return
+		vmin, vmax = values.min(), values.max()
+
+		if self.counts is None:
+			span = vmax - vmin
+			if span == 0:
+				span = max(abs(vmin), 1.0)*1e-3
+			self.low = vmin
+			self.width = 1.01*span/self.bins
+			self.counts = np.zeros(self.bins, dtype=np.int64)
+
+		half = self.bins//2
+		while (vmin < self.low) or (vmax >= self.low + self.width*self.bins):
+			merged = self.counts.reshape(half, 2).sum(axis=1)
+			if vmin < self.low:
+				self.counts = np.concatenate([np.zeros(half, dtype=np.int64), merged])
+				self.low -= self.width*self.bins
+			else:
+				self.counts = np.concatenate([merged, np.zeros(half, dtype=np.int64)])
+			self.width *= 2
+
+		index = ((values - self.low)/self.width).astype(np.int64)
+		self.counts += np.bincount(np.minimum(index, self.bins-1), minlength=self.bins)
+
+	@property
+	def edges(self):
+		return self.low + self.width*np.arange(self.bins+1)
+
+	def percentiles(self, q):
+		"""Returns the approximate percentiles (0-100) of all values."""
+		q = np.asarray(q, dtype=float)
+		if self.counts is None:
+			return np.full(q.shape, np.nan)
+		cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+		return np.interp(q/100*cumulative[-1], cumulative, self.edges)
+
+
+class RunningStatistics(object):
+	"""Count, mean, standard deviation, extremes and histogram of a stream
+	of values. Each batch is reduced in a single vectorised pass and merged
+	into the running moments (Chan et al.), so only a constant amount of
+	memory is used. Non-finite values (e.g. of diverged structures) are 
+	counted separately and left out of all other statistics."""
+	percentile_levels = (5, 25, 50, 75, 95)
+
+	def __init__(self, bins=200):
+		self.count = 0
+		self.nonfinite = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.min = np.inf
+		self.max = -np.inf
+		self.histogram = StreamingHistogram(bins)
+
+	def update(self, values):
+		"""Adds a batch of values."""
+		values = np.asarray(values, dtype=float).ravel()
+		finite = np.isfinite(values)
+		if not finite.all():
+			self.nonfinite += int((~finite).sum())
+			values = values[finite]
+		n = len(values)
+		if n == 0:
+			return
+
+		mean = values.mean()
+		m2 = np.square(values - mean).sum()
+		delta = mean - self.mean
+		total = self.count + n
+		self.mean += delta*n/total
+		self.m2 += m2 + delta**2*self.count*n/total
+		self.count = total
+
+		self.min = min(self.min, values.min())
+		self.max = max(self.max, values.max())
+		self.histogram.update(values)
+
+	@property
+	def std(self):
+		return np.sqrt(self.m2/self.count) if self.count else np.nan
+
+	def summary(self):
+		"""Returns the statistics as a dictionary of numbers."""
+		out = {
+			'count':self.count,
+			'non-finite':self.nonfinite,
+			'mean':self.mean if self.count else np.nan,
+			'std':self.std,
+			'min':self.min if self.count else np.nan,
+			'max':self.max if self.count else np.nan,
+		}
+		# Interpolation within the outer bins may pass the extremes
+		levels = self.percentile_levels
+		values = self.histogram.percentiles(levels)
+		if self.count:
+			values = np.clip(values, self.min, self.max)
+		for level, value in zip(levels, values):
+			out[f'p{level}'] = value
+		return out
+
+
+class DatasetStatistics(object):
+	"""Streaming statistics of the structures evaluated in single point 
+	calculations. Every structure is reduced as soon as it has been evaluated,
+	so memory does not depend on the size of the dataset.
+
+	Quantities:
+	- energy per atom [eV/atom] (one value per structure)
+	- per-atom energies [eV] (if evaluated)
+	- force norm [eV/Å] (if evaluated), also for each element"""
+	def __init__(self, bins=200):
+		self.bins = int(bins)
+		self.quantities = {}
+		self.structures = 0
+
+	def add(self, name, values):
+		if name not in self.quantities:
+			self.quantities[name] = RunningStatistics(self.bins)
+		self.quantities[name].update(values)
+
+	def update(self, atoms, energy):
+		"""Adds a structure with its potential energy and the per-atom
+		properties stored in its arrays."""
+		self.structures += 1
+		self.add('energy per atom [eV/atom]', energy/len(atoms))
+
+		if 'energies' in atoms.arrays:
+			self.add('per-atom energy [eV]', atoms.arrays['energies'])
+
+		if 'forces' in atoms.arrays:
+			forces = atoms.arrays['forces']
+			norms = np.sqrt(np.einsum('ij,ij->i', forces, forces))
+			self.add('force norm [eV/Å]', norms)
+
+			# Per-element distributions
+			symbols = np.array(atoms.get_chemical_symbols())
+			for symbol in np.unique(symbols):
+				self.add(f'force norm {symbol} [eV/Å]', norms[symbols == symbol])
+
+	def summary(self):
+		"""Returns a dataframe with one row of statistics per quantity."""
+		import pandas as pd
+		return pd.DataFrame.from_dict(
+			{name:stats.summary() for name, stats in self.quantities.items()},
+			orient='index'
+		)
+
+	def results(self):
+		"""Collects statistics and histograms in a single dictionary."""
+		out = {'structures':self.structures}
+		for name, stats in self.quantities.items():
+			out[name] = stats.summary()
+			out[name]['histogram edges'] = stats.histogram.edges.tolist() if stats.count else []
+			out[name]['histogram counts'] = (
+				stats.histogram.counts.tolist() if stats.count else []
+			)
+		return out
+
+	def save(self, filename):
+		"""Writes the summary to a JSON file, or to a compressed NumPy 
+		archive if the filename ends with .npz."""
+		results = self.results()
+		if filename.endswith('.npz'):
+			out = {'structures':results.pop('structures')}
+			for name, values in results.items():
+				for key, val in values.items():
+					out[f'{name} {key}'.replace(' ', '_')] = np.asarray(val)
+			np.savez_compressed(filename, **out)
+		else:
+			with open(filename, 'w') as f:
+				json.dump(results, f, indent=1, default=float)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+import io
+import os
+import sys
+import copy
+import yaml
+import contextlib
+
+import asemd.modes as modes
+
+
+class Results(object):
+	"""Outcome of a run. The table holds one row of results per structure
+	(or job/stage for sweeps and workflows), atoms the final structures and
+	setup the object that was run."""
+	def __init__(self, mode, setup):
+		self.mode = mode
+		self.setup = setup
+		self.table = setup.results()
+		self.atoms = getattr(setup, 'atoms', None)
+
+	def __repr__(self):
+		return f'Results(mode={self.mode}, rows={len(self.table)})'
+
+
+class OutputTail(io.TextIOBase):
+	"""Keeps the end of the printouts of a run, so that the message printed
+	before a run is stopped can be passed on to the caller. Printouts are 
+	forwarded to stream if one is given, and discarded otherwise."""
+	def __init__(self, stream=None, size=4096):
+		self.stream = stream
+		self.size = size
+		self.tail = ''
+
+	def writable(self):
+		return True
+
+	def write(self, text):
+		if self.stream is not None:
+			self.stream.write(text)
+		self.tail = (self.tail + text)[-self.size:]
+		return len(text)
+
+	def flush(self):
+		if self.stream is not None:
+			self.stream.flush()
+
+	def message(self):
+		"""Returns the last message printed by error_msg, which is enclosed
+		in lines of dashes, or the end of the printouts."""
+		blocks = self.tail.split('-'*80)
+		if len(blocks) >= 3:
+			return blocks[-2].strip()
+		return self.tail.strip()
+
+
+def create_setup(
+		mode,
+		inp,
+		mode_input,
+		global_input,
+		input_structure,
+		output_structure,
+		log_file,
+		test=False,
+		atoms=None
+	):
+	"""Creates the setup object of a mode, a sweep or a workflow. inp is the
+	complete input, from which workflows read the sections of their
+	stages."""
+	if mode == 'WORKFLOW':
+		import asemd.workflow as wf
+
+		# The stages are read from the sections of their modes, which may be
+		# empty
+		stage_input = {
+			key:{k.lower():v for k, v in (val or {}).items()}
+			for key, val in inp.items() if key in modes.modes
+		}
+		setup = wf.Workflow(
+			mode_input,
+			global_input,
+			stage_input,
+			input_structure,
+			output_structure,
+			log_file,
+			test,
+			atoms=atoms
+		)
+	elif 'sweep' in mode_input:
+		import asemd.sweep as sw
+		setup = sw.Sweep(
+			mode,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			log_file,
+			atoms=atoms
+		)
+	else:
+		setup = modes.initialise(
+			mode,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			log_file,
+			atoms=atoms
+		)
+	return setup
+
+
+def run(mode, config, atoms=None, log_file=None, verbose=False):
+	"""Runs a mode from Python and returns a Results object, e.g.
+
+		import asemd
+		res = asemd.run('SP', {'Global':{'calculator':'EMT'}, 'SP':{}}, atoms=structures)
+		print(res.table)
+
+	The config is a dictionary with the same layout as the YAML input file,
+	or the name of such a file. Structures passed as atoms replace the input
+	file of the Global section and are not modified. Outputs are only written
+	if the mode section sets one, and printouts are hidden unless verbose.
+	Errors that stop the CLI raise a RuntimeError with its message."""
+	mode = mode.upper()
+	if isinstance(config, str):
+		with open(config, 'r') as f:
+			config = yaml.safe_load(f)
+
+	inp = copy.deepcopy(config)
+	global_input = inp.get('Global') or {}
+	mode_input = {key.lower():val for key, val in (inp.get(mode) or {}).items()}
+
+	# Calculator scripts are imported from the working directory
+	path = os.getcwd()
+	if path not in sys.path:
+		sys.path.append(path)
+
+	if atoms is not None:
+		input_structure = ''
+		if not isinstance(atoms, (list, tuple)):
+			atoms = [atoms]
+	else:
+		input_structure = global_input['input file']
+	output_structure = mode_input.get('output', False)
+
+	# Errors in the input are printed and followed by sys.exit(), as in the
+	# CLI, so the printed message is kept for the exception
+	out = OutputTail(sys.stdout if verbose else None)
+	try:
+		with contextlib.redirect_stdout(out):
+			setup = create_setup(
+				mode,
+				inp,
+				mode_input,
+				global_input,
+				input_structure,
+				output_structure,
+				log_file,
+				atoms=atoms
+			)
+			setup.run()
+			if hasattr(setup, 'report_cache'):
+				setup.report_cache()
+	except SystemExit as exc:
+		raise RuntimeError(out.message() or f'{mode} was stopped.') from exc
+
+	return Results(mode, setup)
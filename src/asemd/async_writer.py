@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+import atexit
+import queue
+import threading
+
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+class AsyncTrajectoryWriter(object):
+	"""Wraps a trajectory-like writer (any object with write- and close-
+	methods) and moves serialisation to a background thread.
+
+	Frames are copied when write is called, i.e. at dump time, and placed in a
+	bounded queue. If the queue is full, write blocks until the writer thread
+	has caught up (back-pressure), which keeps memory usage bounded. All queued
+	frames are flushed when close is called, or at interpreter exit if close
+	was never called.
+
+	Methods:
+	write: Copies the current state of the atoms object and queues it.
+	close: Flushes all queued frames and closes the wrapped writer."""
+	def __init__(self, writer, atoms=None, queue_size=8):
+		self.writer = writer
+		self.atoms = atoms
+		self.frames = queue.Queue(maxsize=max(int(queue_size), 1))
+		self.error = None
+		self.closed = False
+
+		self.thread = threading.Thread(target=self._serialise, daemon=True)
+		self.thread.start()
+
+		# Guarantees that frames still in the queue reach the disk even if the
+		# run is interrupted before close is called
+		atexit.register(self.close)
+
+	def write(self, atoms=None):
+		"""Copies the atoms object (including calculator results) and places
+		the copy in the frame queue. Blocks if the queue is full."""
+		if self.closed:
+			raise ValueError('Cannot write to a closed trajectory writer.')
+		if self.error is not None:
+			raise self.error
+
+		if atoms is None:
+			atoms = self.atoms
+		self.frames.put(self.snapshot(atoms))
+
+	def snapshot(self, atoms):
+		"""Returns a copy of the atoms object that is detached from the live
+		simulation, with the latest calculator results frozen in a single
+		point calculator."""
+		frame = atoms.copy()
+		if atoms.calc is not None:
+			results = {
+				key:(val.copy() if hasattr(val, 'copy') else val)
+				for key, val in atoms.calc.results.items()
+			}
+			frame.calc = SinglePointCalculator(frame, **results)
+		return frame
+
+	def close(self):
+		"""Waits for all queued frames to be written and closes the wrapped
+		writer."""
+		if self.closed:
+			return
+		self.closed = True
+
+		# A None-frame signals the writer thread to stop
+		self.frames.put(None)
+		self.thread.join()
+		self.writer.close()
+		atexit.unregister(self.close)
+
+		if self.error is not None:
+			raise self.error
+
+	def _serialise(self):
+		"""Writer thread loop. Serialises frames in the order they were
+		queued until a None-frame is received."""
+		while True:
+			frame = self.frames.get()
+			if frame is None:
+				break
+			# Keep draining the queue after an error so that write never
+			# blocks forever; the error is raised in the main thread instead
+			if self.error is None:
+				try:
+					self.writer.write(frame)
+				except Exception as error:
+					self.error = error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
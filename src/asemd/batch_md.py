@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+import numpy as np
+
+from ase import units
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+class BatchedDynamics(object):
+	"""Advances many small structures (replicas) together using stacked
+	arrays.
+
+	Positions, momenta and masses of all replicas are concatenated into single
+	arrays, so each integration step is a handful of vectorised operations
+	regardless of the number of replicas. Without friction the integrator is
+	velocity Verlet (NVE), with friction a BAOAB Langevin splitting (NVT).
+
+	Forces are evaluated by batch_calculator if one is given. It is called
+	with the list of atoms objects and must return the potential energies
+	(one per replica) and the forces, either as one array per replica or as
+	a single concatenated array. Otherwise the calculator attached to each
+	atoms object is called in turn.
+
+	Observers are attached as in ASE dynamic objects and are called at step 0
+	and every interval steps. The atoms objects are only synchronised with
+	the stacked arrays when forces are evaluated and before observers are
+	called."""
+	def __init__(self,
+			atoms_list,
+			timestep,
+			temperature_K=None,
+			friction=None,
+			batch_calculator=None,
+			rng=None
+		):
+		self.atoms_list = atoms_list
+		self.dt = timestep
+		self.temperature_K = temperature_K
+		self.friction = friction
+		self.batch_calculator = batch_calculator
+		self.rng = np.random.default_rng() if rng is None else rng
+
+		self.sizes = np.array([len(a) for a in atoms_list])
+		self.offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+
+		self.positions = np.concatenate([a.get_positions() for a in atoms_list])
+		self.momenta = np.concatenate([a.get_momenta() for a in atoms_list])
+		self.masses = np.concatenate([a.get_masses() for a in atoms_list])[:, None]
+
+		self.energies = None
+		self.forces = None
+		self.nsteps = 0
+		self.observers = []
+
+	def attach(self, function, interval=1, *args, **kwargs):
+		"""Attaches an observer that is called every interval steps."""
+		self.observers.append((function, interval, args, kwargs))
+
+	def call_observers(self):
+		for function, interval, args, kwargs in self.observers:
+			if self.nsteps % interval == 0:
+				function(*args, **kwargs)
+
+	def sync(self):
+		"""Copies the stacked positions and momenta to the atoms objects."""
+		for atoms, start, stop in zip(self.atoms_list, self.offsets[:-1], self.offsets[1:]):
+			atoms.set_positions(self.positions[start:stop], apply_constraint=False)
+			atoms.set_momenta(self.momenta[start:stop], apply_constraint=False)
+
+	def get_forces(self):
+		"""Evaluates potential energies and forces of all replicas."""
+		self.sync()
+		if self.batch_calculator is not None:
+			energies, forces = self.batch_calculator(self.atoms_list)
+			if not isinstance(forces, np.ndarray):
+				forces = np.concatenate(forces)
+
+			# Lets observers (e.g. trajectories) read the batch results
+			for atoms, energy, start, stop in zip(
+				self.atoms_list, energies, self.offsets[:-1], self.offsets[1:]):
+				atoms.calc = SinglePointCalculator(
+					atoms,
+					energy=energy,
+					forces=forces[start:stop]
+				)
+		else:
+			energies = [a.get_potential_energy() for a in self.atoms_list]
+			forces = np.concatenate([a.get_forces() for a in self.atoms_list])
+
+		self.energies = np.asarray(energies, dtype=float)
+		return np.asarray(forces, dtype=float).reshape(-1, 3)
+
+	def kinetic_energies(self):
+		"""Kinetic energy of each replica."""
+		ekin = 0.5*(self.momenta**2/self.masses).sum(axis=1)
+		return np.add.reduceat(ekin, self.offsets[:-1])
+
+	def temperatures(self):
+		"""Instantaneous temperature of each replica."""
+		return self.kinetic_energies()/(1.5*units.kB*self.sizes)
+
+	def step(self):
+		"""Advances all replicas by one time step."""
+		dt = self.dt
+		self.momenta += 0.5*dt*self.forces
+
+		if self.friction:
+			# BAOAB: drift, Ornstein-Uhlenbeck thermostat, drift
+			self.positions += 0.5*dt*self.momenta/self.masses
+			c1 = np.exp(-self.friction*dt)
+			c2 = np.sqrt((1 - c1**2)*self.masses*units.kB*self.temperature_K)
+			noise = self.rng.standard_normal(self.momenta.shape)
+			self.momenta = c1*self.momenta + c2*noise
+			self.positions += 0.5*dt*self.momenta/self.masses
+		else:
+			self.positions += dt*self.momenta/self.masses
+
+		self.forces = self.get_forces()
+		self.momenta += 0.5*dt*self.forces
+
+	def run(self, steps=50):
+		"""Runs all replicas for the given number of steps."""
+		if self.forces is None:
+			self.forces = self.get_forces()
+			self.call_observers()
+
+		for _ in range(steps):
+			self.step()
+			self.nsteps += 1
+			# Observers see the final momenta of the step
+			if any(self.nsteps % interval == 0 for _, interval, _, _ in self.observers):
+				self.sync()
+			self.call_observers()
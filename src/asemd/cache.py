@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+from ase.calculators.calculator import Calculator, all_changes
+
+
+def structure_hash(atoms):
+	"""Returns a hash of the elements, positions, cell and PBC of a
+	structure."""
+	h = hashlib.sha1()
+	h.update(np.ascontiguousarray(atoms.numbers, dtype=np.int64).tobytes())
+	h.update(np.ascontiguousarray(atoms.positions, dtype=np.float64).tobytes())
+	h.update(np.ascontiguousarray(atoms.cell.array, dtype=np.float64).tobytes())
+	h.update(np.ascontiguousarray(atoms.pbc, dtype=bool).tobytes())
+	return h.hexdigest()
+
+
+def calculator_identity(name, calc):
+	"""Returns a hash that identifies a calculator by its name, class,
+	parameters and (for calculator scripts) the content of the script."""
+	import ase
+
+	h = hashlib.sha1()
+	h.update(str(name).encode())
+	h.update(type(calc).__name__.encode())
+	h.update(ase.__version__.encode())
+	h.update(repr(sorted(getattr(calc, 'parameters', {}).items())).encode())
+
+	module = getattr(__import__(name), '__file__', None) if name not in (None, 'EMT') else None
+	if module and os.path.exists(module):
+		with open(module, 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+
+class ResultCache(object):
+	"""On-disk cache of calculator results stored in an SQLite database.
+
+	Results are keyed on the structure and calculator identity, and the least
+	recently used entries are evicted once the total size of the stored
+	results exceeds max_size (MB). The database may be shared between modes,
+	runs and processes."""
+	def __init__(self, filename, max_size=1024):
+		self.filename = filename
+		self.max_size = float(max_size)*1024**2
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		self.db = sqlite3.connect(filename, timeout=60)
+		self.db.execute(
+			'CREATE TABLE IF NOT EXISTS results ('
+			'key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)'
+		)
+		self.db.execute('CREATE INDEX IF NOT EXISTS used_index ON results (used)')
+		self.db.commit()
+
+		# Running total of the stored results, so that inserts do not need to
+		# sum the whole table. Entries added by other processes sharing the 
+		# database are only counted once they are read here.
+		self.total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+	def get(self, key):
+		"""Returns the stored results of a key, or None."""
+		row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+		if row is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		self.db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+		self.db.commit()
+		with np.load(io.BytesIO(row[0]), allow_pickle=False) as data:
+			return {
+				name:(data[name].item() if data[name].ndim == 0 else data[name])
+				for name in data.files
+			}
+
+	def put(self, key, results):
+		"""Stores the results of a key and evicts old entries if needed."""
+		buffer = io.BytesIO()
+		np.savez(buffer, **{name:np.asarray(val) for name, val in results.items()})
+		value = buffer.getvalue()
+
+		# A replaced entry no longer counts towards the total
+		row = self.db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+		if row is not None:
+			self.total -= row[0]
+		self.total += len(value)
+		self.db.execute(
+			'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+			(key, value, len(value), time.time())
+		)
+		self.evict()
+		self.db.commit()
+
+	def evict(self):
+		"""Removes the least recently used entries until the cache fits."""
+		while self.total > self.max_size:
+			row = self.db.execute(
+				'SELECT key, size FROM results ORDER BY used LIMIT 1'
+			).fetchone()
+			if row is None:
+				self.total = 0
+				break
+			self.db.execute('DELETE FROM results WHERE key = ?', (row[0],))
+			self.total -= row[1]
+			self.evictions += 1
+
+	def summary(self):
+		"""Returns the hit/miss statistics as a string."""
+		calls = self.hits + self.misses
+		rate = self.hits/calls if calls else 0.0
+		return (
+			f'Calculator cache: {self.hits} hits, {self.misses} misses '
+			f'(hit rate {rate:.2f}), {self.evictions} evictions'
+		)
+
+	def close(self):
+		self.db.close()
+
+
+class CachedCalculator(Calculator):
+	"""Wraps a calculator so that results are looked up in a ResultCache
+	before the calculator is called. Everything the wrapped calculator
+	computes is stored, so later requests for other properties of the same
+	structure are also served from the cache.
+
+	Evaluations of the wrapped calculator are counted in calls. Without a 
+	cache the wrapper only counts them."""
+	def __init__(self, calc, cache=None, identity=''):
+		Calculator.__init__(self)
+		self.calc = calc
+		self.cache = cache
+		self.identity = identity
+		self.calls = 0
+		self.implemented_properties = list(getattr(calc, 'implemented_properties', []))
+
+	def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+		Calculator.calculate(self, atoms, properties, system_changes)
+		results = None
+		if self.cache is not None:
+			key = self.identity+structure_hash(self.atoms)
+			results = self.cache.get(key)
+
+		if (results is None) or any(p not in results for p in properties):
+			self.calls += 1
+			for name in properties:
+				self.calc.get_property(name, self.atoms)
+			results = {**(results or {}), **self.calc.results}
+			if self.cache is not None:
+				self.cache.put(key, results)
+		self.results = results
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+import json
+import zlib
+import struct
+import numpy as np
+
+from ase import Atoms
+from ase import units
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+class CompressedTrajectory(object):
+	"""Lossy, compressed trajectory format intended for visualisation and
+	structural statistics.
+
+	Positions (and optionally velocities) are quantised to a user-set precision
+	and stored as integers. Each frame is stored as the difference to the
+	previous frame (delta encoding) using the smallest integer type that fits,
+	and is compressed with zlib. Every keyframe_interval frames a full frame is
+	stored, so that random access only needs to decode a limited number of
+	frames.
+
+	File layout:
+		- A magic line followed by a single line JSON header.
+		- One block per frame: a 4-byte length followed by the compressed
+		  frame.
+
+	Precisions are given in Å for positions and in Å/fs for velocities. The
+	cell and the potential energy are stored without loss.
+
+	Methods:
+	write: Quantises and appends the current state of an atoms object.
+	close: Closes the file."""
+	magic = b'ASEMD-CTRAJ\n'
+	int_types = [np.int8, np.int16, np.int32, np.int64]
+
+	def __init__(self,
+			filename,
+			mode='r',
+			atoms=None,
+			precision=1e-3,
+			velocity_precision=None,
+			keyframe_interval=100,
+			level=6
+		):
+		self.filename = filename
+		self.mode = mode
+		self.atoms = atoms
+
+		if self.mode == 'w':
+			if atoms is None:
+				raise ValueError('An atoms object is required when writing.')
+			self.header = {
+				'format':'asemd-ctraj',
+				'version':1,
+				'numbers':atoms.get_atomic_numbers().tolist(),
+				'masses':atoms.get_masses().tolist(),
+				'pbc':atoms.get_pbc().tolist(),
+				'precision':float(precision),
+				'velocity precision':(
+					None if velocity_precision is None else float(velocity_precision)
+				),
+				'keyframe interval':int(keyframe_interval),
+			}
+			self.level = level
+			self.frames = 0
+			self.previous = None
+
+			self.fd = open(self.filename, 'wb')
+			self.fd.write(self.magic)
+			self.fd.write(json.dumps(self.header).encode()+b'\n')
+
+		elif self.mode == 'r':
+			self.open_read()
+
+		else:
+			raise ValueError(f'Unsupported mode: {self.mode}')
+
+	# Writing
+	def quantise(self, atoms):
+		"""Returns the quantised positions (and velocities) of a structure as a
+		single integer array."""
+		q = [np.rint(atoms.positions/self.header['precision'])]
+		if self.header['velocity precision'] is not None:
+			velocities = atoms.get_velocities()*units.fs
+			q.append(np.rint(velocities/self.header['velocity precision']))
+		return np.concatenate(q).astype(np.int64)
+
+	def write(self, atoms=None):
+		"""Encodes and appends a frame to the file."""
+		if self.mode != 'w':
+			raise ValueError('Trajectory is not opened for writing.')
+		if atoms is None:
+			atoms = self.atoms
+
+		q = self.quantise(atoms)
+		keyframe = (self.frames % self.header['keyframe interval'] == 0)
+		if keyframe:
+			values = q
+		else:
+			values = q - self.previous
+		self.previous = q
+
+		# Smallest integer type that can hold all values in the frame
+		dtype = self.int_types[-1]
+		for int_type in self.int_types:
+			info = np.iinfo(int_type)
+			if (values.min() >= info.min) and (values.max() <= info.max):
+				dtype = int_type
+				break
+
+		energy = np.nan
+		if atoms.calc is not None:
+			energy = atoms.get_potential_energy()
+
+		frame = struct.pack(
+			'<?B9dd',
+			keyframe,
+			self.int_types.index(dtype),
+			*atoms.cell.array.flatten(),
+			energy
+		)
+		frame += values.astype(dtype).tobytes()
+		frame = zlib.compress(frame, self.level)
+
+		self.fd.write(struct.pack('<I', len(frame)))
+		self.fd.write(frame)
+		self.frames += 1
+
+	def close(self):
+		"""Closes the file."""
+		if self.mode == 'w':
+			self.fd.close()
+
+	# Reading
+	def open_read(self):
+		"""Reads the header and the location of every frame in the file."""
+		with open(self.filename, 'rb') as f:
+			if f.readline() != self.magic:
+				raise ValueError(f'{self.filename} is not a compressed trajectory.')
+			self.header = json.loads(f.readline())
+
+			self.offsets = []
+			self.keyframes = []
+			while True:
+				size = f.read(4)
+				if len(size) < 4:
+					break
+				size = struct.unpack('<I', size)[0]
+				self.offsets.append((f.tell(), size))
+				f.seek(size, 1)
+
+		self.frames = len(self.offsets)
+		interval = self.header['keyframe interval']
+		self.keyframes = list(range(0, self.frames, interval))
+
+	def decode(self, fd, index):
+		"""Decompresses a single frame and returns its header values and the
+		integer payload."""
+		offset, size = self.offsets[index]
+		fd.seek(offset)
+		frame = zlib.decompress(fd.read(size))
+
+		head = struct.calcsize('<?B9dd')
+		keyframe, dtype, *values = struct.unpack('<?B9dd', frame[:head])
+		cell, energy = np.array(values[:9]).reshape(3, 3), values[9]
+		data = np.frombuffer(frame[head:], dtype=self.int_types[dtype])
+		return keyframe, cell, energy, data.astype(np.int64)
+
+	def __len__(self):
+		return self.frames
+
+	def __getitem__(self, index):
+		"""Returns frame(s) as atoms objects. Decoding starts at the nearest
+		preceding keyframe."""
+		if isinstance(index, slice):
+			return list(self.iterframes(*index.indices(len(self))))
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError('Trajectory index out of range.')
+		return next(self.iterframes(index, index+1, 1))
+
+	def __iter__(self):
+		return self.iterframes(0, len(self), 1)
+
+	def iterframes(self, start, stop, step):
+		"""Decodes frames sequentially from the keyframe preceding start and
+		yields every step-th frame up to stop. Frames can only be decoded 
+		forwards, so for negative steps the selected frames are decoded first
+		and then yielded in reverse order."""
+		indices = range(start, stop, step)
+		if len(indices) == 0:
+			return
+		if step < 0:
+			frames = dict(zip(indices[::-1], self.iterframes(indices[-1], start+1, -step)))
+			for i in indices:
+				yield frames[i]
+			return
+
+		interval = self.header['keyframe interval']
+		first = (start//interval)*interval
+		wanted = set(indices)
+
+		with open(self.filename, 'rb') as fd:
+			q = None
+			for i in range(first, stop):
+				keyframe, cell, energy, data = self.decode(fd, i)
+				q = data if keyframe else q + data
+				if i in wanted:
+					yield self.to_atoms(q, cell, energy)
+
+	def to_atoms(self, q, cell, energy):
+		"""Converts a quantised frame into an atoms object."""
+		natoms = len(self.header['numbers'])
+		q = q.reshape(-1, 3)
+		atoms = Atoms(
+			numbers=self.header['numbers'],
+			positions=q[:natoms]*self.header['precision'],
+			cell=cell,
+			pbc=self.header['pbc'],
+			masses=self.header['masses']
+		)
+		if self.header['velocity precision'] is not None:
+			velocities = q[natoms:]*self.header['velocity precision']/units.fs
+			atoms.set_velocities(velocities)
+		if not np.isnan(energy):
+			atoms.calc = SinglePointCalculator(atoms, energy=energy)
+		return atoms
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -5,6 +5,8 @@ import copy
 import sys
 import os
 import time
+import hashlib
+import numpy as np
 
 from ase.io import read, iread, write
 from ase.io.trajectory import Trajectory
@@ -12,15 +14,27 @@ from ase.calculators.emt import EMT
 from ase import Atoms
 from ase import units
 
+from asemd.cache import ResultCache, CachedCalculator, calculator_identity, structure_hash
+
 
 class Configure(object):
 	"""Setup class that carries shared variables and methods, such as calculator 
 	selection and energy output."""
+	# Modes that read their input one structure at a time during the run set
+	# this, so that the input file is not loaded into memory
+	stream_input = False
+
+	# Modes that rarely evaluate the same structure twice (e.g. MD) do not use
+	# the calculator cache
+	cache_results = True
+
 	def __init__(self,
 			mode_params,
 			global_params,
 			input_structure,
-			output_structure
+			output_structure,
+			atoms=None,
+			calc=None
 		):
 		self.mode_params = mode_params
 		self.global_params = global_params
@@ -46,6 +60,41 @@ class Configure(object):
 			# This is used to produce an error
 			self.calculator = False
 
+		# Opt-in on-disk cache of calculator results, shared between modes and
+		# runs that use the same file
+		if 'cache' in self.mode_params:
+			self.cache_file = self.mode_params['cache']
+		elif 'cache' in self.global_params:
+			self.cache_file = self.global_params['cache']
+		else:
+			self.cache_file = False
+
+		if 'cache size' in self.mode_params:
+			self.CACHE_SIZE = float(self.mode_params['cache size'])
+		elif 'cache size' in self.global_params:
+			self.CACHE_SIZE = float(self.global_params['cache size'])
+		else:
+			self.CACHE_SIZE = 1024
+
+		self.result_cache = None
+		self.cached_calcs = {}
+
+		# Duplicate structures are only evaluated once (EMIN/SP/EOS). With a
+		# tolerance (Å), structures are compared using quantised coordinates 
+		# in a permutation invariant order
+		if 'duplicate tolerance' in self.mode_params:
+			self.DUPLICATE_TOLERANCE = float(self.mode_params['duplicate tolerance'])
+			self.deduplicate = True
+		elif 'deduplicate' in self.mode_params:
+			self.DUPLICATE_TOLERANCE = None
+			self.deduplicate = bool(self.mode_params['deduplicate'])
+		else:
+			self.DUPLICATE_TOLERANCE = None
+			self.deduplicate = False
+
+		self.duplicate_of = {}
+		self.atom_orders = {}
+
 		# Collect geometry variables and indices
 		if 'periodic' in self.global_params:
 			self.pbc = self.global_params['periodic']
@@ -78,8 +127,19 @@ class Configure(object):
 
 
 
-		# Generate atoms-object list from input structure(s)
-		self.atoms = self.load_structure(self.input_structure)
+		# Generate atoms-object list from input structure(s). Structures that
+		# have already been loaded (e.g. shared between jobs) are copied so
+		# that changes made by one run do not carry over to another.
+		if atoms is not None:
+			self.atoms = [a.copy() for a in atoms]
+		elif self.stream_input:
+			self.atoms = None
+		else:
+			self.atoms = self.load_structure(self.input_structure)
+
+		# A calculator that is already loaded (e.g. by a previous workflow
+		# stage) replaces the one named in the input
+		self.shared_calc = calc
 		#atoms = self.load_structure(self.input_structure)
 		#self.atoms = [
 		#	Atoms(
@@ -111,6 +171,9 @@ class Configure(object):
 				self.structures = -1
 				self.STRUCTURE_INDEX = -1
 				self.mode_params['structures'] = self.structures
+			elif self.atoms is None:
+				# All structures of a streamed input
+				self.structures = None
 			else:
 				self.structures = [_ for _ in range(len(self.atoms))]
 
@@ -122,28 +185,9 @@ class Configure(object):
 			self.mode_params['structures'] = self.structures
 
 
-		for i, a in enumerate(self.atoms):
+		for i, a in enumerate(self.atoms or []):
 			if i+1 in self.structures:
-
-				# Terminate if no cell size in input
-				try:
-					a.set_cell(self.size)
-				except:
-					# Would be neat to include structure-wise input parameters in
-					# the log/stdout next to each evaluation.
-					pass
-
-					#self.error_msg(
-					#	'CRITICAL ERROR',
-					#	'Input file contains no cell parameters!',
-					#	'Please set cell size (Å) manually by adding:',
-					#	'Global:\n  box size:  x y z',
-					#	'to the YAML input file.'
-					#)
-					#sys.exit()
-				
-				# Assing PBC status
-				a.set_pbc(self.pbc)
+				self.set_geometry(a)
 
 				# If first calculator cannot be assigned, raise error and terminate
 				#try:
@@ -159,29 +203,14 @@ class Configure(object):
 				#	sys.exit()
 
 
-		# If previous output exist, create new files datetime handle
-		if self.output_structure and (
-			os.path.exists(self.output_structure)):
-			
-			if self.overwrite:
-				os.remove(self.output_structure)
-			else:
-				# Adds datetime infor just before extension if filename is taken
-				ext = self.output_structure.split('.')[-1]
-				new_filename = self.output_structure.replace('.'+ext, '')
-				new_filename += '_'+time.strftime("%Y%m%d-%H%M%S")+'.'+ext
-
-				self.error_msg(
-					'Warning:',
-					f'Target output file {self.output_structure} already exist.',
-					f'Created a new outfile called {new_filename}'
-				)
+		# If previous output exist, create new files datetime handle. Resumed
+		# runs continue writing to their previous output.
+		if self.output_structure and (not self.mode_params.get('resume')):
+			new_filename = self.output_name(self.output_structure)
+			if new_filename != self.output_structure:
 				self.output_structure = new_filename
 				self.mode_params['output'] = self.output_structure
 
-		else:	
-			pass
-
 
 		# Input will only be read as a traj if name includes correct extension
 		# Otherwise it will be treated as a .pdb or .xyz file that may, or may
@@ -235,12 +264,108 @@ class Configure(object):
 		
 		# Logical test to see if specified handles are present in dataset
 		# Used for printing warnings		
-		info = [a.info.keys() for a in self.atoms]
+		info = [a.info.keys() for a in self.atoms or []]
 		self.handle_test = {(self.structure_handle in handle) for handle in info}
 		#######################################################################
 
 
 
+	def set_geometry(self, a):
+		"""Assigns the cell and PBC status from the input to a structure."""
+		# Terminate if no cell size in input
+		try:
+			a.set_cell(self.size)
+		except:
+			# Would be neat to include structure-wise input parameters in
+			# the log/stdout next to each evaluation.
+			pass
+
+			#self.error_msg(
+			#	'CRITICAL ERROR',
+			#	'Input file contains no cell parameters!',
+			#	'Please set cell size (Å) manually by adding:',
+			#	'Global:\n  box size:  x y z',
+			#	'to the YAML input file.'
+			#)
+			#sys.exit()
+		
+		# Assing PBC status
+		a.set_pbc(self.pbc)
+
+	def structure_hash(self, atoms):
+		"""Returns a hash of the elements, positions, cell and PBC of a
+		structure."""
+		return structure_hash(atoms)
+
+	def canonical_form(self, atoms):
+		"""Returns the hash of a structure together with the order of its 
+		atoms in the canonical form. Without a duplicate tolerance the hash is 
+		that of the exact structure and the order is None.
+
+		With a tolerance, the (wrapped) positions and the cell are rounded to 
+		multiples of the tolerance and the atoms are sorted by element and
+		rounded position. Near duplicates that are rounded to different sides
+		of a multiple are not detected."""
+		if not self.DUPLICATE_TOLERANCE:
+			return structure_hash(atoms), None
+
+		tolerance = self.DUPLICATE_TOLERANCE
+		positions = atoms.get_positions(wrap=bool(atoms.pbc.any()))
+		grid = np.round(positions/tolerance).astype(np.int64)
+		order = np.lexsort((grid[:,2], grid[:,1], grid[:,0], atoms.numbers))
+
+		h = hashlib.sha1()
+		h.update(np.ascontiguousarray(atoms.numbers[order], dtype=np.int64).tobytes())
+		h.update(np.ascontiguousarray(grid[order]).tobytes())
+		h.update(np.round(atoms.cell.array/tolerance).astype(np.int64).tobytes())
+		h.update(np.ascontiguousarray(atoms.pbc, dtype=bool).tobytes())
+		return h.hexdigest(), order
+
+	def find_duplicates(self, structures):
+		"""Pre-pass over (index, atoms) pairs that maps each duplicate 
+		structure to the index of its first occurrence, stored in 
+		self.duplicate_of."""
+		self.duplicate_of = {}
+		self.atom_orders = {}
+		if not self.deduplicate:
+			return
+
+		first = {}
+		orders = {}
+		total = 0
+		for i, a in structures:
+			total += 1
+			key, order = self.canonical_form(a)
+			if key in first:
+				self.duplicate_of[i] = first[key]
+				if order is not None:
+					self.atom_orders[i] = order
+					self.atom_orders[first[key]] = orders[key]
+			else:
+				first[key] = i
+				orders[key] = order
+
+		print(
+			f'Found {len(self.duplicate_of)} duplicates among {total} structures, '
+			f'{total-len(self.duplicate_of)} unique structures will be evaluated.'
+		)
+
+	def fan_out(self, array, representative, duplicate):
+		"""Returns a per-atom array of a representative structure in the 
+		atom order of its duplicate."""
+		array = np.asarray(array)
+		if duplicate not in self.atom_orders:
+			return array.copy()
+		out = np.empty_like(array)
+		out[self.atom_orders[duplicate]] = array[self.atom_orders[representative]]
+		return out
+
+	def results(self):
+		"""Returns a dataframe with one row of results per evaluated 
+		structure, collected in self.data during the run."""
+		import pandas as pd
+		return pd.DataFrame.from_dict(getattr(self, 'data', {}), orient='index')
+
 	def acquire_calc(self, filename='EMT'):
 		"""Method that acquires a chose calculator. If no argument is passed,
 		the method will arbitrarily choose the EMT calculator used for testing 
@@ -248,13 +373,56 @@ class Configure(object):
 
 		The calculator used for actual simulations should be defined
 		in a separate python script. To choose such a calculator, this method
-		should be passed with the name of the script as an argument."""
-		if filename == (None or 'EMT'):
-			calculator = EMT()
-		else:
-			calculator = __import__(filename).calculator
+		should be passed with the name of the script as an argument.
+
+		If a cache has been set, the calculator is wrapped so that results
+		are looked up in the cache before the calculator is called."""
+		if self.cache_file and self.cache_results and (filename in self.cached_calcs):
+			return self.cached_calcs[filename]
+
+		calculator = self.load_calc(filename)
+
+		if self.cache_file and self.cache_results:
+			if self.result_cache is None:
+				self.result_cache = ResultCache(self.cache_file, self.CACHE_SIZE)
+			calculator = CachedCalculator(
+				calculator,
+				self.result_cache,
+				calculator_identity(filename, calculator)
+			)
+			self.cached_calcs[filename] = calculator
 		return calculator
 
+	def load_calc(self, filename='EMT'):
+		"""Returns the chosen calculator without the cache wrapper, reusing 
+		the shared calculator if it has been given."""
+		if (self.shared_calc is not None) and (filename == self.calculator):
+			return self.shared_calc
+		elif filename == (None or 'EMT'):
+			return EMT()
+		return __import__(filename).calculator
+
+	def acquire_batch_calc(self, filename):
+		"""Returns the batch_calculator defined in a calculator script, or 
+		None if the script does not define one."""
+		if filename in (None, False, 'EMT'):
+			return None
+		return getattr(__import__(filename), 'batch_calculator', None)
+
+	def report_cache(self):
+		"""Prints (and logs) the hit/miss statistics of the calculator cache,
+		if one has been used."""
+		if self.result_cache is None:
+			return
+
+		print(self.result_cache.summary())
+		if getattr(self, 'log_file', None):
+			with open(self.log_file, 'a') as f:
+				print(self.result_cache.summary(), file=f)
+		self.result_cache.close()
+		self.result_cache = None
+		self.cached_calcs = {}
+
 	def load_structure(self, filename):
 		"""Reads input files and stores them in an iterable list."""
 		if 'traj' in self.input_structure:
@@ -283,6 +451,29 @@ class Configure(object):
 		temp = ekin/(1.5*units.kB)
 		print(f'Energy per atom: Epot: {epot:.4f} eV, Ekin: {ekin:.4f} eV (T: {temp:3.0f} K), Etot: {etot:.4} eV')
 
+	def output_name(self, filename):
+		"""Returns the name of an output file. A previous output with the same
+		name is removed if overwrite is set, otherwise a datetime handle is 
+		added to the new name."""
+		if not os.path.exists(filename):
+			return filename
+
+		if self.overwrite:
+			os.remove(filename)
+			return filename
+
+		# Adds datetime infor just before extension if filename is taken
+		ext = filename.split('.')[-1]
+		new_filename = filename.replace('.'+ext, '')
+		new_filename += '_'+time.strftime("%Y%m%d-%H%M%S")+'.'+ext
+
+		self.error_msg(
+			'Warning:',
+			f'Target output file {filename} already exist.',
+			f'Created a new outfile called {new_filename}'
+		)
+		return new_filename
+
 	def error_msg(self, *args):
 		"""Envelopes (and prints) error messages with lines and adds empty 
 		lines between each argument."""
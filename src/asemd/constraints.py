@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+import numpy as np
+
+from ase.constraints import FixBondLengths
+from ase.neighborlist import NeighborList, natural_cutoffs
+
+
+def find_hydrogen_bonds(atoms, scale=1.2):
+	"""Returns a list of index pairs [heavy, hydrogen] for all covalent bonds
+	between a hydrogen and a non-hydrogen atom. Atoms are considered bonded if
+	their distance is within scale times the sum of their covalent radii."""
+	cutoffs = natural_cutoffs(atoms, mult=scale)
+	nl = NeighborList(cutoffs, self_interaction=False, bothways=True)
+	nl.update(atoms)
+
+	numbers = atoms.get_atomic_numbers()
+	pairs = []
+	for h in np.where(numbers == 1)[0]:
+		neighbours, offsets = nl.get_neighbors(h)
+		for j in neighbours:
+			if numbers[j] != 1:
+				pairs.append([int(j), int(h)])
+	return pairs
+
+
+def repartition_hydrogen_mass(atoms, pairs, hydrogen_mass=3.024):
+	"""Hydrogen mass repartitioning. Sets the mass of every bonded hydrogen to
+	hydrogen_mass (amu) and subtracts the added mass from the heavy atom it is
+	bonded to, so that the total mass of each molecule is unchanged."""
+	masses = atoms.get_masses()
+	for heavy, h in pairs:
+		delta = hydrogen_mass - masses[h]
+		masses[h] += delta
+		masses[heavy] -= delta
+
+	if np.any(masses <= 0):
+		raise ValueError('Hydrogen mass repartitioning resulted in non-positive masses.')
+	atoms.set_masses(masses)
+
+
+def constrain_hydrogen_bonds(atoms, pairs, tolerance=1e-13):
+	"""Fixes the lengths of the given bonds at their current values. The
+	constraint is applied to positions and momenta using the iterative
+	SHAKE/RATTLE scheme of ase.constraints.FixBondLengths."""
+	remove_bond_constraints(atoms)
+	if len(pairs) == 0:
+		return
+	constraint = FixBondLengths(pairs, tolerance=tolerance)
+	atoms.set_constraint(atoms.constraints + [constraint])
+
+
+def remove_bond_constraints(atoms):
+	"""Removes the bond constraints of a structure, e.g. those set by a
+	previous MD stage, and keeps all other constraints."""
+	constraints = [c for c in atoms.constraints if not isinstance(c, FixBondLengths)]
+	if len(constraints) != len(atoms.constraints):
+		atoms.set_constraint(constraints)
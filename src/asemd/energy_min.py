@@ -13,13 +13,12 @@ from ase.io.trajectory import Trajectory
 from asemd.configure import Configure
 
 
-# Collects- and appends all local variables to the global variables
-# This is used to select arbitrary methods from strings using get(attr)
-# For example, global_vars is a dictionary where all modules imported as
-# 'from x import y' are found as {y:x}. Using global_vars.get(y)() is equivalent
-# to calling 'x.y()'.
-global_vars = globals().copy()
-global_vars.update(locals())
+# Mapping between optimiser input and ASE-object
+optimisers = {
+	'BFGS': BFGS,
+	'MDMin': MDMin,
+	'GPMin': GPMin
+}
 
 
 class EnergyMinimisation(Configure):
@@ -35,15 +34,42 @@ class EnergyMinimisation(Configure):
 			FMAX=None,
 			DUMP_INTERVAL=1,
 			log_file=None,
-			*args
+			*args,
+			**kwargs
 		):
-		super().__init__(*args)
+		super().__init__(*args, **kwargs)
 		self.optimiser = optimiser
 		self.STEPS = STEPS
 		self.FMAX = FMAX
 		self.DUMP_INTERVAL = DUMP_INTERVAL
 		self.log_file = log_file
 
+		# Final energy and force of each minimised structure
+		self.data = {}
+
+		# Two-stage minimisation, in which each structure is first relaxed 
+		# with a cheap calculator to a loose fmax before the main calculator
+		# takes over
+		if 'pre-relax calculator' in self.mode_params:
+			self.prerelax_calculator = self.mode_params['pre-relax calculator']
+		else:
+			self.prerelax_calculator = False
+
+		if 'pre-relax fmax' in self.mode_params:
+			self.PRERELAX_FMAX = float(self.mode_params['pre-relax fmax'])
+		else:
+			self.PRERELAX_FMAX = 0.5
+
+		if 'pre-relax steps' in self.mode_params:
+			self.PRERELAX_STEPS = int(self.mode_params['pre-relax steps'])
+		else:
+			self.PRERELAX_STEPS = None
+
+		# Steps and time spent in each stage of all structures
+		self.stage_totals = {
+			'Pre-relaxation':[0, datetime.timedelta()],
+			'Main stage':[0, datetime.timedelta()]
+		}
 
 
 		# NOT IMPLEMENTED
@@ -84,10 +110,18 @@ class EnergyMinimisation(Configure):
 				'This information may not appear in the stdout'
 			)
 
+		# Pre-pass that finds duplicate structures before any are minimised
+		self.find_duplicates(
+			(i, a) for i, a in enumerate(self.atoms) if i in self.structures
+		)
+
 		for i, a in enumerate(self.atoms):
 			# Removing this might cause slurm to not produce any output
 			print('', flush=True)
-			if i in self.structures:
+			if i in self.duplicate_of:
+				self.copy_duplicate(i, a)
+
+			elif i in self.structures:
 				self.printout = []
 
 				try:
@@ -102,18 +136,8 @@ class EnergyMinimisation(Configure):
 					)
 					sys.exit()
 
-				if len(self.atoms) > 1:
-					start = datetime.datetime.now()		
-
+				start = datetime.datetime.now()
 
-				# Initiate dynamic optimiser object
-				opt = global_vars.get(self.mode_params['optimiser'])
-				if self.log_file is None:
-					#self.dyn = opt(a, logfile='-')
-					self.dyn = opt(a)
-				else:	
-					self.dyn = opt(a, logfile=self.log_file)
-				
 
 				# Logging and saving
 				#if self.output_structure and 'traj' in self.output_structure:
@@ -122,12 +146,24 @@ class EnergyMinimisation(Configure):
 				
 				#self.structure_info(a)
 				#self.dyn.attach(self.print_energy, interval=self.DUMP_INTERVAL)
-				if self.output_structure:
+				if self.log_file:
 					with open(self.log_file, 'a') as f:
 						if i != 0:
 							print('', file=f)
 						print(f'Structure: {i+1} (of {len(self.atoms)})', file=f)
 
+				if self.prerelax_calculator:
+					prerelax_steps, prerelax_time = self.pre_relax(a)
+				main_start = datetime.datetime.now()
+
+				# Initiate dynamic optimiser object. It is created after the 
+				# pre-relaxation so that it starts from the pre-relaxed geometry
+				opt = optimisers.get(self.mode_params['optimiser'])
+				if self.log_file is None:
+					#self.dyn = opt(a, logfile='-')
+					self.dyn = opt(a)
+				else:	
+					self.dyn = opt(a, logfile=self.log_file)
 
 				# Run the minimisation
 				if (self.STEPS is None) and (self.FMAX is not None):
@@ -180,15 +216,31 @@ class EnergyMinimisation(Configure):
 				forces = (fx**2 + fy**2 + fz**2)**0.5
 				energy = a.get_potential_energy()
 				
+				end = datetime.datetime.now()
 				if len(self.atoms) > 1:
-					end = datetime.datetime.now()
 					print(f'Structure {i+1} of ({len(self.atoms)}) completed after {end-start}')
 
 				print(f'potential energy: {energy:.4f}')
 				print(f'max force: {max(forces):.4f}\n')
+
+				self.data[i+1] = {
+					'Potential energy [eV]':energy,
+					'Max. force [eV/Å]':max(forces)
+				}
+
+				self.stage_totals['Main stage'][0] += self.dyn.nsteps
+				self.stage_totals['Main stage'][1] += end-main_start
+				if self.prerelax_calculator:
+					print(f'Main stage: {self.dyn.nsteps} steps in {end-main_start}\n')
+					self.data[i+1].update({
+						'Pre-relax steps':prerelax_steps,
+						'Pre-relax time [s]':prerelax_time.total_seconds(),
+						'Steps':self.dyn.nsteps,
+						'Time [s]':(end-main_start).total_seconds()
+					})
 				
 
-				if self.output_structure:
+				if self.log_file:
 					with open(self.log_file, 'a') as f:
 						print(f'Completed after {end-start}\n', file=f)
 
@@ -197,6 +249,80 @@ class EnergyMinimisation(Configure):
 
 			del a.calc
 
+		if self.prerelax_calculator:
+			self.print_stage_summary()
+
+	def pre_relax(self, atoms):
+		"""Relaxes a structure with the pre-relaxation calculator until the
+		loose fmax has been reached. Returns the number of steps and the time
+		spent. The calculator of the structure is restored afterwards."""
+		calc = atoms.calc
+		try:
+			atoms.calc = self.acquire_calc(self.prerelax_calculator)
+		except:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Missing pre-relaxation calculator!',
+				'Select EMT or specify a python script that contains the calculator definition by including:',
+				'EMIN:\n  pre-relax calculator: EMT/name_of_script',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		start = datetime.datetime.now()
+		opt = optimisers.get(self.mode_params['optimiser'])
+		if self.log_file is None:
+			dyn = opt(atoms)
+		else:
+			with open(self.log_file, 'a') as f:
+				print(f'Pre-relaxation ({self.prerelax_calculator}):', file=f)
+			dyn = opt(atoms, logfile=self.log_file)
+
+		if self.PRERELAX_STEPS is None:
+			dyn.run(fmax=self.PRERELAX_FMAX)
+		else:
+			dyn.run(fmax=self.PRERELAX_FMAX, steps=self.PRERELAX_STEPS)
+		elapsed = datetime.datetime.now() - start
+		atoms.calc = calc
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('Main stage:', file=f)
+
+		self.stage_totals['Pre-relaxation'][0] += dyn.nsteps
+		self.stage_totals['Pre-relaxation'][1] += elapsed
+		print(f'Pre-relaxation: {dyn.nsteps} steps in {elapsed}')
+		return dyn.nsteps, elapsed
+
+	def print_stage_summary(self):
+		"""Prints (and logs) the steps and time spent in each stage of the
+		two-stage minimisation."""
+		out = [
+			f'{stage}: {steps} steps in {time}'
+			for stage, (steps, time) in self.stage_totals.items()
+		]
+		print('\n'.join(out))
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\n'.join(out), file=f)
+
+
+	def copy_duplicate(self, index, atoms):
+		"""Assigns the minimised geometry and results of the first occurrence
+		of a duplicate structure to the duplicate."""
+		rep = self.duplicate_of[index]
+		minimised = self.atoms[rep]
+		atoms.set_cell(minimised.get_cell())
+		atoms.set_positions(self.fan_out(minimised.get_positions(), rep, index))
+		self.data[index+1] = dict(self.data[rep+1])
+
+		print(f'Structure {index+1} is a duplicate of structure {rep+1}')
+		print(f'potential energy: {self.data[index+1]["Potential energy [eV]"]:.4f}\n')
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print(f'\nStructure: {index+1} (of {len(self.atoms)})', file=f)
+				print(f'Duplicate of structure {rep+1}\n', file=f)
 
 	def save_structure(self, a):
 		"""If an output filename has been given, the the output is saved to a
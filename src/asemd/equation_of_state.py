@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import os
+import shutil
 import datetime
 import numpy as np
 import pandas as pd
@@ -16,8 +17,8 @@ from asemd.configure import Configure
 
 class EquationState(Configure):
 	""" """
-	def __init__(self, log_file=False, *args):
-		super().__init__(*args)
+	def __init__(self, log_file=False, *args, **kwargs):
+		super().__init__(*args, **kwargs)
 		self.log_file = log_file
 
 		#self.attribute_map = {
@@ -49,10 +50,26 @@ class EquationState(Configure):
 
 	def run(self):
 		"""Evaluates an equation of state on the given set of structures."""
+		# Pre-pass that finds duplicate structures, which reuse the fit of 
+		# their first occurrence
+		self.find_duplicates(
+			(i, a) for i, a in enumerate(self.atoms) if i in self.structures
+		)
+
 		for i, a in enumerate(self.atoms):
 			# Removing this might cause slurm to not produce any output
 			print('', flush=True)
-			if i in self.structures:
+			if i in self.duplicate_of:
+				rep = self.duplicate_of[i]
+				self.data[i+1] = list(self.data[rep+1])
+				if self.output_structure:
+					shutil.copyfile(
+						self.output_structure.replace('.'+self.ext, f'_{rep}.traj'),
+						self.output_structure.replace('.'+self.ext, f'_{i}.traj')
+					)
+				print(f'Structure {i+1} is a duplicate of structure {rep+1}\n')
+
+			elif i in self.structures:
 
 				try:
 					a.calc = self.acquire_calc(self.calculator)
@@ -102,6 +119,11 @@ class EquationState(Configure):
 
 
 
+	def results(self):
+		"""Returns the fitted equation of state parameters of each evaluated
+		structure."""
+		return self.out
+
 	def size_variation(self, index, atoms):
 		""" """
 		if self.output_structure:
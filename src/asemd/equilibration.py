@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import collections
+import numpy as np
+
+
+class EquilibrationMonitor(object):
+	"""Keeps a rolling window of the temperature (and volume) of a structure
+	and tests whether they have settled.
+
+	The temperature is considered settled when its mean over the window is
+	within tolerance (relative) of the target temperature. The volume is
+	considered settled when the relative difference between the means of the
+	first and second half of the window is below tolerance."""
+	def __init__(self, atoms, window=100, tolerance=0.05, volume=False):
+		self.atoms = atoms
+		self.window = int(window)
+		self.tolerance = float(tolerance)
+		self.volume = volume
+
+		self.temperatures = collections.deque(maxlen=self.window)
+		self.volumes = collections.deque(maxlen=self.window)
+
+	def __call__(self):
+		"""Records the current temperature and volume."""
+		self.temperatures.append(self.atoms.get_temperature())
+		if self.volume:
+			self.volumes.append(self.atoms.get_volume())
+
+	def settled(self, temperature):
+		"""Returns True if the window is full and the temperature (and volume)
+		have settled."""
+		if len(self.temperatures) < self.window:
+			return False
+
+		mean = np.mean(self.temperatures)
+		if abs(mean - temperature) > self.tolerance*temperature:
+			return False
+
+		if self.volume:
+			half = self.window//2
+			volumes = np.array(self.volumes)
+			first, second = volumes[:half].mean(), volumes[half:].mean()
+			if abs(second - first) > self.tolerance*first:
+				return False
+
+		return True
+
+
+class StationarityMonitor(object):
+	"""Tests whether the temperature, potential energy and (optionally) the
+	volume of a running simulation are stationary over a rolling window.
+
+	The window is split into two halves, each of which is divided into blocks.
+	Block averaging reduces the effect of correlation between consecutive
+	samples, and the means of the two halves are compared using a t-statistic
+	based on the block standard error of the second half. The first half is
+	not used for the error estimate, since transients would inflate it. A 
+	series is considered stationary if the statistic is below threshold 
+	(roughly 2 for a 95% confidence level). All monitored series must be 
+	stationary for the structure to be considered equilibrated."""
+	def __init__(self, atoms, window=200, blocks=5, threshold=2.0, volume=False):
+		self.atoms = atoms
+		self.window = int(window)
+		self.blocks = int(blocks)
+		self.threshold = float(threshold)
+		self.volume = volume
+
+		if self.window//2 < 2*self.blocks:
+			raise ValueError(
+				f'The stationarity window must contain at least {4*self.blocks} samples.'
+			)
+
+		self.series = {
+			'temperature':collections.deque(maxlen=self.window),
+			'potential energy':collections.deque(maxlen=self.window),
+		}
+		if self.volume:
+			self.series['volume'] = collections.deque(maxlen=self.window)
+
+	def __call__(self):
+		"""Records the current state of the monitored quantities."""
+		self.series['temperature'].append(self.atoms.get_temperature())
+		self.series['potential energy'].append(self.atoms.get_potential_energy())
+		if self.volume:
+			self.series['volume'].append(self.atoms.get_volume())
+
+	def statistic(self, values):
+		"""Returns the t-statistic for the difference between the means of the
+		first and second half of a series."""
+		values = np.array(values)
+		half = len(values)//2
+		halves = [values[:half], values[half:2*half]]
+
+		means = []
+		for x in halves:
+			# Drops the remainder so that all blocks are of equal size
+			size = len(x)//self.blocks
+			block_means = x[:size*self.blocks].reshape(self.blocks, size).mean(axis=1)
+			means.append(block_means.mean())
+
+		# Standard error of the difference between two means with the
+		# (stationary) error of the second half
+		error = np.sqrt(2)*block_means.std(ddof=1)/np.sqrt(self.blocks)
+		difference = abs(means[1] - means[0])
+		if error == 0:
+			return 0.0 if difference == 0 else np.inf
+		return difference/error
+
+	def statistics(self):
+		"""Returns the t-statistic of each monitored series."""
+		return {key:self.statistic(val) for key, val in self.series.items()}
+
+	def stationary(self):
+		"""Returns True if the window is full and all series are stationary."""
+		if len(self.series['temperature']) < self.window:
+			return False
+		return all(t < self.threshold for t in self.statistics().values())
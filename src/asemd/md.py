@@ -8,20 +8,49 @@ from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
 from ase.io.trajectory import Trajectory
 from ase.md.verlet import VelocityVerlet
 from ase.md.langevin import Langevin
+from ase.md.nvtberendsen import NVTBerendsen
+from ase.md.bussi import Bussi
 from ase.md.npt import NPT
+from ase.md.nptberendsen import NPTBerendsen
 from ase.io import read, write
 from ase import units
 from ase.md import MDLogger
 
 from asemd.configure import Configure
+from asemd.async_writer import AsyncTrajectoryWriter
+from asemd.memmap_trajectory import MemmapTrajectory
+from asemd.compressed_trajectory import CompressedTrajectory
+from asemd.analysis import StreamingAnalysis
+from asemd.respa import RESPA
+from asemd.adaptive import AdaptiveTimeStep
+from asemd.constraints import find_hydrogen_bonds, repartition_hydrogen_mass, constrain_hydrogen_bonds
+from asemd.constraints import remove_bond_constraints
+from asemd.equilibration import EquilibrationMonitor, StationarityMonitor
+from asemd.batch_md import BatchedDynamics
 
-# Collects- and appends all local variables to the global variables
-# This is used to select arbitrary methods from strings using get(attr)
-# For example, global_vars is a dictionary where all modules imported as
-# 'from x import y' are found as {y:x}. Using global_vars.get(y)() is equivalent
-# to calling 'x.y()'.
-global_vars = globals().copy()
-global_vars.update(locals())
+# Mapping between class names and ASE dynamic objects
+integrators = {
+	'VelocityVerlet': VelocityVerlet,
+	'Langevin': Langevin,
+	'NVTBerendsen': NVTBerendsen,
+	'Bussi': Bussi,
+	'NPT': NPT,
+	'NPTBerendsen': NPTBerendsen
+}
+
+# Mapping between thermostat/barostat input and class name of each ASE-object
+thermostats = {
+	'langevin': 'Langevin',
+	'berendsen': 'NVTBerendsen',
+	'bussi': 'Bussi'
+}
+
+barostats = {
+	'npt': 'NPT',
+	'nosehoover': 'NPT',
+	'parrinellorahman': 'NPT',
+	'berendsen': 'NPTBerendsen'
+}
 
 
 class MolecularDynamics(Configure):
@@ -34,6 +63,8 @@ class MolecularDynamics(Configure):
 	simulation can be run by calling the run-method on the instance.
 
 	Logs and trajectories are saved if names for these have been provided."""
+	cache_results = False
+
 	def __init__(self,
 			STEPS,
 			TEMPERATURE,
@@ -44,9 +75,10 @@ class MolecularDynamics(Configure):
 			DUMP_INTERVAL,
 			external_stress,
 			log_file,
-			*args
+			*args,
+			**kwargs
 		):
-		super().__init__(*args)
+		super().__init__(*args, **kwargs)
 		self.STEPS = STEPS
 		self.TEMPERATURE = TEMPERATURE
 		self.TIME_STEP = TIME_STEP
@@ -64,9 +96,166 @@ class MolecularDynamics(Configure):
 		# Stores a set of dynamic objects for each atoms object.
 		self.dyns = []
 
+		# Final energies of each simulated structure
+		self.data = {}
+
+		# Interval at which the MD logger is called
+		self.log_interval = 1
+
+		# Adaptive time step (NVE/NVT), bounds are given in fs
+		if 'adaptive time step' in self.mode_params:
+			self.adaptive = bool(self.mode_params['adaptive time step'])
+		else:
+			self.adaptive = False
+
+		if self.adaptive:
+			self.adaptive_settings = {
+				'max_displacement':float(self.mode_params.get('max displacement', 0.05)),
+				'min_step':float(self.mode_params.get('min time step', 0.1*self.TIME_STEP)),
+				'max_step':float(self.mode_params.get('max time step', 4*self.TIME_STEP)),
+			}
+			if 'energy tolerance' in self.mode_params:
+				self.adaptive_settings['energy_tolerance'] = float(
+					self.mode_params['energy tolerance']
+				)
+
+		# Bond constraints and hydrogen mass repartitioning, which are applied
+		# to each structure before its dynamic object is built
+		if 'constrain hydrogens' in self.mode_params:
+			self.constrain_hydrogens = bool(self.mode_params['constrain hydrogens'])
+		else:
+			self.constrain_hydrogens = False
+
+		if 'constraint tolerance' in self.mode_params:
+			self.constraint_tolerance = float(self.mode_params['constraint tolerance'])
+		else:
+			self.constraint_tolerance = 1e-13
+
+		if 'hydrogen mass' in self.mode_params:
+			self.hydrogen_mass = float(self.mode_params['hydrogen mass'])
+		else:
+			self.hydrogen_mass = None
+
+		# Trajectory frames can be serialised by a background thread so that
+		# the integrator does not wait for the filesystem at every dump
+		if 'async output' in self.mode_params:
+			self.async_output = bool(self.mode_params['async output'])
+		else:
+			self.async_output = False
+
+		if 'output queue' in self.mode_params:
+			self.output_queue = int(self.mode_params['output queue'])
+		else:
+			self.output_queue = 8
+
+		# Quantisation used by compressed (.ctraj) outputs. Velocities are only
+		# stored if a velocity precision has been given
+		if 'output precision' in self.mode_params:
+			self.output_precision = float(self.mode_params['output precision'])
+		else:
+			self.output_precision = 1e-3
+
+		if 'velocity precision' in self.mode_params:
+			self.velocity_precision = float(self.mode_params['velocity precision'])
+		else:
+			self.velocity_precision = None
+
+		if 'keyframe interval' in self.mode_params:
+			self.keyframe_interval = int(self.mode_params['keyframe interval'])
+		else:
+			self.keyframe_interval = 100
+
+		# Thermostat (NVT) and barostat (NPT) selection
+		if 'thermostat' in self.mode_params:
+			self.thermostat = self.mode_params['thermostat']
+		else:
+			self.thermostat = 'Langevin'
+
+		if 'barostat' in self.mode_params:
+			self.barostat = self.mode_params['barostat']
+		else:
+			self.barostat = 'NPT'
+
+		if 'barostat timescale' in self.mode_params:
+			self.BAROSTAT_TIMESCALE = float(self.mode_params['barostat timescale'])
+		else:
+			self.BAROSTAT_TIMESCALE = 1000.0
+
+		# Compressibility (1/bar) used by the Berendsen barostat
+		if 'compressibility' in self.mode_params:
+			self.compressibility = float(self.mode_params['compressibility'])
+		else:
+			self.compressibility = 4.57e-5
+
+		# Optional equilibration phase that is run with a separate (usually
+		# fast) thermostat/barostat until temperature and volume have settled
+		if 'equilibration' in self.mode_params:
+			self.equilibration = self.mode_params['equilibration']
+		else:
+			self.equilibration = False
+
+		if 'equilibration steps' in self.mode_params:
+			self.EQUILIBRATION_STEPS = int(self.mode_params['equilibration steps'])
+		else:
+			self.EQUILIBRATION_STEPS = 10000
+
+		if 'equilibration window' in self.mode_params:
+			self.EQUILIBRATION_WINDOW = int(self.mode_params['equilibration window'])
+		else:
+			self.EQUILIBRATION_WINDOW = 100
+
+		if 'equilibration tolerance' in self.mode_params:
+			self.equilibration_tolerance = float(self.mode_params['equilibration tolerance'])
+		else:
+			self.equilibration_tolerance = 0.05
+
+		# Used to select the equilibration thermostat/barostat
+		self.ensemble = None
+
+		# Opt-in termination of a structure once it has equilibrated
+		if 'stop when equilibrated' in self.mode_params:
+			self.stop_when_equilibrated = bool(self.mode_params['stop when equilibrated'])
+		else:
+			self.stop_when_equilibrated = False
+
+		if 'stationarity window' in self.mode_params:
+			self.STATIONARITY_WINDOW = int(self.mode_params['stationarity window'])
+		else:
+			self.STATIONARITY_WINDOW = 200
+
+		if 'stationarity threshold' in self.mode_params:
+			self.stationarity_threshold = float(self.mode_params['stationarity threshold'])
+		else:
+			self.stationarity_threshold = 2.0
+
+		# Advances all selected structures together (NVE/NVT)
+		if 'batch' in self.mode_params:
+			self.batch = bool(self.mode_params['batch'])
+		else:
+			self.batch = False
+
+		# Starts from the momenta of the input structures (e.g. those of a 
+		# previous workflow stage) instead of drawing new ones
+		if 'keep velocities' in self.mode_params:
+			self.keep_velocities = bool(self.mode_params['keep velocities'])
+		else:
+			self.keep_velocities = False
+
+		# Streaming analysis (RDF, MSD, VACF) accumulated during the run
+		if 'analysis' in self.mode_params:
+			self.analysis_settings = {
+				key.lower():val for key, val in (self.mode_params['analysis'] or {}).items()
+			}
+		else:
+			self.analysis_settings = False
+
 
 	def run(self):
 		"""Runs a molecular dynamics simulation under a chosen ensemble."""
+		if self.batch:
+			self.run_batch()
+			return
+
 		for i, d in enumerate(self.dyns):
 			# Removing this might cause slurm to not produce any output
 			print('', flush=True)
@@ -90,22 +279,38 @@ class MolecularDynamics(Configure):
 					sys.exit()
 				
 				# Set initial velocities based on temperature
-				MaxwellBoltzmannDistribution(self.atoms_handle, temperature_K=self.TEMPERATURE)
+				if not self.carries_velocities(self.atoms_handle):
+					MaxwellBoltzmannDistribution(self.atoms_handle, temperature_K=self.TEMPERATURE)
 				
 				if len(self.atoms) > 1:
 					start = datetime.datetime.now()
 				print(f'Running structure: {i+1} (of {len(self.atoms)})')
 
+				# Fast equilibration before the production run
+				if self.equilibration:
+					self.equilibrate(self.atoms[i])
+
 				# Add output generator to dynamic object for info during run
 				d.attach(self.print_energy_wrapper, interval=self.DUMP_INTERVAL)
+
+				# Must be attached before the trajectory so that each frame 
+				# carries the time step that was used to reach it
+				if self.adaptive:
+					self.time_step_control = AdaptiveTimeStep(
+						d,
+						self.atoms[i],
+						**self.adaptive_settings
+					)
+					d.attach(self.time_step_control, interval=1)
 				
 				# Logging and trajectory saving
 				if self.output_structure:
 					traj_name = f'{i}_'+self.output_structure
-					self.traj = Trajectory(traj_name, 'w', self.atoms[i])
+					self.traj = self.open_trajectory(traj_name, self.atoms[i])
 					d.attach(self.traj.write, interval=self.DUMP_INTERVAL)
 					
-					# Logging
+				# Logging
+				if self.output_structure and self.log_file:
 					logger = MDLogger(
 						d,
 						self.atoms[i],
@@ -115,6 +320,7 @@ class MolecularDynamics(Configure):
 					)
 					d.attach(
 						logger,
+						interval=self.log_interval
 					)
 					
 					with open(self.log_file, 'a') as f:
@@ -123,8 +329,31 @@ class MolecularDynamics(Configure):
 						print(f'Structure: {i+1} (of {len(self.atoms)})', file=f)
 
 
+				# Streaming analysis
+				if self.analysis_settings:
+					self.analysis = self.attach_analysis(d, self.atoms[i])
+
 				# Running
-				d.run(steps=self.STEPS)
+				try:
+					if self.stop_when_equilibrated:
+						self.run_until_equilibrated(d, self.atoms[i])
+					else:
+						d.run(steps=self.STEPS)
+				finally:
+					# Flushes any frames still waiting to be written
+					if self.output_structure:
+						self.traj.close()
+
+				if self.analysis_settings:
+					self.save_analysis(i)
+
+				if isinstance(d, RESPA):
+					self.respa_summary(d)
+
+				if self.adaptive:
+					self.adaptive_summary()
+
+				self.data[i+1] = self.final_state(self.atoms[i])
 
 
 				if len(self.atoms) > 1:
@@ -142,7 +371,11 @@ class MolecularDynamics(Configure):
 	# Ensemble initialisation methods
 	def nve(self):
 		"""Sets up a dynamic object for a microcanonical ensemble simulation."""
+		self.ensemble = 'NVE'
+
 		for i, a in enumerate(self.atoms):
+			self.prepare_atoms(a)
+
 			# Initiate dynamic object
 			dyn = VelocityVerlet(
 				a,
@@ -153,41 +386,525 @@ class MolecularDynamics(Configure):
 
 	def nvt(self):
 		"""Sets up a dynamic object for a canonical ensemble simulation using
-		a Langevin thermostat."""
+		a Langevin (default), Berendsen or Bussi thermostat."""
+		self.ensemble = 'NVT'
+
 		for i, a in enumerate(self.atoms):
+			self.prepare_atoms(a)
+
 			# Initiate dynamic object
-			dyn = Langevin(
-				a,
-				timestep=self.TIME_STEP*units.fs,
-				temperature_K=self.TEMPERATURE,
-				friction=self.FRICTION
-			)
+			dyn = self.build_thermostat(self.thermostat, a)
 
 			self.dyns.append(dyn)
 
+	def run_batch(self):
+		"""Runs all selected structures together using a batched velocity 
+		Verlet (NVE) or Langevin (NVT) integrator on stacked arrays. A batch 
+		calculator is used if the calculator script defines one, and each 
+		structure is written to its own trajectory."""
+		if (self.ensemble not in ('NVE', 'NVT')) or (
+			self.ensemble == 'NVT' and self.acquire_method(
+				self.thermostat, thermostats, 'thermostat') != 'Langevin'):
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Batched MD is only supported in NVE and in NVT with a Langevin thermostat.',
+				'Remove batch from the YAML input file to run the structures one by one.'
+			)
+			sys.exit()
+
+		# The batched integrators work on stacked arrays without constraints,
+		# per-structure masses or time steps, or per-structure observers
+		unsupported = {
+			'constrain hydrogens':self.constrain_hydrogens,
+			'hydrogen mass':self.hydrogen_mass is not None,
+			'adaptive time step':self.adaptive,
+			'equilibration':bool(self.equilibration),
+			'stop when equilibrated':self.stop_when_equilibrated,
+			'analysis':bool(self.analysis_settings),
+		}
+		unsupported = [key for key, val in unsupported.items() if val]
+		if unsupported:
+			self.error_msg(
+				'CRITICAL ERROR',
+				f'Batched MD does not support: {", ".join(unsupported)}.',
+				'Remove these keys or batch from the YAML input file.'
+			)
+			sys.exit()
+
+		indices = [i for i in range(len(self.atoms)) if i in self.structures]
+		atoms_list = [self.atoms[i] for i in indices]
+
+		# Bond constraints of a previous stage are not carried over
+		for a in atoms_list:
+			remove_bond_constraints(a)
+		if any(a.constraints for a in atoms_list):
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Batched MD does not support structures with constraints.',
+				'Remove batch from the YAML input file to run the structures one by one.'
+			)
+			sys.exit()
+
+		batch_calc = self.acquire_batch_calc(self.calculator)
+		for a in atoms_list:
+			if batch_calc is None:
+				a.calc = self.acquire_calc(self.calculator)
+			if not self.carries_velocities(a):
+				MaxwellBoltzmannDistribution(a, temperature_K=self.TEMPERATURE)
+
+		dyn = BatchedDynamics(
+			atoms_list,
+			timestep=self.TIME_STEP*units.fs,
+			temperature_K=self.TEMPERATURE,
+			friction=(self.FRICTION if self.ensemble == 'NVT' else None),
+			batch_calculator=batch_calc
+		)
+		self.batch_dyn = dyn
+		dyn.attach(self.print_batch_wrapper, interval=self.DUMP_INTERVAL)
+
+		print(f'Running {len(atoms_list)} structures as a batch')
+		trajs = []
+		if self.output_structure:
+			for i, a in zip(indices, atoms_list):
+				traj = self.open_trajectory(f'{i}_'+self.output_structure, a)
+				dyn.attach(traj.write, interval=self.DUMP_INTERVAL)
+				trajs.append(traj)
+
+		try:
+			dyn.run(steps=self.STEPS)
+		finally:
+			for traj in trajs:
+				traj.close()
+
+		for a in atoms_list:
+			a.calc = None
+
+	def print_batch_wrapper(self):
+		"""Prints energies and temperatures averaged over a batch of 
+		structures."""
+		dyn = self.batch_dyn
+		epot = dyn.energies/dyn.sizes
+		ekin = dyn.kinetic_energies()/dyn.sizes
+		temp = dyn.temperatures()
+		out = (
+			f'Step: {dyn.nsteps}, mean energy per atom: Epot: {epot.mean():.4f} eV, '
+			f'Ekin: {ekin.mean():.4f} eV, Etot: {(epot + ekin).mean():.4} eV, '
+			f'T: {temp.mean():3.0f} K (min {temp.min():3.0f} K, max {temp.max():3.0f} K)'
+		)
+		print(out)
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print(out, file=f)
+
+	def build_thermostat(self, thermostat, atoms, temperature=None, rng=None):
+		"""Returns a canonical dynamic object using the named thermostat. 
+		Stochastic thermostats draw from rng if one is given."""
+		if temperature is None:
+			temperature = self.TEMPERATURE
+		name = self.acquire_method(thermostat, thermostats, 'thermostat')
+
+		if name == 'Langevin':
+			kwargs = {'friction':self.FRICTION}
+		else:
+			kwargs = {'taut':self.acquire_timescale()*units.fs}
+		if (rng is not None) and (name in ('Langevin', 'Bussi')):
+			kwargs['rng'] = rng
+
+		# The Bussi thermostat cannot be initialised without velocities
+		if (name == 'Bussi') and (atoms.get_kinetic_energy() == 0):
+			MaxwellBoltzmannDistribution(atoms, temperature_K=temperature, rng=rng)
+
+		return integrators[name](
+			atoms,
+			timestep=self.TIME_STEP*units.fs,
+			temperature_K=temperature,
+			**kwargs
+		)
+
 
 	def npt(self):
 		"""Sets up a dynamic object for an isobaric ensemble simulation using 
-		a Nosé-Hoover thermostat and a Parrinello-Rahman barostat."""
+		a Nosé-Hoover thermostat and a Parrinello-Rahman barostat (default) or
+		Berendsen pressure coupling."""
+		self.ensemble = 'NPT'
+		self.disable_adaptive()
+
+		# The NPT integrator does not support constraints
+		if self.constrain_hydrogens:
+			self.error_msg(
+				'Warning:',
+				'Bond constraints are not supported in NPT.',
+				'Bonds to hydrogen will not be constrained.'
+			)
+			self.constrain_hydrogens = False
+			self.mode_params['constrain hydrogens'] = self.constrain_hydrogens
+
+		if self.PFACTOR is not None:
+			self.PFACTOR = float(self.PFACTOR)
+
 		for i, a in enumerate(self.atoms):
-			print(self.PFACTOR, type(self.PFACTOR))
+			self.prepare_atoms(a)
+
+			dyn = self.build_barostat(self.barostat, a)
+
+			self.dyns.append(dyn)
+
+	def build_barostat(self, barostat, atoms):
+		"""Returns an isobaric dynamic object using the named barostat."""
+		name = self.acquire_method(barostat, barostats, 'barostat')
+
+		if name == 'NPT':
+			# Without a pfactor the NPT object runs an NVT ensemble
 			if self.PFACTOR is not None:
-				self.PFACTOR = float(self.PFACTOR)
+				pfactor = self.PFACTOR*units.GPa*(units.fs**2)
 			else:
-				pass
+				pfactor = None
 
-			dyn = NPT(
-				a,
+			return NPT(
+				atoms,
 				timestep=self.TIME_STEP*units.fs,
 				temperature_K=self.TEMPERATURE,
-				pfactor=self.PFACTOR*units.GPa*(units.fs**2),
-				ttime=self.CHARACTERSISTIC_TIMESCALE*units.fs,
+				pfactor=pfactor,
+				ttime=self.acquire_timescale()*units.fs,
 				externalstress = self.external_stress*units.bar
 			)
+		else:
+			return NPTBerendsen(
+				atoms,
+				timestep=self.TIME_STEP*units.fs,
+				temperature_K=self.TEMPERATURE,
+				pressure_au=self.isotropic_pressure()*units.bar,
+				taut=self.acquire_timescale()*units.fs,
+				taup=self.BAROSTAT_TIMESCALE*units.fs,
+				compressibility_au=self.compressibility/units.bar
+			)
+
+	def isotropic_pressure(self):
+		"""Returns the scalar pressure (bar) used by Berendsen pressure 
+		coupling. A stress tensor, which is positive in tension, is only 
+		accepted if it is hydrostatic, i.e. equal to (-p, -p, -p, 0, 0, 0)."""
+		stress = np.asarray(self.external_stress, dtype=float)
+		if stress.ndim == 0:
+			return float(stress)
+
+		if stress.size == 9:
+			stress = stress.reshape(3, 3)
+			diagonal = stress.diagonal()
+			shear = stress[~np.eye(3, dtype=bool)]
+		elif stress.size == 6:
+			diagonal, shear = stress[:3], stress[3:]
+		else:
+			diagonal, shear = None, None
+
+		if (diagonal is None) or np.any(shear != 0) or np.any(diagonal != diagonal[0]):
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Berendsen pressure coupling only supports a hydrostatic pressure.',
+				'Give the external stress as a single pressure, or select the NPT barostat by including:',
+				'NPT:\n  barostat: NPT',
+				'in the YAML input file.'
+			)
+			sys.exit()
+		return -float(diagonal[0])
+
+	def acquire_method(self, method, methods, kind):
+		"""Converts a thermostat/barostat name from the input to the name of
+		the corresponding ASE class. Terminates if the name is unknown."""
+		key = str(method).lower().replace(' ', '').replace('-', '').replace('é', 'e')
+		if key not in methods:
+			self.error_msg(
+				'CRITICAL ERROR',
+				f'Unknown {kind}: {method}',
+				f'Choose one of: {", ".join(methods.keys())}'
+			)
+			sys.exit()
+		return methods[key]
+
+	def acquire_timescale(self):
+		"""Thermostat timescale in fs. Defaults to 100 fs if none was given."""
+		if self.CHARACTERSISTIC_TIMESCALE is None:
+			return 100.0
+		return self.CHARACTERSISTIC_TIMESCALE
+
+	def run_until_equilibrated(self, dyn, atoms):
+		"""Runs a dynamic object for at most STEPS steps, but terminates as
+		soon as temperature, potential energy and (NPT) volume are stationary.
+		If the run stops early between two dump steps, the final frame is also
+		written to the trajectory."""
+		# Energies are only read where observers already read them
+		monitor = StationarityMonitor(
+			atoms,
+			window=self.STATIONARITY_WINDOW,
+			threshold=self.stationarity_threshold,
+			volume=(self.ensemble == 'NPT')
+		)
+		dyn.attach(monitor, interval=self.log_interval)
+
+		equilibrated = False
+		first = dyn.nsteps
+		for _ in dyn.irun(steps=self.STEPS):
+			steps = dyn.nsteps - first
+			if (steps > 0) and (steps % self.log_interval == 0) and monitor.stationary():
+				equilibrated = True
+				break
+
+		steps = dyn.nsteps - first
+		if equilibrated:
+			if self.output_structure and (steps % self.DUMP_INTERVAL != 0):
+				self.traj.write()
+			stats = ', '.join(f'{key}: {val:.2f}' for key, val in monitor.statistics().items())
+			out = [
+				f'Equilibrated after {steps} steps ({stats})',
+				f'Steps saved: {self.STEPS - steps} (of {self.STEPS})',
+			]
+		else:
+			out = [f'Not equilibrated after {steps} steps']
+		print('\n'.join(out))
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\n'.join(out), file=f)
+
+	def equilibrate(self, atoms):
+		"""Runs an equilibration phase using the equilibration thermostat 
+		(NVT) or barostat (NPT) until the temperature (and volume) have settled
+		or the maximum number of equilibration steps has been reached."""
+		if self.ensemble == 'NVT':
+			dyn = self.build_thermostat(self.equilibration, atoms)
+		elif self.ensemble == 'NPT':
+			dyn = self.build_barostat(self.equilibration, atoms)
+		else:
+			return
+
+		monitor = EquilibrationMonitor(
+			atoms,
+			window=self.EQUILIBRATION_WINDOW,
+			tolerance=self.equilibration_tolerance,
+			volume=(self.ensemble == 'NPT')
+		)
+		dyn.attach(monitor, interval=1)
+		dyn.attach(self.print_energy_wrapper, interval=self.DUMP_INTERVAL)
+
+		print(f'Equilibrating using: {self.equilibration}')
+		steps = 0
+		while steps < self.EQUILIBRATION_STEPS:
+			chunk = min(self.EQUILIBRATION_WINDOW, self.EQUILIBRATION_STEPS - steps)
+			dyn.run(steps=chunk)
+			steps += chunk
+			if monitor.settled(self.TEMPERATURE):
+				break
+
+		if monitor.settled(self.TEMPERATURE):
+			out = f'Equilibrated after {steps} steps'
+		else:
+			out = f'Not equilibrated after {steps} steps, continuing with production run'
+		print(out)
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print(out, file=f)
+
+	def respa(self):
+		"""Sets up a multiple time step (RESPA) dynamic object for a 
+		microcanonical ensemble simulation. A cheap fast calculator is evaluated
+		every time step and the expensive calculator every respa interval 
+		steps."""
+		if 'fast calculator' in self.mode_params:
+			fast_calculator = self.mode_params['fast calculator']
+		else:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'No fast calculator chosen!',
+				'Select a cheap calculator for the inner time steps by including:',
+				'RESPA:\n  fast calculator: EMT/name_of_script',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		if 'respa interval' in self.mode_params:
+			self.RESPA_INTERVAL = int(self.mode_params['respa interval'])
+		else:
+			self.RESPA_INTERVAL = 4
+			self.mode_params['respa interval'] = self.RESPA_INTERVAL
+
+		# Observers that read energies call the expensive calculator, so they
+		# are only allowed at the end of outer cycles
+		if self.DUMP_INTERVAL % self.RESPA_INTERVAL != 0:
+			interval = self.DUMP_INTERVAL
+			self.DUMP_INTERVAL += self.RESPA_INTERVAL - interval % self.RESPA_INTERVAL
+			self.error_msg(
+				'Warning:',
+				f'Dump interval ({interval}) is not a multiple of the respa interval.',
+				f'Dump interval has been set to {self.DUMP_INTERVAL}.'
+			)
+			self.mode_params['dump interval'] = self.DUMP_INTERVAL
+		self.log_interval = self.DUMP_INTERVAL
+
+		# The run must end with a complete outer cycle
+		if self.STEPS % self.RESPA_INTERVAL != 0:
+			steps = self.STEPS
+			self.STEPS += self.RESPA_INTERVAL - steps % self.RESPA_INTERVAL
+			self.error_msg(
+				'Warning:',
+				f'Number of steps ({steps}) is not a multiple of the respa interval.',
+				f'Number of steps has been set to {self.STEPS}.'
+			)
+			self.mode_params['steps'] = self.STEPS
+		self.disable_adaptive()
+
+		for i, a in enumerate(self.atoms):
+			self.prepare_atoms(a)
+
+			dyn = RESPA(
+				a,
+				timestep=self.TIME_STEP*units.fs,
+				fast_calculator=self.acquire_calc(fast_calculator),
+				interval=self.RESPA_INTERVAL
+			)
 
 			self.dyns.append(dyn)
 
 	# Auxillary methods
+	def carries_velocities(self, atoms):
+		"""Returns True if the momenta of a structure should be kept."""
+		return self.keep_velocities and atoms.get_momenta().any()
+
+	def final_state(self, atoms):
+		"""Returns energies per atom and temperature of a structure."""
+		epot = atoms.get_potential_energy()/len(atoms)
+		ekin = atoms.get_kinetic_energy()/len(atoms)
+		out = {
+			'Epot [eV/atom]':epot,
+			'Ekin [eV/atom]':ekin,
+			'Etot [eV/atom]':epot + ekin,
+			'T [K]':atoms.get_temperature()
+		}
+		if atoms.cell.rank == 3:
+			out['V [Å^3]'] = atoms.get_volume()
+		return out
+
+	def prepare_atoms(self, atoms):
+		"""Applies hydrogen mass repartitioning and X-H bond constraints (if
+		requested) to a structure before a dynamic object is built for it.
+		Bond constraints set by a previous stage are replaced."""
+		if not self.constrain_hydrogens:
+			remove_bond_constraints(atoms)
+
+		if (self.hydrogen_mass is None) and (self.constrain_hydrogens is False):
+			return
+
+		pairs = find_hydrogen_bonds(atoms)
+
+		if self.hydrogen_mass is not None:
+			repartition_hydrogen_mass(atoms, pairs, self.hydrogen_mass)
+
+		if self.constrain_hydrogens:
+			constrain_hydrogen_bonds(atoms, pairs, self.constraint_tolerance)
+
+		print(f'Bonds to hydrogen: {len(pairs)}')
+
+	def disable_adaptive(self):
+		"""Adaptive time steps are only supported in NVE and NVT."""
+		if self.adaptive:
+			self.error_msg(
+				'Warning:',
+				'Adaptive time steps are only supported in NVE and NVT.',
+				'A fixed time step will be used.'
+			)
+			self.adaptive = False
+			self.mode_params['adaptive time step'] = self.adaptive
+
+	def adaptive_summary(self):
+		"""Prints (and logs) the time steps used in an adaptive run."""
+		out = self.time_step_control.summary()
+		print('\n'.join(out))
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\n'.join(out), file=f)
+
+	def respa_summary(self, dyn):
+		"""Prints (and logs) the energy drift and the estimated speed-up of a
+		RESPA run relative to VelocityVerlet with the expensive calculator."""
+		out = [
+			f'Expensive calculator calls: {dyn.slow_calls} (VelocityVerlet: {dyn.nsteps})',
+			f'Fast calculator calls: {dyn.fast_calls}',
+			f'Energy drift: {dyn.energy_drift():.3e} eV/atom/ps',
+			f'Estimated speed-up: {dyn.speed_up():.2f}',
+		]
+		print('\n'.join(out))
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\n'.join(out), file=f)
+
+	def attach_analysis(self, dyn, atoms):
+		"""Attaches streaming analysis accumulators to a dynamic object."""
+		if 'interval' in self.analysis_settings:
+			interval = int(self.analysis_settings['interval'])
+		else:
+			interval = 1
+
+		# Elapsed simulated time (fs), which the adaptive controller (called
+		# before the analysis) keeps track of if the time step varies
+		if self.adaptive:
+			control = self.time_step_control
+			clock = lambda: control.simulated_time
+		else:
+			clock = lambda: dyn.get_time()/units.fs
+
+		analysis = StreamingAnalysis(
+			self.analysis_settings,
+			atoms,
+			interval=interval,
+			clock=clock
+		)
+		dyn.attach(analysis.update, interval=interval)
+		return analysis
+
+	def save_analysis(self, index):
+		"""Saves the results of the streaming analysis of a structure as a
+		compressed NumPy archive named after the structure index."""
+		results = self.analysis.results()
+		summary = [key for key in results if ' ' not in key]
+		print(f'Analysis: {", ".join(summary)}')
+
+		if self.analysis_settings.get('output'):
+			filename = f'{index}_'+self.analysis_settings['output']
+			self.analysis.save(filename)
+			print(f'Analysis results saved to: {filename}')
+
+	def open_trajectory(self, filename, atoms):
+		"""Opens a trajectory writer for the given atoms object. If async 
+		output has been enabled in the input, frames are copied at dump time
+		and written by a background thread.
+
+		Outputs with the .mmap extension are written as columnar memory-mapped
+		trajectories that are pre-allocated for all frames of the run, whereas
+		.ctraj outputs are quantised and compressed."""
+		if filename.endswith('.mmap'):
+			# The dynamic object dumps at step 0 and every DUMP_INTERVAL after.
+			# A run that stops when equilibrated may add its final frame
+			frames = self.STEPS//self.DUMP_INTERVAL + 1
+			if self.stop_when_equilibrated:
+				frames += 1
+			traj = MemmapTrajectory(filename, 'w', atoms, frames=frames)
+		elif filename.endswith('.ctraj'):
+			traj = CompressedTrajectory(
+				filename,
+				'w',
+				atoms,
+				precision=self.output_precision,
+				velocity_precision=self.velocity_precision,
+				keyframe_interval=self.keyframe_interval
+			)
+		else:
+			traj = Trajectory(filename, 'w', atoms)
+		if self.async_output:
+			traj = AsyncTrajectoryWriter(traj, atoms, self.output_queue)
+		return traj
+
 	def print_energy_wrapper(self):
 		"""Wrapper function that allows self.print_energy to be attached to 
 		dynamic objects within a loop."""
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+import os
+import json
+import numpy as np
+
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+class MemmapTrajectory(object):
+	"""Columnar trajectory format built from pre-allocated NumPy memory maps.
+
+	A trajectory is a directory that contains a small JSON header together with
+	one .npy file per column:
+		- positions [frames, atoms, 3]
+		- momenta [frames, atoms, 3]
+		- cell [frames, 3, 3]
+		- energy [frames] (potential energy)
+		- kinetic [frames] (kinetic energy)
+
+	All columns are allocated with a fixed shape when the trajectory is opened
+	for writing, so every frame is written as a single copy per column. When
+	opened for reading the columns are memory-mapped, allowing analysis
+	scripts to slice frames without loading or copying the full trajectory,
+	e.g. MemmapTrajectory('nve.mmap').positions[::10].
+
+	Methods:
+	write: Writes the current state of an atoms object as the next frame.
+	close: Flushes the columns to disk and updates the header."""
+	columns = {
+		'positions':lambda n: (n, 3),
+		'momenta':lambda n: (n, 3),
+		'cell':lambda n: (3, 3),
+		'energy':lambda n: (),
+		'kinetic':lambda n: (),
+	}
+
+	def __init__(self, filename, mode='r', atoms=None, frames=None, dtype='float64'):
+		self.filename = filename
+		self.mode = mode
+		self.atoms = atoms
+		self.header_file = os.path.join(self.filename, 'header.json')
+
+		if self.mode == 'w':
+			if (atoms is None) or (frames is None):
+				raise ValueError('Both atoms and number of frames are required when writing.')
+			self.open_write(atoms, int(frames), dtype)
+		elif self.mode == 'r':
+			self.open_read()
+		else:
+			raise ValueError(f'Unsupported mode: {self.mode}')
+
+	def open_write(self, atoms, frames, dtype):
+		"""Allocates all columns on disk with room for the given number of
+		frames."""
+		os.makedirs(self.filename, exist_ok=True)
+		self.header = {
+			'format':'asemd-memmap',
+			'version':1,
+			'frames':0,
+			'capacity':frames,
+			'natoms':len(atoms),
+			'numbers':atoms.get_atomic_numbers().tolist(),
+			'masses':atoms.get_masses().tolist(),
+			'pbc':atoms.get_pbc().tolist(),
+			'dtype':np.dtype(dtype).str,
+			'columns':list(self.columns.keys()),
+		}
+
+		self.data = {}
+		for name, shape in self.columns.items():
+			self.data[name] = np.lib.format.open_memmap(
+				os.path.join(self.filename, f'{name}.npy'),
+				mode='w+',
+				dtype=dtype,
+				shape=(frames,)+shape(len(atoms))
+			)
+		self.write_header()
+
+	def open_read(self):
+		"""Memory-maps all columns in read-only mode. Only frames that have
+		been written are exposed."""
+		with open(self.header_file, 'r') as f:
+			self.header = json.load(f)
+
+		frames = self.header['frames']
+		self.data = {}
+		for name in self.header['columns']:
+			column = np.load(
+				os.path.join(self.filename, f'{name}.npy'),
+				mmap_mode='r'
+			)
+			self.data[name] = column[:frames]
+
+	def write(self, atoms=None):
+		"""Writes a frame. Each column is filled using one array copy."""
+		if self.mode != 'w':
+			raise ValueError('Trajectory is not opened for writing.')
+		if atoms is None:
+			atoms = self.atoms
+
+		index = self.header['frames']
+		if index >= self.header['capacity']:
+			raise IndexError(
+				f'Trajectory {self.filename} is full ({index} frames).'
+			)
+
+		self.data['positions'][index] = atoms.positions
+		self.data['momenta'][index] = atoms.get_momenta()
+		self.data['cell'][index] = atoms.cell.array
+		self.data['energy'][index] = atoms.get_potential_energy()
+		self.data['kinetic'][index] = atoms.get_kinetic_energy()
+		self.header['frames'] += 1
+
+	def write_header(self):
+		"""Writes the JSON header."""
+		with open(self.header_file, 'w') as f:
+			json.dump(self.header, f, indent=1)
+
+	def close(self):
+		"""Flushes written frames and records the number of frames in the
+		header."""
+		if self.mode == 'w':
+			for column in self.data.values():
+				column.flush()
+			self.write_header()
+
+	def __getattr__(self, name):
+		# Exposes columns as attributes, e.g. traj.positions
+		if name in self.__dict__.get('data', {}):
+			return self.data[name]
+		raise AttributeError(name)
+
+	def __len__(self):
+		return self.header['frames']
+
+	def __getitem__(self, index):
+		"""Returns frame(s) as atoms objects with energies attached."""
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError('Trajectory index out of range.')
+
+		atoms = Atoms(
+			numbers=self.header['numbers'],
+			positions=np.array(self.data['positions'][index]),
+			cell=np.array(self.data['cell'][index]),
+			pbc=self.header['pbc'],
+			masses=self.header['masses'],
+			momenta=np.array(self.data['momenta'][index])
+		)
+		atoms.calc = SinglePointCalculator(
+			atoms,
+			energy=float(self.data['energy'][index])
+		)
+		return atoms
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+
+import sys
+import importlib
+import numpy as np
+
+
+# Mapping between input mode and class name for each relevant ASE-object
+ensemble_methods = {
+	'NVE': 'VelocityVerlet',
+	'NVT': 'Langevin',
+	'NPT': 'NPT',
+	'RESPA': 'RESPA',
+	'REMD': 'Langevin'
+}
+
+modes = {
+	'EMIN':'Energy minimisation',
+	'SP':'Single point energy calculation',
+	'EOS':'Equation of state',
+	'NVE':'Microcanonical ensemble',
+	'NVT':'Canonical ensemble',
+	'NPT':'Isobaric ensemble',
+	'RESPA':'Microcanonical ensemble (multiple time step)',
+	'REMD':'Replica exchange (parallel tempering)',
+	'WORKFLOW':'Multi-stage workflow',
+	'CH':'Changes structure headers',
+}
+
+# Module implementing each mode. Modules are only imported once their mode
+# has been selected, since each of them pulls in a different part of ASE.
+mode_modules = {
+	'EMIN':'asemd.energy_min',
+	'SP':'asemd.single_point',
+	'EOS':'asemd.equation_of_state',
+	'NVE':'asemd.md',
+	'NVT':'asemd.md',
+	'NPT':'asemd.md',
+	'RESPA':'asemd.md',
+	'REMD':'asemd.remd',
+	'WORKFLOW':'asemd.workflow',
+}
+
+
+def import_mode(mode):
+	"""Imports and returns the module implementing a mode."""
+	return importlib.import_module(mode_modules[mode])
+
+
+def initialise(
+		mode,
+		mode_input,
+		global_input,
+		input_structure,
+		output_structure,
+		log_file,
+		**kwargs
+	):
+	"""Creates the setup object of a mode from its input parameters. CLI
+	arguments are expected to have been merged into mode_input beforehand.
+	Keyword arguments are passed on to the Configure base class."""
+	# Shared variables
+	if 'steps' in mode_input:
+		STEPS = int(mode_input['steps'])
+	else:
+		STEPS = None
+
+	if 'dump interval' in mode_input:
+		DUMP_INTERVAL = int(mode_input['dump interval'])
+	else:
+		DUMP_INTERVAL = 1
+
+	# ENERGY MINIMISATION
+	if mode == 'EMIN':
+		if mode_input.get('optimiser'):
+			optimiser = mode_input['optimiser']
+		else:
+			print('No optimiser chosen!')
+			print('''Select optimiser by including:\n  optimiser: BFGS/MDMin/GPMin\nin the YAML input file.''')
+			sys.exit()
+
+		if 'fmax' in mode_input:
+			FMAX = float(mode_input['fmax'])
+		else:
+			FMAX = None
+
+		# Initialise an energy minimisation object
+		emin = import_mode(mode)
+		setup = emin.EnergyMinimisation(
+			optimiser,
+			STEPS,
+			FMAX,
+			DUMP_INTERVAL,
+			log_file,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			**kwargs
+		)
+
+	# SINGLE POINT EVALUATION
+	elif mode == 'SP':
+		# Initiate a single point caluclation object
+		sp = import_mode(mode)
+		setup = sp.SinglePoint(
+			log_file,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			**kwargs
+		)
+
+	# EQUATION OF STATE
+	elif mode == 'EOS':
+		# Initiate a equation of state object
+		eos = import_mode(mode)
+		setup = eos.EquationState(
+			log_file,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			**kwargs
+		)
+
+	# ENSEMBLES
+	elif mode in ensemble_methods.keys():
+		if 'temperature' in mode_input:
+			TEMPERATURE = float(mode_input['temperature'])
+		else:
+			TEMPERATURE = None
+
+		if 'time step' in mode_input:
+			TIME_STEP = float(mode_input['time step'])
+		else:
+			TIME_STEP = None
+
+		if 'friction' in mode_input:
+			FRICTION = float(mode_input['friction'])
+		else:
+			FRICTION = None
+
+		if 'pfactor' in mode_input:
+			PFACTOR = mode_input['pfactor']
+		else:
+			PFACTOR = None
+
+		if 'external stress' in mode_input:
+			external_stress = mode_input['external stress']
+		else:
+			external_stress = 0
+
+		# A single value is a scalar pressure, otherwise a stress tensor is
+		# given as space separated components
+		external_stress = [float(s) for s in str(external_stress).split()]
+		if len(external_stress) > 1:
+			external_stress = np.array(external_stress)
+		else:
+			external_stress = external_stress[0]
+
+		if 'thermostat timescale' in mode_input:
+			CHARACTERSISTIC_TIMESCALE = float(mode_input['thermostat timescale'])
+		else:
+			CHARACTERSISTIC_TIMESCALE = None
+
+		# Replica exchange runs a ladder of canonical ensembles
+		if mode == 'REMD':
+			ensemble = import_mode(mode).ReplicaExchange
+		else:
+			ensemble = import_mode(mode).MolecularDynamics
+
+		# Initiate molecular dynamics object
+		setup = ensemble(
+			STEPS,
+			TEMPERATURE,
+			TIME_STEP,
+			FRICTION,
+			PFACTOR,
+			CHARACTERSISTIC_TIMESCALE,
+			DUMP_INTERVAL,
+			external_stress,
+			log_file,
+			mode_input,
+			global_input,
+			input_structure,
+			output_structure,
+			**kwargs
+		)
+
+		if mode == 'NVE':
+			setup.nve()
+
+		elif mode == 'NVT':
+			setup.nvt()
+
+		elif mode == 'NPT':
+			setup.npt()
+
+		elif mode == 'RESPA':
+			setup.respa()
+
+		elif mode == 'REMD':
+			setup.remd()
+
+	else:
+		raise ValueError(f'Unknown mode: {mode}')
+
+	return setup
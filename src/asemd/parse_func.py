@@ -1,7 +1,6 @@
 #!/usr/bin/python
 
 import argparse
-from importlib.metadata import version
 
 # Indentation with two spaces will result in a match with argparse in general
 desc = f'''To run this script, call e.g.,
@@ -66,11 +65,26 @@ GLOBAL INPUT:
   overwrite:            Boolean for wheter or not outputs should overwrite 
                         previous files with the same name.
   log path:             Path to log file.
+  cache:                SQLite file in which calculator results are cached 
+                        (EMIN/SP/EOS). Identical structures evaluated with the
+                        same calculator are then read from the cache. May also
+                        be set per mode.
+  cache size:           Largest size (MB) of the cache before the least 
+                        recently used results are removed. Default is 1024.
 
 MODE INPUT:
   optimiser:            Minimisation optimiser. Choose between BFGS, GPMin or 
                         MDMin.
-  output:               Name of output file with extention.
+  pre-relax calculator: Cheap calculator (EMT or script) with which EMIN first
+                        relaxes each structure to the pre-relax fmax, before 
+                        the main calculator finishes the minimisation.
+  pre-relax fmax:       Loose force criterion (eV/Å) of the pre-relaxation. 
+                        Default is 0.5.
+  pre-relax steps:      Largest number of pre-relaxation steps.
+  output:               Name of output file with extention. MD trajectories 
+                        named *.mmap are written as directories of memory-mapped
+                        NumPy columns (positions, momenta, cell, energies).
+                        Trajectories named *.ctraj are quantised and compressed.
   temperature:          Specifies the temperature in Kelvin used in simulations.
   time step:            Width of the time step in fs.
   steps:                Number of simulation steps.
@@ -82,26 +96,147 @@ MODE INPUT:
                         (NVT).
   pfactor:              The pressure factor used for a parrinello-Rahman 
                         barostat (NPT).
-  external stress:      External stress tensor used in NPT ensembles.
+  external stress:      External stress tensor used in NPT ensembles. The
+                        Berendsen barostat only accepts a single pressure or
+                        a hydrostatic tensor.
   thermostat timescale: Characteristic timescale of a Nosé-Hoover thermostat 
                         (NPT).
   range:                The range used when fitting an eauation of state. Set 
                         start stop and num-points.
   method:               The equation of state method. Default is Birch-Murnaghan.
+  async output:         Boolean that lets a background thread write MD 
+                        trajectory frames so that the integrator does not wait 
+                        for the filesystem (NVE/NVT/NPT).
+  output queue:         Maximum number of frames waiting to be written when
+                        async output is used. Default is 8.
+  output precision:     Precision (Å) of positions stored in .ctraj outputs.
+                        Default is 0.001.
+  velocity precision:   Precision (Å/fs) of velocities stored in .ctraj outputs.
+                        Velocities are only stored if this is set.
+  keyframe interval:    Number of frames between full (non-delta) frames in
+                        .ctraj outputs. Default is 100.
+  analysis:             Streaming analysis during MD. Indented settings:
+                          interval: steps between updates (default 1)
+                          output: name of .npz file with results
+                          rdf: indented rmax (Å) and bins
+                          msd: indented window (number of updates)
+                          vacf: indented window (number of updates)
+                        Trajectory output may be left out when this is used.
+  fast calculator:      Cheap calculator evaluated every time step in RESPA. 
+                        The expensive correction uses the regular calculator.
+  respa interval:       Number of fast time steps per expensive force 
+                        evaluation (RESPA). Default is 4.
+  adaptive time step:   Boolean that lets the time step adapt during NVE/NVT 
+                        runs. The time step is written to each frame.
+  max displacement:     Target for the largest per-atom displacement (Å) per
+                        step with adaptive time steps. Default is 0.05.
+  energy tolerance:     Largest allowed change in total energy per atom (eV)
+                        per step with adaptive time steps (NVE).
+  min time step:        Lower bound for adaptive time steps (fs).
+  max time step:        Upper bound for adaptive time steps (fs).
+  constrain hydrogens:  Boolean that fixes the lengths of all bonds to hydrogen
+                        using RATTLE (NVE/NVT/RESPA).
+  constraint tolerance: Convergence tolerance of the bond constraints.
+  hydrogen mass:        Mass (amu) assigned to hydrogens bonded to heavy atoms.
+                        The added mass is taken from the bonded heavy atom.
+  thermostat:           Thermostat used in NVT. Choose between Langevin 
+                        (default), Berendsen or Bussi. Berendsen and Bussi use
+                        the thermostat timescale (default 100 fs).
+  barostat:             Barostat used in NPT. Choose between NPT (Nosé-Hoover/
+                        Parrinello-Rahman, default) or Berendsen.
+  barostat timescale:   Pressure coupling timescale of the Berendsen barostat
+                        (fs). Default is 1000.
+  compressibility:      Compressibility (1/bar) used by the Berendsen barostat.
+                        Default is 4.57e-5 (water).
+  equilibration:        Thermostat (NVT) or barostat (NPT) used in a separate
+                        equilibration phase before the production run, e.g. 
+                        Berendsen.
+  equilibration steps:  Maximum number of equilibration steps. Default is 10000.
+  equilibration window: Number of steps over which temperature (and volume) 
+                        must have settled. Default is 100.
+  equilibration tolerance: Relative tolerance used to decide whether 
+                        temperature and volume have settled. Default is 0.05.
+  stop when equilibrated: Boolean that ends the MD run of a structure once the
+                        temperature, potential energy and (NPT) volume are 
+                        stationary. The final frame is always written.
+  stationarity window:  Number of samples in the rolling window used to test 
+                        for stationarity. Default is 200.
+  stationarity threshold: Largest t-statistic between the means of the two
+                        halves of the window. Default is 2.0.
+  batch:                Boolean that advances all selected structures together
+                        on stacked arrays (NVE, and NVT with Langevin). If the
+                        calculator script defines batch_calculator(atoms_list),
+                        returning energies and forces, it is used for all 
+                        structures at once. Constraints, hydrogen mass, 
+                        adaptive time steps, equilibration and analysis are 
+                        not supported.
+  temperatures:         Temperature ladder (K) used in REMD, e.g. 300 330 360.
+                        Each replica runs in its own process.
+  exchange interval:    Number of steps between replica exchange attempts 
+                        (REMD). Default is 100.
+  seed:                 Integer from which independent random streams are 
+                        spawned for each REMD replica and each sweep job. 
+                        Default is fresh entropy.
+  sweep:                Runs the mode for every combination of the indented 
+                        parameters, e.g. temperature: 300 400 500. Each job
+                        gets its own output, log and standard output file
+                        (<name>_job<n>, <log>_job<n>.out).
+  workers:              Number of sweep jobs run in parallel. Default is the
+                        number of cores.
+  resume:               Boolean that lets SP continue the run that wrote to the
+                        same output, using the progress manifest stored next 
+                        to it (<output>.progress).
+  store:                Directory to which SP also writes its results as a 
+                        columnar binary store, which can be memory-mapped by
+                        asemd.results_store.ResultStore.
+  statistics:           Boolean, or indented settings, that lets SP accumulate 
+                        dataset statistics (mean, std, percentiles and 
+                        histograms of energy per atom, per-atom energies and
+                        force norms, also per element) during the run:
+                          output: name of .json or .npz summary file
+                          bins: number of histogram bins (default 200)
+                        Structures labelled by a resumed run are read back 
+                        from its output.
+  screen calculator:    Cheap calculator (EMT or script) with which SP first 
+                        evaluates all structures, in batches if the script 
+                        defines batch_calculator. Only structures that pass 
+                        all set screening rules are evaluated with the main
+                        calculator.
+  screen energy window: Largest energy per atom (eV) above the lowest screened
+                        structure of the same composition.
+  screen top k:         Number of lowest energy structures kept per 
+                        composition.
+  screen fmax:          Largest screened force (eV/Å) of kept structures.
+  screen batch size:    Number of structures per screening batch. Default is 
+                        64.
+  deduplicate:          Boolean that lets SP, EMIN and EOS evaluate identical 
+                        structures only once. Duplicates are given the results
+                        of their first occurrence.
+  duplicate tolerance:  Distance (Å) within which positions and cell vectors
+                        are treated as equal when finding duplicates, in any
+                        atom order. Implies deduplicate.
+  keep velocities:      Boolean that starts MD from the velocities of the input
+                        structures instead of drawing new ones.
+  stages:               Modes run in sequence by WORKFLOW, e.g. EMIN NVT NPT. 
+                        Each stage uses the section of its mode, and structures
+                        and calculators are kept in memory between stages. 
+                        Only stages with an output write files.
 '''
 
 # These statements are indented in the console and should break lines after
 # only 56 characters.
 #-------------------------------------------------------
-version_help = f'\
-asemd ver. {version("asemd")}'
+version_help = '''\
+Prints the installed version.'''
 #-------------------------------------------------------
 test_help = '''\
 This flag hinders all output files and is only used for
 testing.'''
 #-------------------------------------------------------
 mode_help = '''\
-Sets the run-mode to EMIN, SP, EOS, NVE, NVT or NPT.'''
+Sets the run-mode to EMIN, SP, EOS, NVE, NVT, NPT, 
+RESPA, REMD or WORKFLOW. SERVE starts a server that runs
+jobs submitted using --server.'''
 #-------------------------------------------------------
 config_help = '''\
 Assigns a file with input paramters written in YAML
@@ -164,6 +299,29 @@ stress_help = '''\
 Overrides the external stress tensor used in the NPT
 ensemble.'''
 #-------------------------------------------------------
+resume_help = '''\
+Continues an interrupted SP run, skipping the structures
+that were already written to its output.'''
+#-------------------------------------------------------
+server_help = '''\
+Submits the run to a server started using asemd SERVE,
+which keeps ASE and the calculators loaded between runs.'''
+#-------------------------------------------------------
+socket_help = '''\
+Unix socket used by asemd SERVE and --server. Default is
+asemd-<uid>.sock in the temporary directory.'''
+#-------------------------------------------------------
+
+
+class VersionAction(argparse.Action):
+	"""Prints the installed version. The version is only looked up when
+	asked for, since reading package metadata slows down start-up."""
+	def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+		super().__init__(option_strings, dest=dest, default=argparse.SUPPRESS, nargs=0, help=help)
+
+	def __call__(self, parser, namespace, values, option_string=None):
+		from importlib.metadata import version
+		parser.exit(message=f'asemd ver. {version("asemd")}\n')
 
 
 def create_parser():
@@ -175,8 +333,8 @@ def create_parser():
 	)
 	parser.add_argument(
 		'--version',
-		action='version',
-		version=version_help
+		action=VersionAction,
+		help=version_help
 	)
 	
 	# Define arguments/flags for running program
@@ -188,12 +346,14 @@ def create_parser():
 	parser.add_argument(
 		'mode',
 		metavar='mode',
-		choices=['EMIN', 'SP', 'EOS', 'NVE', 'NVT', 'NPT', 'CH'],
+		type=str.upper,
+		choices=['EMIN', 'SP', 'EOS', 'NVE', 'NVT', 'NPT', 'RESPA', 'REMD', 'WORKFLOW', 'SERVE', 'CH'],
 		help=mode_help
 	)
 	parser.add_argument(
 		'input',
 		metavar='input.in',
+		nargs='?',
 		help=config_help
 	)
 	parser.add_argument(
@@ -282,6 +442,21 @@ def create_parser():
 		metavar='external_stress',
 		help=stress_help
 	)
+	parser.add_argument(
+		'--resume',
+		action='store_true',
+		help=resume_help
+	)
+	parser.add_argument(
+		'--server',
+		action='store_true',
+		help=server_help
+	)
+	parser.add_argument(
+		'--socket',
+		metavar='path',
+		help=socket_help
+	)
 	#parser.add_argument(
 	#	'--range',
 	#	dest='eos_range',
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+import os
+import sys
+import datetime
+import traceback
+import multiprocessing
+import numpy as np
+
+from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+from ase import units
+
+from asemd.md import MolecularDynamics
+
+
+class ReplicaExchange(MolecularDynamics):
+	"""Runs replica exchange molecular dynamics (parallel tempering).
+
+	Each structure is simulated as a ladder of replicas at the temperatures
+	given in the input. Every replica runs in its own worker process using the
+	canonical dynamic object of MolecularDynamics.nvt (Langevin by default).
+	After every exchange interval, neighbouring replicas attempt to swap
+	configurations according to the Metropolis criterion
+
+		P = min(1, exp[(1/kT_i - 1/kT_j)(E_i - E_j)])
+
+	alternating between even and odd pairs. Momenta are rescaled to the new
+	temperature when configurations are swapped. Every worker writes its own
+	trajectory, so each trajectory contains a single temperature."""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+
+		if 'temperatures' in self.mode_params:
+			temperatures = str(self.mode_params['temperatures']).split()
+			self.temperatures = sorted(float(t) for t in temperatures)
+		else:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'No temperature ladder given!',
+				'Set the replica temperatures (K) by including:',
+				'REMD:\n  temperatures: 300 330 360 400',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		if 'exchange interval' in self.mode_params:
+			self.EXCHANGE_INTERVAL = int(self.mode_params['exchange interval'])
+		else:
+			self.EXCHANGE_INTERVAL = 100
+			self.mode_params['exchange interval'] = self.EXCHANGE_INTERVAL
+
+		# Every replica draws from its own generator, spawned from the seed.
+		# Without a seed, fresh entropy is used
+		if 'seed' in self.mode_params:
+			self.SEED = int(self.mode_params['seed'])
+		else:
+			self.SEED = None
+
+		self.ensemble = 'NVT'
+
+	def remd(self):
+		"""Sets up replica exchange. Replicas are created in the worker
+		processes, so this only checks the settings."""
+		self.disable_adaptive()
+		if self.STEPS < self.EXCHANGE_INTERVAL:
+			self.error_msg(
+				'Warning:',
+				'The number of steps is smaller than the exchange interval.',
+				'No exchanges will be attempted.'
+			)
+
+	def run(self):
+		"""Runs replica exchange on all selected structures."""
+		for i, a in enumerate(self.atoms):
+			# Removing this might cause slurm to not produce any output
+			print('', flush=True)
+			if i in self.structures:
+				start = datetime.datetime.now()
+				print(f'Running structure: {i+1} (of {len(self.atoms)})')
+				print(f'Temperatures: {", ".join(f"{t:g} K" for t in self.temperatures)}')
+
+				if self.log_file:
+					with open(self.log_file, 'a') as f:
+						if i != 0:
+							print('', file=f)
+						print(f'Structure: {i+1} (of {len(self.atoms)})', file=f)
+
+				self.run_ladder(i, a)
+
+				end = datetime.datetime.now()
+				print(f'Completed after {end-start}\n')
+				if self.log_file:
+					with open(self.log_file, 'a') as f:
+						print(f'Completed after {end-start}\n', file=f)
+
+	def run_ladder(self, index, atoms):
+		"""Starts one worker per temperature and alternates between running
+		the replicas and attempting exchanges."""
+		# Independent streams for the exchanges and each replica. Otherwise
+		# all forked workers inherit the same global random state
+		if self.SEED is None:
+			seed = np.random.SeedSequence()
+		else:
+			seed = np.random.SeedSequence([self.SEED, index])
+		seeds = seed.spawn(len(self.temperatures)+1)
+		self.rng = np.random.default_rng(seeds[-1])
+
+		# Forking shares the loaded calculator modules with the workers
+		context = multiprocessing.get_context('fork')
+		connections, workers = [], []
+		for temperature, replica_seed in zip(self.temperatures, seeds):
+			parent, child = context.Pipe()
+			worker = context.Process(
+				target=self.replica_worker,
+				args=(child, index, atoms, temperature, replica_seed),
+				daemon=True
+			)
+			worker.start()
+			connections.append(parent)
+			workers.append(worker)
+
+		pairs = len(self.temperatures) - 1
+		attempts = np.zeros(pairs, dtype=int)
+		accepted = np.zeros(pairs, dtype=int)
+
+		try:
+			# The remainder of the steps is run without a final exchange
+			cycles, remainder = divmod(self.STEPS, self.EXCHANGE_INTERVAL)
+			for cycle in range(cycles):
+				energies = self.advance(connections, self.EXCHANGE_INTERVAL)
+				for j in range(cycle % 2, pairs, 2):
+					attempts[j] += 1
+					if self.attempt_exchange(connections, energies, j):
+						accepted[j] += 1
+				self.print_ladder(cycle+1, energies)
+
+			if remainder:
+				self.advance(connections, remainder)
+
+		finally:
+			for conn in connections:
+				try:
+					conn.send(('close',))
+				except (BrokenPipeError, OSError):
+					pass
+			for worker in workers:
+				worker.join()
+
+		self.exchange_summary(attempts, accepted)
+
+	def advance(self, connections, steps):
+		"""Runs all replicas in parallel and returns their potential
+		energies."""
+		for conn in connections:
+			conn.send(('run', steps))
+		return np.array([self.receive(conn)[1] for conn in connections])
+
+	def receive(self, conn):
+		"""Returns the reply of a worker, or raises if the worker failed."""
+		reply = conn.recv()
+		if reply[0] == 'error':
+			raise RuntimeError(f'Replica worker failed:\n{reply[1]}')
+		return reply
+
+	def attempt_exchange(self, connections, energies, j):
+		"""Attempts to swap the configurations of replicas j and j+1 using
+		the Metropolis criterion."""
+		t1, t2 = self.temperatures[j], self.temperatures[j+1]
+		delta = (1/(units.kB*t1) - 1/(units.kB*t2))*(energies[j] - energies[j+1])
+		if (delta < 0) and (self.rng.random() >= np.exp(delta)):
+			return False
+
+		connections[j].send(('get',))
+		connections[j+1].send(('get',))
+		_, positions1, momenta1 = self.receive(connections[j])
+		_, positions2, momenta2 = self.receive(connections[j+1])
+
+		# Momenta are rescaled to the temperature of the receiving replica
+		connections[j].send(('set', positions2, momenta2*np.sqrt(t1/t2)))
+		connections[j+1].send(('set', positions1, momenta1*np.sqrt(t2/t1)))
+		self.receive(connections[j])
+		self.receive(connections[j+1])
+		energies[j], energies[j+1] = energies[j+1], energies[j]
+		return True
+
+	def replica_worker(self, conn, index, atoms, temperature, seed):
+		"""Worker process that holds a single replica at a fixed temperature
+		and runs it on request. Velocities and the thermostat draw from a 
+		generator seeded by the replica's own seed sequence."""
+		try:
+			sys.path.append(os.getcwd())
+			rng = np.random.default_rng(seed)
+			atoms = atoms.copy()
+			self.prepare_atoms(atoms)
+			atoms.calc = self.acquire_calc(self.calculator)
+			MaxwellBoltzmannDistribution(atoms, temperature_K=temperature, rng=rng)
+
+			dyn = self.build_thermostat(self.thermostat, atoms, temperature, rng=rng)
+
+			traj = None
+			if self.output_structure:
+				traj_name = f'{index}_{temperature:g}K_'+self.output_structure
+				traj = self.open_trajectory(traj_name, atoms)
+				dyn.attach(traj.write, interval=self.DUMP_INTERVAL)
+		except Exception:
+			conn.send(('error', traceback.format_exc()))
+			return
+
+		while True:
+			message = conn.recv()
+			try:
+				if message[0] == 'run':
+					dyn.run(steps=message[1])
+					conn.send(('energy', atoms.get_potential_energy()))
+				elif message[0] == 'get':
+					conn.send(('state', atoms.get_positions(), atoms.get_momenta()))
+				elif message[0] == 'set':
+					atoms.set_positions(message[1])
+					atoms.set_momenta(message[2])
+					conn.send(('ok',))
+				elif message[0] == 'close':
+					break
+			except Exception:
+				conn.send(('error', traceback.format_exc()))
+
+		if traj is not None:
+			traj.close()
+
+	def print_ladder(self, cycle, energies):
+		"""Prints the potential energy of each replica after an exchange
+		cycle."""
+		out = ', '.join(f'{t:g} K: {e:.4f} eV' for t, e in zip(self.temperatures, energies))
+		if cycle % max(self.DUMP_INTERVAL//self.EXCHANGE_INTERVAL, 1) == 0:
+			print(f'Cycle {cycle}: {out}', flush=True)
+
+	def exchange_summary(self, attempts, accepted):
+		"""Prints (and logs) the acceptance rate of each neighbouring pair."""
+		out = ['Exchange acceptance rates:']
+		for j in range(len(attempts)):
+			rate = accepted[j]/attempts[j] if attempts[j] else 0.0
+			t1, t2 = self.temperatures[j], self.temperatures[j+1]
+			out.append(f'  {t1:g} K <-> {t2:g} K: {rate:.2f} ({accepted[j]}/{attempts[j]})')
+		print('\n'.join(out))
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\n'.join(out), file=f)
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+import time
+import numpy as np
+
+from ase.md.md import MolecularDynamics
+from ase import units
+
+
+class RESPA(MolecularDynamics):
+	"""Reversible multiple time step (RESPA) integrator for the NVE ensemble.
+
+	The total force is split into a cheap part, evaluated by a fast calculator
+	every step, and a slow correction (expensive minus cheap forces) that is
+	only evaluated every interval steps. Each outer cycle is
+
+		p += (interval*dt/2)*F_slow
+		interval velocity Verlet steps of length dt using F_fast
+		p += (interval*dt/2)*F_slow
+
+	where the expensive calculator is the one attached to the atoms object.
+	Each call to step advances the system by one inner time step, so a run of
+	N steps covers the same simulated time as N steps of VelocityVerlet while
+	only calling the expensive calculator N/interval times.
+
+	The total energy (expensive potential plus kinetic) is recorded at the end
+	of every outer cycle and is used to report the energy drift."""
+	def __init__(self, atoms, timestep, fast_calculator, interval=4, **kwargs):
+		super().__init__(atoms, timestep, **kwargs)
+		self.fast_calculator = fast_calculator
+		self.interval = int(interval)
+
+		self.fast_forces = None
+		self.slow_forces = None
+		self.slow_energy = None
+
+		# Call counts and timings used to estimate the speed-up
+		self.fast_calls = 0
+		self.slow_calls = 0
+		self.fast_time = 0
+		self.slow_time = 0
+		self.energies = []
+
+	def get_fast_forces(self):
+		"""Forces from the cheap calculator."""
+		start = time.perf_counter()
+		forces = self.fast_calculator.get_forces(self.atoms)
+		self.fast_time += time.perf_counter() - start
+		self.fast_calls += 1
+		return forces
+
+	def get_slow_forces(self):
+		"""Slow correction, i.e. the difference between the expensive and the
+		cheap forces at the current positions. The cheap forces at the current
+		positions are always available from the last inner step."""
+		start = time.perf_counter()
+		forces = self.atoms.get_forces(md=True)
+		energy = self.atoms.get_potential_energy()
+		self.slow_time += time.perf_counter() - start
+		self.slow_calls += 1
+
+		self.slow_energy = energy
+		return forces - self.fast_forces
+
+	def record_energy(self):
+		"""Records the total energy. Must only be called at the end of an 
+		outer cycle, where the momenta include the closing slow half-kick."""
+		self.energies.append(self.slow_energy + self.atoms.get_kinetic_energy())
+
+	def step(self):
+		atoms = self.atoms
+		masses = self.masses
+
+		if self.fast_forces is None:
+			self.fast_forces = self.get_fast_forces()
+			self.slow_forces = self.get_slow_forces()
+			self.record_energy()
+
+		p = atoms.get_momenta()
+
+		# Opening half-kick with the slow forces
+		if self.nsteps % self.interval == 0:
+			p += 0.5*self.interval*self.dt*self.slow_forces
+
+		# Inner velocity Verlet step with the fast forces
+		p += 0.5*self.dt*self.fast_forces
+		r = atoms.get_positions()
+		atoms.set_positions(r + self.dt*p/masses)
+		if atoms.constraints:
+			p = (atoms.get_positions() - r)*masses/self.dt
+		atoms.set_momenta(p, apply_constraint=False)
+
+		self.fast_forces = self.get_fast_forces()
+		p = atoms.get_momenta() + 0.5*self.dt*self.fast_forces
+
+		# Closing half-kick with the slow forces
+		if (self.nsteps + 1) % self.interval == 0:
+			atoms.set_momenta(p, apply_constraint=False)
+			self.slow_forces = self.get_slow_forces()
+			p = atoms.get_momenta() + 0.5*self.interval*self.dt*self.slow_forces
+
+		atoms.set_momenta(p)
+
+		if (self.nsteps + 1) % self.interval == 0:
+			self.record_energy()
+
+	def _refresh_properties(self):
+		# The expensive calculator must only be called at the end of outer
+		# cycles, where its results are already cached
+		pass
+
+	def energy_drift(self):
+		"""Returns the drift of the total energy in eV/atom/ps, estimated from
+		a linear fit over all completed outer cycles."""
+		if len(self.energies) < 2:
+			return 0.0
+		t = np.arange(len(self.energies))*self.interval*self.dt/(1000*units.fs)
+		slope = np.polyfit(t, self.energies, 1)[0]
+		return slope/len(self.atoms)
+
+	def speed_up(self):
+		"""Returns the estimated speed-up relative to VelocityVerlet using the
+		expensive calculator, which requires one expensive call per step."""
+		if self.slow_calls == 0:
+			return 1.0
+		reference = self.nsteps*self.slow_time/self.slow_calls
+		return reference/(self.slow_time + self.fast_time)
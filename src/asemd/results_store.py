@@ -0,0 +1,309 @@
+#!/usr/bin/python
+
+import os
+import json
+import numpy as np
+
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+class ResultStore(object):
+	"""Columnar binary store for the results of single point calculations.
+
+	A store is a directory that contains a small JSON header together with
+	one raw binary file per column. Per-atom columns of all frames are
+	concatenated, and the atoms of frame i are found between offsets[i] and
+	offsets[i+1]:
+		- offsets [frames+1]
+		- index [frames] (index of the structure in the input)
+		- energy [frames] (potential energy)
+		- cell [frames, 3, 3]
+		- stress [frames, 6] (if evaluated)
+		- numbers [atoms]
+		- positions [atoms, 3]
+		- forces, energies, charges, momenta, velocities [atoms, ...] (if
+		  evaluated)
+
+	Frames are appended to the end of each column, so a store can be written
+	incrementally and continued after an interrupted run. When opened for
+	reading the columns are memory-mapped, e.g.
+		store = ResultStore('sp.store')
+		forces = store.forces[store.offsets[10]:store.offsets[11]]
+	and the complete store can be exported to a compressed NumPy archive
+	using to_npz.
+
+	Methods:
+	write: Appends the results of a structure as the next frame.
+	close: Closes the columns and updates the header.
+	to_npz: Writes all columns to a compressed NumPy archive."""
+	frame_columns = {
+		'index':('int64', ()),
+		'energy':('float64', ()),
+		'cell':('float64', (3, 3)),
+		'stress':('float64', (6,)),
+	}
+	atom_columns = {
+		'numbers':('int64', ()),
+		'positions':('float64', (3,)),
+		'forces':('float64', (3,)),
+		'energies':('float64', ()),
+		'charges':('float64', ()),
+		'momenta':('float64', (3,)),
+		'velocities':('float64', (3,)),
+	}
+
+	def __init__(self, filename, mode='r', frames=None):
+		self.filename = filename
+		self.mode = mode
+		self.header_file = os.path.join(self.filename, 'header.json')
+		self.files = {}
+
+		if self.mode == 'w':
+			os.makedirs(self.filename, exist_ok=True)
+			self.header = {
+				'format':'asemd-spstore',
+				'version':1,
+				'frames':0,
+				'atoms':0,
+				'columns':{}
+			}
+		elif self.mode == 'a':
+			self.open_append(frames)
+		elif self.mode == 'r':
+			self.open_read()
+		else:
+			raise ValueError(f'Unsupported mode: {self.mode}')
+
+	def column_file(self, name):
+		return os.path.join(self.filename, f'{name}.bin')
+
+	def row_size(self, name):
+		"""Returns the number of bytes of a single row of a column."""
+		column = self.header['columns'][name]
+		return np.dtype(column['dtype']).itemsize*int(np.prod(column['shape']))
+
+	# Writing
+	def add_column(self, name, dtype, shape, kind):
+		"""Adds a column to the header of a new store."""
+		self.header['columns'][name] = {
+			'dtype':np.dtype(dtype).str,
+			'shape':list(shape),
+			'kind':kind
+		}
+
+	def open_append(self, frames=None):
+		"""Opens an existing store for appending. The number of frames is
+		recovered from the size of the columns, since the header is only
+		updated when the store is closed. If frames is given, the store is
+		truncated to that number of frames."""
+		with open(self.header_file, 'r') as f:
+			self.header = json.load(f)
+
+		# No frames were written before the store was closed
+		if not self.header['columns']:
+			return
+
+		stored = self.count_frames()
+		if frames is None:
+			frames = stored
+		elif frames > stored:
+			raise ValueError(
+				f'Store {self.filename} holds {stored} frames, {frames} were expected.'
+			)
+
+		offsets = np.fromfile(self.column_file('offsets'), dtype=np.int64, count=frames+1)
+		self.header['frames'] = int(frames)
+		self.header['atoms'] = int(offsets[-1]) if len(offsets) else 0
+
+		for name, column in self.header['columns'].items():
+			if name == 'offsets':
+				rows = frames+1
+			elif column['kind'] == 'frame':
+				rows = frames
+			else:
+				rows = self.header['atoms']
+			self.files[name] = open(self.column_file(name), 'r+b')
+			self.files[name].truncate(rows*self.row_size(name))
+			self.files[name].seek(0, os.SEEK_END)
+
+	def count_frames(self):
+		"""Returns the number of complete frames held by the columns. Frames 
+		that were only partially written before an interruption are not 
+		counted."""
+		rows = {
+			name:os.path.getsize(self.column_file(name))//self.row_size(name)
+			for name in self.header['columns']
+		}
+		frames = min(
+			[rows['offsets']-1]+[
+				rows[name] for name, column in self.header['columns'].items()
+				if column['kind'] == 'frame'
+			]
+		)
+		frames = max(frames, 0)
+
+		offsets = np.fromfile(self.column_file('offsets'), dtype=np.int64, count=frames+1)
+		atoms = min(
+			[rows[name] for name, column in self.header['columns'].items()
+			if column['kind'] == 'atom']
+		)
+		while (frames > 0) and (offsets[frames] > atoms):
+			frames -= 1
+		return frames
+
+	@classmethod
+	def stored_frames(cls, filename):
+		"""Returns the number of complete frames of the store in filename,
+		which is zero if it does not exist."""
+		if not os.path.exists(os.path.join(filename, 'header.json')):
+			return 0
+		store = cls.__new__(cls)
+		store.filename = filename
+		with open(os.path.join(filename, 'header.json'), 'r') as f:
+			store.header = json.load(f)
+		if not store.header['columns']:
+			return 0
+		return store.count_frames()
+
+	def create_columns(self, atoms, properties):
+		"""Creates the columns of a new store from the first frame."""
+		self.add_column('offsets', 'int64', (), 'offset')
+		for name, (dtype, shape) in self.frame_columns.items():
+			if (name not in ('stress',)) or (name in properties):
+				self.add_column(name, dtype, shape, 'frame')
+		for name, (dtype, shape) in self.atom_columns.items():
+			if (name in ('numbers', 'positions')) or (name in properties):
+				self.add_column(name, dtype, shape, 'atom')
+
+		for name in self.header['columns']:
+			self.files[name] = open(self.column_file(name), 'wb')
+		self.append('offsets', 0)
+		self.write_header()
+
+	def append(self, name, values):
+		column = self.header['columns'][name]
+		self.files[name].write(
+			np.ascontiguousarray(values, dtype=column['dtype']).tobytes()
+		)
+
+	def write(self, atoms, index, energy, properties):
+		"""Appends a frame. properties holds the evaluated per-atom arrays and
+		the stress of the structure."""
+		if self.mode == 'r':
+			raise ValueError('Store is not opened for writing.')
+		if not self.files:
+			self.create_columns(atoms, properties)
+
+		self.append('index', index)
+		self.append('energy', energy)
+		self.append('cell', atoms.cell.array)
+		self.append('numbers', atoms.numbers)
+		self.append('positions', atoms.positions)
+		for name, column in self.header['columns'].items():
+			if name in properties:
+				values = np.asarray(properties[name])
+				if name == 'stress' and values.shape == (3, 3):
+					values = values[[0, 1, 2, 1, 0, 0], [0, 1, 2, 2, 2, 1]]
+				self.append(name, values)
+			elif column['kind'] != 'offset' and name not in (
+				'index', 'energy', 'cell', 'numbers', 'positions'):
+				raise ValueError(f'Frame {index} is missing the column {name}.')
+
+		self.header['frames'] += 1
+		self.header['atoms'] += len(atoms)
+		self.append('offsets', self.header['atoms'])
+
+	def flush(self):
+		for f in self.files.values():
+			f.flush()
+
+	def write_header(self):
+		"""Writes the JSON header."""
+		with open(self.header_file, 'w') as f:
+			json.dump(self.header, f, indent=1)
+
+	def close(self):
+		"""Closes the columns and records the number of frames in the
+		header."""
+		if self.mode in ('w', 'a'):
+			for f in self.files.values():
+				f.close()
+			self.files = {}
+			if self.header['columns']:
+				self.write_header()
+
+	# Reading
+	def open_read(self):
+		"""Memory-maps all columns in read-only mode. Only frames that have
+		been recorded in the header are exposed."""
+		with open(self.header_file, 'r') as f:
+			self.header = json.load(f)
+
+		self.data = {}
+		for name, column in self.header['columns'].items():
+			if name == 'offsets':
+				rows = self.header['frames']+1
+			elif column['kind'] == 'frame':
+				rows = self.header['frames']
+			else:
+				rows = self.header['atoms']
+			if rows == 0:
+				self.data[name] = np.empty((0,)+tuple(column['shape']), dtype=column['dtype'])
+				continue
+			self.data[name] = np.memmap(
+				self.column_file(name),
+				dtype=column['dtype'],
+				mode='r',
+				shape=(rows,)+tuple(column['shape'])
+			)
+
+	def to_npz(self, filename):
+		"""Writes all columns to a compressed NumPy archive."""
+		np.savez_compressed(filename, **self.data)
+
+	def __getattr__(self, name):
+		# Exposes columns as attributes, e.g. store.forces
+		if name in self.__dict__.get('data', {}):
+			return self.data[name]
+		raise AttributeError(name)
+
+	def __len__(self):
+		return self.header['frames']
+
+	def __getitem__(self, index):
+		"""Returns frame(s) as atoms objects with the stored results
+		attached."""
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError('Store index out of range.')
+
+		start, stop = self.data['offsets'][index:index+2]
+		atoms = Atoms(
+			numbers=np.array(self.data['numbers'][start:stop]),
+			positions=np.array(self.data['positions'][start:stop]),
+			cell=np.array(self.data['cell'][index])
+		)
+		results = {'energy':float(self.data['energy'][index])}
+		for name, column in self.header['columns'].items():
+			if name in ('forces', 'energies', 'charges'):
+				results[name] = np.array(self.data[name][start:stop])
+			elif name in ('momenta', 'velocities'):
+				atoms.arrays[name] = np.array(self.data[name][start:stop])
+		if 'stress' in self.data:
+			results['stress'] = np.array(self.data['stress'][index])
+		atoms.calc = SinglePointCalculator(atoms, **results)
+		return atoms
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
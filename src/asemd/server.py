@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import yaml
+import socket
+import signal
+import tempfile
+import traceback
+import importlib.util
+import importlib.machinery
+
+
+# Separates the output of a job from its exit status
+END_OF_OUTPUT = b'\x00'
+
+default_socket = os.path.join(tempfile.gettempdir(), f'asemd-{os.getuid()}.sock')
+
+# Seconds a client may take to send its request. Requests are read by the
+# server itself, so a stalled client would otherwise block all others
+REQUEST_TIMEOUT = 10
+
+
+# Calculator modules loaded by the server, keyed on the resolved path and
+# modification time of their script
+preloaded = {}
+
+
+def calculator_names(config, cwd):
+	"""Returns the names of the calculator scripts in a config file."""
+	try:
+		with open(os.path.join(cwd, config), 'r') as f:
+			inp = yaml.safe_load(f)
+	except (OSError, yaml.YAMLError):
+		return []
+
+	names = []
+	for section in (inp or {}).values():
+		if not isinstance(section, dict):
+			continue
+		for key, val in section.items():
+			if str(key).lower().endswith('calculator') and isinstance(val, str) and val != 'EMT':
+				names.append(val)
+	return names
+
+
+def calculator_key(name, cwd):
+	"""Returns the import spec of a calculator script, which is looked up in
+	the working directory of the job first, and the key it is preloaded 
+	under."""
+	spec = importlib.machinery.PathFinder.find_spec(name, [cwd])
+	if spec is None:
+		spec = importlib.util.find_spec(name)
+	if (spec is None) or (spec.origin is None) or not os.path.exists(spec.origin):
+		return spec, None
+	origin = os.path.realpath(spec.origin)
+	return spec, (origin, os.path.getmtime(origin))
+
+
+def preload_calculators(config, cwd):
+	"""Loads the calculator scripts named in a config file, so that they
+	are loaded once in the server and inherited by every job. Scripts are
+	told apart by their path and modification time, so jobs in different
+	directories (or after a script has been edited) get their own."""
+	for name in calculator_names(config, cwd):
+		try:
+			spec, key = calculator_key(name, cwd)
+			if (key is None) or (key in preloaded):
+				continue
+			module = importlib.util.module_from_spec(spec)
+			sys.path.insert(0, cwd)
+			try:
+				spec.loader.exec_module(module)
+			finally:
+				sys.path.remove(cwd)
+			preloaded[key] = module
+		except Exception:
+			# The job reports the error itself
+			pass
+
+
+def install_calculators(config, cwd):
+	"""Makes the calculator names of a job refer to the modules that were
+	preloaded from its own scripts. Other names are imported by the job
+	from its working directory."""
+	sys.path.insert(0, cwd)
+	for name in calculator_names(config, cwd):
+		sys.modules.pop(name, None)
+		try:
+			_, key = calculator_key(name, cwd)
+		except Exception:
+			continue
+		if key in preloaded:
+			sys.modules[name] = preloaded[key]
+
+
+def run_job(conn, request):
+	"""Runs a single job in a forked process. Its output is sent back over
+	the connection, followed by the exit status."""
+	signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+	devnull = os.open(os.devnull, os.O_RDONLY)
+	os.dup2(devnull, 0)
+	os.dup2(conn.fileno(), 1)
+	os.dup2(conn.fileno(), 2)
+	sys.stdout.reconfigure(line_buffering=True)
+	sys.stderr.reconfigure(line_buffering=True)
+
+	status = 0
+	try:
+		os.chdir(request['cwd'])
+		if request.get('input'):
+			install_calculators(request['input'], request['cwd'])
+		from asemd.__main__ import main
+		main(request['argv'])
+	except SystemExit as error:
+		if isinstance(error.code, int):
+			status = error.code
+		elif error.code is not None:
+			print(error.code, file=sys.stderr)
+			status = 1
+	except BaseException:
+		traceback.print_exc()
+		status = 1
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+	conn.sendall(END_OF_OUTPUT + str(status).encode())
+	conn.close()
+	os._exit(0)
+
+
+def serve(socket_path=None):
+	"""Listens for jobs on a Unix socket. Every job is run in a process
+	forked from the server, so that ASE, pandas and the calculators that
+	have already been loaded do not have to be imported again."""
+	if socket_path is None:
+		socket_path = default_socket
+
+	if os.path.exists(socket_path):
+		try:
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+				s.connect(socket_path)
+			print(f'A server is already listening on {socket_path}')
+			sys.exit(1)
+		except ConnectionRefusedError:
+			# Left behind by a server that did not shut down cleanly
+			os.unlink(socket_path)
+
+	# Finished jobs are reaped automatically, and the socket is removed when
+	# the server is terminated
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+	# Only the user that started the server may submit jobs
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	umask = os.umask(0o177)
+	try:
+		server.bind(socket_path)
+	finally:
+		os.umask(umask)
+	os.chmod(socket_path, 0o600)
+	server.listen()
+	print(f'Listening on: {socket_path}', flush=True)
+
+	try:
+		while True:
+			conn, _ = server.accept()
+			conn.settimeout(REQUEST_TIMEOUT)
+			try:
+				with conn.makefile('rb') as f:
+					line = f.readline()
+				request = json.loads(line)
+			except (OSError, ValueError):
+				conn.close()
+				continue
+
+			# The connection becomes the output of the job, which must block
+			conn.settimeout(None)
+
+			print(f'Job: asemd {" ".join(request["argv"])} (in {request["cwd"]})', flush=True)
+			if request.get('input'):
+				preload_calculators(request['input'], request['cwd'])
+
+			if os.fork() == 0:
+				server.close()
+				run_job(conn, request)
+			conn.close()
+
+	except (KeyboardInterrupt, SystemExit):
+		print('\nShutting down.')
+	finally:
+		server.close()
+		os.unlink(socket_path)
+
+
+def submit(argv, input_file=None, socket_path=None):
+	"""Sends a job to a running server and prints its output. Returns the
+	exit status of the job."""
+	if socket_path is None:
+		socket_path = default_socket
+
+	request = {'argv':argv, 'input':input_file, 'cwd':os.getcwd()}
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		client.connect(socket_path)
+	except (FileNotFoundError, ConnectionRefusedError):
+		print(f'No server is listening on {socket_path}. Start one using:')
+		print('$ asemd SERVE')
+		return 1
+
+	client.sendall(json.dumps(request).encode() + b'\n')
+	client.shutdown(socket.SHUT_WR)
+
+	out = sys.stdout.buffer
+	status = b''
+	done = False
+	while True:
+		chunk = client.recv(65536)
+		if not chunk:
+			break
+		if done:
+			status += chunk
+			continue
+		if END_OF_OUTPUT in chunk:
+			chunk, status = chunk.split(END_OF_OUTPUT, 1)
+			done = True
+		out.write(chunk)
+		out.flush()
+	client.close()
+
+	if not done:
+		print('The server closed the connection before the job finished.')
+		return 1
+	return int(status or 0)
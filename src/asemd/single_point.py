@@ -1,14 +1,22 @@
 #!/usr/bin/python
 
 import os
+import sys
+import json
+import array
 import datetime
+from collections import Counter
 import numpy as np
-import pandas as pd
 
-from ase.io import read, write
+from ase.io import read, iread, write
+from ase.io.formats import filetype
+from ase.io.trajectory import Trajectory
 from ase.calculators.emt import EMT
 
 from asemd.configure import Configure
+from asemd.cache import CachedCalculator
+from asemd.results_store import ResultStore
+from asemd.analysis import DatasetStatistics
 
 
 class SinglePoint(Configure):
@@ -19,9 +27,10 @@ class SinglePoint(Configure):
 	
 	Methods:
 	run: Runs the single point calculations within the instance object.
-	acquire_property: Evaluates a given property an all atoms-objects found in 
-	the input file. The single point mode has support for input files that 
-	contain multiple structures.
+	calculate_properties: Evaluates all calculator properties of a structure 
+	in a single call of the calculator.
+	acquire_property: Returns a given property of a structure. The single 
+	point mode has support for input files that contain multiple structures.
 
 	Supported properties:
 		- Forces
@@ -29,13 +38,16 @@ class SinglePoint(Configure):
 		- Momenta
 		- Stress
 		- Velocities"""
-	def __init__(self, log_file, *args):
-		super().__init__(*args)
+	stream_input = True
+
+	def __init__(self, log_file, *args, **kwargs):
+		super().__init__(*args, **kwargs)
 		self.log_file = log_file
 
 		self.attribute_map = {
 			'forces':'get_forces',
 			'energies':'get_potential_energies',
+			'stress':'get_stress',
 			'momenta':'get_momenta',
 			'velocities':'get_velocities',
 			'charges':'get_charges'
@@ -45,120 +57,553 @@ class SinglePoint(Configure):
 			'forces':'Max. force [eV/Å]',
 			'energy':'Potential energy [eV]',
 			'energies':'Max. energies [eV]',
+			'stress':'Max. stress [eV/Å^3]',
 			'momenta':'Max. momentum [kg*m/s]',
 			'velocities':'Max. velocity [m/s]',
 			'charges':'Max. charge'
 		}
 
-		self.data = {}
+		# Properties that are computed by the calculator, mapped to the names
+		# used by ASE calculators. All of them are requested in a single call.
+		# These are copied from the first occurrence of a duplicate structure
+		# instead of being evaluated again
+		self.calculator_properties = {
+			'forces':'forces',
+			'energies':'energies',
+			'stress':'stress',
+			'charges':'charges'
+		}
+
+		# Reduced to the largest norm of the per-atom vectors
+		self.vector_properties = {'forces', 'momenta', 'velocities'}
+		self.shared_results = {}
+
+		# Results are stored column-wise, which keeps the memory footprint of 
+		# large runs small
+		self.index = []
+		self.columns = {}
+		self.log_header = False
+
+		# Continues a previous run with the same output, skipping structures
+		# that are found in its progress manifest
+		if 'resume' in self.mode_params:
+			self.resume = bool(self.mode_params['resume'])
+		else:
+			self.resume = False
+
+		if self.resume and not self.output_structure:
+			self.error_msg(
+				'Warning:',
+				'Resuming requires an output file, which holds the progress manifest.',
+				'All structures will be evaluated.'
+			)
+			self.resume = False
+
+		# Optional columnar binary store of the results, written next to the
+		# output structures
+		if 'store' in self.mode_params:
+			self.store_name = self.mode_params['store']
+		else:
+			self.store_name = False
+		self.store = None
+
+		# Streaming statistics of the whole dataset, which are printed and
+		# optionally written to a summary file
+		if 'statistics' in self.mode_params:
+			settings = self.mode_params['statistics']
+			if isinstance(settings, dict):
+				self.statistics_settings = {key.lower():val for key, val in settings.items()}
+			elif settings:
+				self.statistics_settings = {}
+			else:
+				self.statistics_settings = False
+		else:
+			self.statistics_settings = False
+		self.statistics = None
+
+		# Multi-fidelity screening: all structures are first evaluated with a
+		# cheap calculator and only those that pass the selection rules are
+		# evaluated with the main calculator
+		if 'screen calculator' in self.mode_params:
+			self.screen_calculator = self.mode_params['screen calculator']
+		else:
+			self.screen_calculator = False
+
+		if 'screen energy window' in self.mode_params:
+			self.SCREEN_WINDOW = float(self.mode_params['screen energy window'])
+		else:
+			self.SCREEN_WINDOW = None
+
+		if 'screen top k' in self.mode_params:
+			self.SCREEN_TOP = int(self.mode_params['screen top k'])
+		else:
+			self.SCREEN_TOP = None
+
+		if 'screen fmax' in self.mode_params:
+			self.SCREEN_FMAX = float(self.mode_params['screen fmax'])
+		else:
+			self.SCREEN_FMAX = None
+
+		if 'screen batch size' in self.mode_params:
+			self.SCREEN_BATCH = int(self.mode_params['screen batch size'])
+		else:
+			self.SCREEN_BATCH = 64
+
+		if self.screen_calculator and (self.SCREEN_WINDOW, self.SCREEN_TOP, self.SCREEN_FMAX) == (None, None, None):
+			self.error_msg(
+				'Warning:',
+				'A screening calculator has been set without any selection rule.',
+				'Set screen energy window, screen top k or screen fmax in the YAML input file.',
+				'All structures will be evaluated with the main calculator.'
+			)
 
 
 	def run(self):
 		"""Runs the single point evaluation of the properties that have been
 		specified in the YAML input file.
 
+		Structures are read, evaluated and written one at a time, and each row
+		of results is appended to the log as soon as it is available. Only the
+		results table is kept in memory.
+
 		Supported properties:
 		- forces
 		- energies
 		- momenta
 		- stress
 		- velocities"""
-		for i, a in enumerate(self.atoms):
-			# Removing this might cause slurm to not produce any output
-			print('', flush=True)
-			if i in self.structures:
+		# Checks to see if properties have been assigned correctly in the input
+		if ('evaluate' in self.mode_params) and (
+			self.mode_params['evaluate'] is not None):
+			self.evaluate = set(self.mode_params['evaluate'])
+		else:
+			self.evaluate = set()
+
+		try:
+			calc = self.acquire_calc(self.calculator)
+		except:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Missing calculator!',
+				'Select EMT (for testing) or specify a python script that contains all calculator\ndefinitions by including:',
+				'Global/MODE:\n  calculator: EMT/name_of_script',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		# Pre-pass over the input that finds duplicate structures
+		self.find_duplicates(self.iterate_structures())
+		remaining = Counter(self.duplicate_of.values())
+
+		# Pre-pass with the screening calculator, which skips the structures
+		# labelled by a resumed run
+		self.open_output()
+		survivors = self.screen()
+
+		# Counts the calculator invocations, which should be one per structure.
+		# Calculators are counted by the cache wrapper, which is only used to
+		# count if no cache has been set
+		if not isinstance(calc, CachedCalculator):
+			calc = CachedCalculator(calc)
+		calls_before = calc.calls
+
+		if self.statistics_settings is not False:
+			self.statistics = DatasetStatistics(self.statistics_settings.get('bins', 200))
+
+		self.open_store()
+		if self.statistics is not None:
+			self.resume_statistics()
+		log = open(self.log_file, 'a') if self.log_file else None
+		skipped = 0
+		copied = 0
+		evaluated = 0
+		rejected = 0
+		main_time = datetime.timedelta()
+		try:
+			for i, a in self.iterate_structures():
+				# Removing this might cause slurm to not produce any output
+				print('', flush=True)
+
+				key = self.structure_hash(a)
+				if i in self.completed:
+					if self.labelled_hash(i) != key:
+						self.error_msg(
+							'CRITICAL ERROR',
+							f'Structure {i+1} differs from the one labelled by the resumed run.',
+							'The input file has changed since the previous run.',
+							'Run without resume to start over.'
+						)
+						sys.exit()
+					skipped += 1
+					continue
+
+				if (survivors is not None) and (i not in survivors):
+					rejected += 1
+					continue
+
 				out = {}
-				
-				try:
-					a.calc = self.acquire_calc(self.calculator)
-				except:
-					self.error_msg(
-						'CRITICAL ERROR',
-						'Missing calculator!',
-						'Select EMT (for testing) or specify a python script that contains all calculator\ndefinitions by including:',
-						'Global/MODE:\n  calculator: EMT/name_of_script',
-						'in the YAML input file.'
-					)
-					sys.exit()
-				
-				#a.calc = self.acquire_calc(self.calculator)
-
-				# Prints timestamps and indices
-				if len(self.atoms) > 1:
-					start = datetime.datetime.now()
-				#print(f'Running structure: {i+1} (of {len(self.atoms)})')
-
-				# Checks to see if properties have been assigned correctly in the input
-				if ('evaluate' in self.mode_params) and (
-					self.mode_params['evaluate'] is not None):
-					self.evaluate = set(self.mode_params['evaluate'])
-
-					# Runs evaluation on all attributes
-					for attribute in self.evaluate:
-						print(f'Evaluating: {attribute}')
-
-						# Evaluate property
-						prop = self.acquire_property(attribute, a)			
-						
-						# Evaluates maximum attribute qty
-						# If attribute is a vector-qty, evaluate max norm
-						if attribute is ('forces' or 'velocities' or 'momenta'):
-							propx, propy, propz = prop[:,0], prop[:,1], prop[:,2]
-							prop_vectors = (propx**2 + propy**2 + propz**2)**0.5
-							out[self.output_map[attribute]] = np.max(prop_vectors)
-						else:
-							out[self.output_map[attribute]] = np.max(prop)
-				else:
-					pass
+
+				# Duplicates reuse the results of their first occurrence, 
+				# unless it was labelled by a resumed run
+				rep = self.duplicate_of.get(i)
+				shared = self.shared_results.get(rep)
+
+				start = datetime.datetime.now()
+				calls = calc.calls
+				if shared is None:
+					self.calculate_properties(a, calc)
+					evaluated += 1
+
+				for attribute in self.evaluate:
+					if (shared is not None) and (attribute in shared['arrays']):
+						prop = shared['arrays'][attribute]
+						if attribute != 'stress':
+							prop = self.fan_out(prop, rep, i)
+						self.store_property(attribute, a, prop)
+					else:
+						# Read from the results of the calculator
+						prop = self.acquire_property(attribute, a)
+					out[self.output_map[attribute]] = self.reduce_property(attribute, prop)
 
 				# Stack attribute evaluations with potential energy
-				energy = a.get_potential_energy()
+				if shared is not None:
+					energy = shared['energy']
+					remaining[rep] -= 1
+					if not remaining[rep]:
+						del self.shared_results[rep]
+					copied += 1
+				else:
+					energy = a.get_potential_energy()
+					if remaining[i]:
+						self.shared_results[i] = {
+							'energy':energy,
+							'arrays':{
+								attribute:np.array(a.info[attribute] if attribute == 'stress' else a.arrays[attribute])
+								for attribute in self.evaluate 
+								if attribute in self.calculator_properties
+							}
+						}
 				out[self.output_map['energy']] = energy
-				self.data[i+1] = out
+				self.add_row(i+1, out, log)
 
-				if len(self.atoms) > 1:
-					end = datetime.datetime.now()
-					print(f'Potential energy: {energy:.4f} eV')
-					print(f'Structure {i+1} of ({len(self.atoms)}) completed after {end-start}\n')
-			
-				del a.calc
+				end = datetime.datetime.now()
+				print(f'Potential energy: {energy:.4f} eV')
+				if shared is not None:
+					print(f'Structure {i+1} is a duplicate of structure {rep+1}\n')
+				else:
+					print(f'Calculator calls: {calc.calls-calls}')
+					print(f'Structure {i+1} completed after {end-start}\n')
+					main_time += end-start
+					del a.calc
+				self.save_structure(a)
+				self.save_results(i, a, energy)
+				if self.statistics is not None:
+					self.statistics.update(a, energy)
+				self.record_progress(i, key, out)
+		finally:
+			self.calculator_calls = calc.calls - calls_before
+			self.close_output()
+			if log is not None:
+				log.close()
+
+		if evaluated:
+			print(
+				f'Calculator called {self.calculator_calls} times for {evaluated} '
+				f'structures ({self.calculator_calls/evaluated:.2f} per structure).'
+			)
 
-		#print(len(self.structures))
-		#print(self.structures)
+		if skipped:
+			print(f'Skipped {skipped} structures labelled by a previous run.')
+		if copied:
+			print(f'Copied the results of {copied} duplicate structures.')
+		if survivors is not None:
+			print(
+				f'Screening rejected {rejected} structures, '
+				f'{self.screen_passed} of {self.screened} passed.'
+			)
+			if evaluated:
+				saved = main_time/evaluated*rejected - self.screen_time
+				print(f'Estimated time saved by screening: {saved}')
 
-		#print(self.data)
-		self.out = pd.DataFrame.from_dict(self.data, orient='index')
-		if len(self.structures) <= 100:
-			print(self.out.to_string())
+		if len(self.index) <= 100:
+			print(self.results().to_string())
 		else:
 			self.error_msg(
 				'Warning',
 				'Too many structures to print tabulated summary of output.',
 				'Please refer to the log file stored under logs/.'
 			)
-		
+
+		if self.statistics is not None:
+			self.save_statistics()
+
+	def screen(self):
+		"""Evaluates all selected structures with the screening calculator 
+		and returns the indices of those that pass the selection rules, or 
+		None if no screening has been set.
+
+		Only representatives that have not been labelled by a resumed run are
+		screened and ranked, and duplicates pass together with their 
+		representative. Labelled representatives keep their top k places. Structures are evaluated in batches. If the calculator
+		script defines batch_calculator(atoms_list), it is called once per 
+		batch."""
+		if not self.screen_calculator:
+			return None
+
+		start = datetime.datetime.now()
+		try:
+			calc = self.acquire_calc(self.screen_calculator)
+			batch_calc = self.acquire_batch_calc(self.screen_calculator)
+		except:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Missing screening calculator!',
+				'Select EMT or specify a python script that contains the calculator definition by including:',
+				'MODE:\n  screen calculator: EMT/name_of_script',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		indices = []
+		formulas = []
+		energies = array.array('d')
+		fmax = array.array('d')
+		batch = []
+		labelled = Counter()
+		for i, a in self.iterate_structures():
+			if i in self.duplicate_of:
+				continue
+			if i in self.completed:
+				# Takes one of the top k places of its composition
+				labelled[a.get_chemical_formula()] += 1
+				continue
+			batch.append(a)
+			indices.append(i)
+			formulas.append(a.get_chemical_formula())
+			if len(batch) == self.SCREEN_BATCH:
+				self.screen_batch(batch, calc, batch_calc, energies, fmax)
+				batch = []
+		if batch:
+			self.screen_batch(batch, calc, batch_calc, energies, fmax)
+
+		indices = np.asarray(indices)
+		energies = np.asarray(energies)
+		fmax = np.asarray(fmax)
+		keep = np.ones(len(indices), dtype=bool)
+
+		if self.SCREEN_FMAX is not None:
+			keep &= fmax <= self.SCREEN_FMAX
+
+		# Energies per atom are compared within each composition
+		names, compositions = np.unique(formulas, return_inverse=True)
+		compositions = compositions.ravel()
+		if self.SCREEN_WINDOW is not None:
+			lowest = np.full(compositions.max(initial=-1)+1, np.inf)
+			np.minimum.at(lowest, compositions[keep], energies[keep])
+			keep &= energies - lowest[compositions] <= self.SCREEN_WINDOW
+
+		if self.SCREEN_TOP is not None:
+			# Ranks the remaining structures of each composition by energy
+			order = np.lexsort((np.where(keep, energies, np.inf), compositions))
+			groups = compositions[order]
+			first = np.searchsorted(groups, groups)
+			rank = np.empty(len(order), dtype=np.int64)
+			rank[order] = np.arange(len(order)) - first
+			places = np.array([self.SCREEN_TOP - labelled[name] for name in names], dtype=np.int64)
+			keep &= rank < places[compositions]
+
+		self.screened = len(indices)
+		self.screen_passed = int(keep.sum())
+		self.screen_time = datetime.datetime.now() - start
+		print(
+			f'Screened {self.screened} structures with {self.screen_calculator} '
+			f'in {self.screen_time}, {self.screen_passed} passed.\n'
+		)
+
+		# Representatives labelled by a resumed run passed a previous screening
+		survivors = set(indices[keep].tolist())
+		survivors |= {
+			i for i, rep in self.duplicate_of.items() 
+			if (rep in survivors) or (rep in self.completed)
+		}
+		return survivors
+
+	def screen_batch(self, batch, calc, batch_calc, energies, fmax):
+		"""Evaluates a batch of structures with the screening calculator and
+		appends their energies per atom and largest force norms."""
+		sizes = np.array([len(a) for a in batch])
+		if batch_calc is not None:
+			batch_energies, forces = batch_calc(batch)
+			if not isinstance(forces, (list, tuple)):
+				forces = np.split(np.asarray(forces), np.cumsum(sizes)[:-1])
+		else:
+			batch_energies, forces = [], []
+			for a in batch:
+				a.calc = calc
+				batch_energies.append(a.get_potential_energy())
+				if self.SCREEN_FMAX is not None:
+					forces.append(a.get_forces())
+				a.calc = None
+
+		energies.extend(np.asarray(batch_energies, dtype=float)/sizes)
+		if self.SCREEN_FMAX is not None:
+			fmax.extend(np.sqrt(np.einsum('ij,ij->i', f, f)).max() for f in forces)
+		else:
+			fmax.extend(np.zeros(len(batch)))
+
+	def resume_statistics(self):
+		"""Adds the structures labelled by a resumed run to the statistics. 
+		Their energies are taken from the progress manifest and their per-atom
+		properties are read back from the output, one frame at a time."""
+		self.resumed_statistics = (0, 0)
+		completed = len(self.completed)
+		if not completed:
+			return
+
+		energies = self.columns[self.output_map['energy']]
+		incomplete = 0
+		for k, frame in enumerate(iread(self.output_structure, f':{completed}')):
+			results = frame.calc.results if frame.calc is not None else {}
+			for name in ('forces', 'energies'):
+				if (name in results) and (name not in frame.arrays):
+					frame.arrays[name] = results[name]
+			if any(name not in frame.arrays for name in ('forces', 'energies') if name in self.evaluate):
+				incomplete += 1
+			self.statistics.update(frame, energies[k])
+		self.resumed_statistics = (completed, incomplete)
+
+	def save_statistics(self):
+		"""Prints the dataset statistics, adds them to the log and writes them
+		to the summary file if one has been set."""
+		summary = self.statistics.summary().to_string(float_format='{:.6g}'.format)
+		title = f'\nStatistics of {self.statistics.structures} structures'
+		resumed, incomplete = getattr(self, 'resumed_statistics', (0, 0))
+		if resumed:
+			title += f' ({resumed} read back from the output of the resumed run'
+			if incomplete:
+				title += f', {incomplete} of which without per-atom properties'
+			title += ')'
+		title += ':'
+		print(title)
+		print(summary)
+
 		if self.log_file:
 			with open(self.log_file, 'a') as f:
-				print(self.out.to_string(), file=f)
-
-		self.save_structure(a)
+				print(title, file=f)
+				print(summary, file=f)
+
+		if 'output' in self.statistics_settings:
+			filename = self.statistics_settings['output']
+			self.statistics.save(filename)
+			print(f'Statistics saved to: {filename}')
+
+	def iterate_structures(self):
+		"""Yields the index and atoms object of each selected structure. 
+		Structures are read one at a time unless they have been passed in
+		memory."""
+		if self.atoms is not None:
+			structures = enumerate(self.atoms)
+		elif self.structures == -1:
+			# Trajectory inputs are evaluated at the last frame
+			atoms = read(self.input_structure, -1)
+			structures = [(0, atoms)]
+			self.structures = [0]
+		else:
+			structures = enumerate(iread(self.input_structure, ':'))
 
+		if self.structures is None:
+			selected, last = None, None
+		else:
+			selected = set(self.structures)
+			last = max(selected)
+
+		for i, a in structures:
+			if (selected is None) or (i in selected):
+				self.set_geometry(a)
+				yield i, a
+			if (last is not None) and (i >= last):
+				break
+
+	def store_property(self, attribute, atoms, prop):
+		"""Stores a property with a structure, so that it is written to the
+		output. Stress is stored in the info of the structure."""
+		if attribute == 'stress':
+			atoms.info[attribute] = prop
+		else:
+			atoms.arrays[attribute] = prop
+
+	def reduce_property(self, attribute, prop):
+		"""Reduces a property to its largest value. Vector quantities are 
+		reduced to their largest norm and stress to its largest absolute 
+		component."""
+		prop = np.asarray(prop)
+		if attribute in self.vector_properties:
+			return np.sqrt(np.einsum('ij,ij->i', prop, prop)).max()
+		elif attribute == 'stress':
+			return np.abs(prop).max()
+		return prop.max()
+
+	def add_row(self, index, out, log=None):
+		"""Stores a row of results and appends it to the log."""
+		if not self.index:
+			self.columns = {key:array.array('d') for key in out}
+
+		if (log is not None) and not self.log_header:
+			print(self.row_format(['']+list(out)), file=log)
+			self.log_header = True
+
+		self.index.append(index)
+		for key, val in out.items():
+			self.columns[key].append(val)
+
+		if log is not None:
+			print(self.row_format([index]+[f'{val:.6f}' for val in out.values()]), file=log)
+			log.flush()
+
+	def row_format(self, values):
+		"""Formats a row of the results table in the log."""
+		widths = [8]+[max(len(key), 12) for key in self.columns]
+		return ' '.join(f'{val:>{width}}' for val, width in zip(values, widths))
+
+	def results(self):
+		"""Returns a dataframe with one row of results per evaluated 
+		structure."""
+		import pandas as pd
+		return pd.DataFrame(
+			{key:np.asarray(val) for key, val in self.columns.items()},
+			index=list(self.index)
+		)
+
+	def calculate_properties(self, atoms, calc):
+		"""Evaluates the potential energy and all requested calculator 
+		properties of a structure. Calculators that evaluate all properties 
+		together are only called once. The properties are then read from the
+		results of the calculator."""
+		properties = ['energy']+[
+			self.calculator_properties[attribute] for attribute in self.evaluate 
+			if attribute in self.calculator_properties
+		]
+		print(f'Evaluating: {", ".join(properties)}')
+
+		# Removes properties read from the input, which would otherwise be 
+		# written to the output next to the new ones
+		for attribute in self.calculator_properties:
+			atoms.arrays.pop(attribute, None)
+
+		atoms.calc = calc
+		for name in properties:
+			calc.get_property(name, atoms)
 
 	def acquire_property(self, attribute, atoms):
-		"""Evaluates the input structure for the properties specified in the 
-		input."""
+		"""Returns the property of a structure specified in the input and
+		stores it with the structure. Calculator properties have already been
+		evaluated by calculate_properties."""
 		# This is achieved using the getattr-method which concatenates the 
 		# first and second arguments as first.second. For example, if first=a 
 		# and second='get_forces', then attr=a.get_forces. The added parenthesis
 		# results in the correct expression a.get_forces().
-
-		try:
-			atoms.arrays.pop(attribute)
-		except:
-			pass
-
 		prop = getattr(atoms, self.attribute_map[attribute])()
-		atoms.arrays[attribute] = prop
+		self.store_property(attribute, atoms, prop)
 		return prop
 
 		
@@ -215,11 +660,158 @@ class SinglePoint(Configure):
 				print(f'Completed after {end-start}\n')
 		"""
 
+	def open_output(self):
+		"""Opens the output file, to which each structure is written as soon 
+		as it has been evaluated, together with its progress manifest. When
+		resuming, both are opened for appending after the last structure
+		that was completed."""
+		self.output_file = None
+		self.manifest = None
+		self.labelled = None
+		self.completed = set()
+		if not self.output_structure:
+			return
+
+		self.output_format = filetype(self.output_structure, read=False)
+		manifest = self.output_structure+'.progress'
+		if self.resume and os.path.exists(manifest):
+			# Structures that did not reach the results store are evaluated 
+			# again
+			limit = ResultStore.stored_frames(self.store_name) if self.store_name else None
+			self.completed = self.load_manifest(manifest, limit)
+			mode = 'a'
+		else:
+			mode = 'w'
+
+		if self.output_format == 'traj':
+			if mode == 'a' and os.path.exists(self.output_structure):
+				self.truncate_trajectory(len(self.completed))
+			self.output_file = Trajectory(self.output_structure, mode)
+		else:
+			if mode == 'a' and os.path.exists(self.output_structure):
+				# Removes frames written after the last completed structure
+				with open(self.output_structure, 'r+b') as f:
+					f.truncate(self.output_offset)
+			self.output_file = open(self.output_structure, mode)
+		self.manifest = open(manifest, mode)
+
+		# The hashes of the labelled structures are read back one at a time
+		if self.completed:
+			self.labelled = open(manifest, 'rb')
+			print(f'Resuming after {len(self.completed)} labelled structures.')
+
+	def open_store(self):
+		"""Opens the results store, if one has been set. When resuming, the
+		store is truncated to the structures that were completed."""
+		self.store = None
+		if not self.store_name:
+			return
+
+		header = os.path.join(self.store_name, 'header.json')
+		if self.completed and os.path.exists(header):
+			self.store = ResultStore(self.store_name, 'a', frames=len(self.completed))
+		else:
+			self.store = ResultStore(self.store_name, 'w')
+
+	def save_results(self, index, structure, energy):
+		"""Appends the evaluated properties of a structure to the results 
+		store."""
+		if self.store is None:
+			return
+
+		properties = {}
+		for attribute in self.evaluate:
+			if attribute == 'stress':
+				properties[attribute] = structure.info[attribute]
+			else:
+				properties[attribute] = structure.arrays[attribute]
+		self.store.write(structure, index, energy, properties)
+
+	def truncate_trajectory(self, frames):
+		"""Removes the frames of a trajectory output that were written after
+		the last completed structure."""
+		with Trajectory(self.output_structure) as traj:
+			if len(traj) <= frames:
+				return
+
+		filename = self.output_structure+'.tmp'
+		with Trajectory(filename, 'w') as traj:
+			for atoms in iread(self.output_structure, f':{frames}'):
+				traj.write(atoms)
+		os.replace(filename, self.output_structure)
+
+	def load_manifest(self, filename, limit=None):
+		"""Reads the progress manifest of a previous run and returns the 
+		indices of the completed structures, whose results are added to the
+		results table. If a limit is given, the manifest is trimmed to that
+		number of structures."""
+		completed = set()
+		self.output_offset = 0
+		length = 0
+		with open(filename, 'rb') as f:
+			for line in f:
+				if (limit is not None) and (len(completed) >= limit):
+					break
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# Written while the previous run was interrupted
+					break
+				completed.add(entry['index'])
+				self.add_row(entry['index']+1, entry['row'])
+				self.output_offset = entry.get('offset', 0)
+				length += len(line)
+
+		with open(filename, 'r+b') as f:
+			f.truncate(length)
+		return completed
+
+	def labelled_hash(self, index):
+		"""Returns the hash of a structure labelled by the resumed run. The
+		structures are met in the order of the manifest, so it is read one 
+		line at a time."""
+		entry = json.loads(self.labelled.readline())
+		if entry['index'] != index:
+			return None
+		return entry['hash']
+
+	def record_progress(self, index, key, out):
+		"""Appends a completed structure to the progress manifest. The
+		structure has already been written to the output."""
+		if self.manifest is None:
+			return
+
+		# The structure must be in the results store before it is recorded
+		if self.store is not None:
+			self.store.flush()
+
+		entry = {'index':index, 'hash':key, 'row':{k:float(v) for k, v in out.items()}}
+		if self.output_format != 'traj':
+			entry['offset'] = self.output_file.tell()
+		self.manifest.write(json.dumps(entry)+'\n')
+		self.manifest.flush()
+
+	def close_output(self):
+		if self.output_file is not None:
+			self.output_file.close()
+			self.output_file = None
+		if self.manifest is not None:
+			self.manifest.close()
+			self.manifest = None
+		if self.labelled is not None:
+			self.labelled.close()
+			self.labelled = None
+		if self.store is not None:
+			self.store.close()
+			self.store = None
+
 	def save_structure(self, structure):
-		"""If an output filename has been given, the the output is saved to a
-		file by appending all atoms objects to the file."""
-		if self.output_structure:
-			#write(self.output_structure, structure, append=True)
-			write(self.output_structure, self.atoms)
+		"""If an output filename has been given, the structure is appended to
+		the output file."""
+		if self.output_file is None:
+			pass
+		elif self.output_format == 'traj':
+			self.output_file.write(structure)
 		else:
-			pass
\ No newline at end of file
+			write(self.output_file, structure, format=self.output_format)
+			self.output_file.flush()
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+import os
+import sys
+import copy
+import time
+import datetime
+import functools
+import itertools
+import contextlib
+import multiprocessing
+import numpy as np
+
+from ase.io import read
+
+import asemd.modes as modes
+from asemd.configure import Configure
+
+
+# Structures shared by all jobs of a sweep. Set once in every worker by the
+# pool initialiser, so the input file is only read and sent a single time.
+shared_atoms = None
+
+
+def share_atoms(atoms):
+	global shared_atoms
+	shared_atoms = atoms
+
+
+def job_name(filename, n):
+	"""Appends the job number to a file name."""
+	base, ext = os.path.splitext(filename)
+	return f'{base}_job{n}{ext}'
+
+
+def run_job(
+		mode,
+		mode_params,
+		global_params,
+		input_structure,
+		output_structure,
+		log_file,
+		seeded,
+		job
+	):
+	"""Runs a single job of a sweep in a worker process. Only the settings
+	of the sweep are sent to the worker, the structures are shared by the pool
+	initialiser. Returns the job number, elapsed time and the results of each
+	structure."""
+	n, overrides, seed = job
+	mode_params = copy.deepcopy(mode_params)
+	mode_params.pop('sweep')
+	mode_params.pop('workers', None)
+	if seeded:
+		mode_params['seed'] = int(seed.generate_state(1)[0])
+	mode_params.update(overrides)
+	np.random.seed(seed.generate_state(4))
+
+	if output_structure:
+		output_structure = job_name(output_structure, n)
+		mode_params['output'] = output_structure
+
+	stdout_file = os.devnull
+	if log_file:
+		log_file = job_name(log_file, n)
+		stdout_file = os.path.splitext(log_file)[0]+'.out'
+
+	start = time.perf_counter()
+	# The output of each job goes to its own file, or nowhere in test mode
+	out = open(stdout_file, 'a')
+	with out, contextlib.redirect_stdout(out):
+		print(f'Job {n}: ' + ', '.join(f'{k}={v}' for k, v in overrides.items()))
+		setup = modes.initialise(
+			mode,
+			mode_params,
+			copy.deepcopy(global_params),
+			input_structure,
+			output_structure,
+			log_file,
+			atoms=shared_atoms
+		)
+		setup.run()
+		setup.report_cache()
+	elapsed = datetime.timedelta(seconds=round(time.perf_counter() - start, 2))
+
+	return n, elapsed, setup.results().to_dict(orient='index')
+
+
+class Sweep(object):
+	"""Runs a mode once for every combination of the parameters given under
+	sweep, e.g.
+
+		NVT:
+		  sweep:
+		    temperature: 300 400 500
+		    friction: 0.01 0.02
+
+	runs six canonical ensembles. Values are given as YAML lists or space
+	separated strings. The jobs are run by a pool of workers (one per core by
+	default). Each job writes its own output, log and standard output file, 
+	named after the job number, and the final state of every job is collected
+	in a single summary table. Every job draws its random numbers from its own
+	stream, spawned from the seed (if given)."""
+	error_msg = Configure.error_msg
+
+	def __init__(self,
+			mode,
+			mode_params,
+			global_params,
+			input_structure,
+			output_structure,
+			log_file,
+			atoms=None
+		):
+		self.mode = mode
+		self.mode_params = mode_params
+		self.global_params = global_params
+		self.input_structure = input_structure
+		self.output_structure = output_structure
+		self.log_file = log_file
+		self.atoms = atoms
+
+		grid = {}
+		for key, val in self.mode_params['sweep'].items():
+			if isinstance(val, (list, tuple)):
+				grid[key.lower()] = list(val)
+			else:
+				grid[key.lower()] = str(val).split()
+
+		if not grid:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'No sweep parameters given!',
+				'Set the swept parameters by including e.g.:',
+				f'{self.mode}:\n  sweep:\n    temperature: 300 400 500',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		# Pool workers are daemonic and cannot start the replica processes
+		if self.mode == 'REMD':
+			self.error_msg(
+				'CRITICAL ERROR',
+				'Sweeps are not supported in REMD.',
+				'Remove sweep from the YAML input file and run one REMD per set of parameters.'
+			)
+			sys.exit()
+
+		keys = list(grid.keys())
+		self.jobs = [dict(zip(keys, val)) for val in itertools.product(*grid.values())]
+
+		if 'workers' in self.mode_params:
+			self.WORKERS = int(self.mode_params['workers'])
+		else:
+			self.WORKERS = os.cpu_count()
+			self.mode_params['workers'] = self.WORKERS
+		self.WORKERS = max(min(self.WORKERS, len(self.jobs)), 1)
+
+		if 'seed' in self.mode_params:
+			self.SEED = int(self.mode_params['seed'])
+		else:
+			self.SEED = None
+
+	def results(self):
+		"""Returns the summary table of all jobs."""
+		return self.out
+
+	def run(self):
+		"""Runs all jobs of the sweep and prints a summary table."""
+		print(f'Sweep: {len(self.jobs)} jobs on {self.WORKERS} workers')
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print(f'Sweep: {len(self.jobs)} jobs on {self.WORKERS} workers', file=f)
+
+		if self.atoms is None:
+			atoms = read(self.input_structure, ':')
+		else:
+			atoms = self.atoms
+
+		# Forked workers inherit the same random state, so each job is given
+		# its own stream
+		seeds = np.random.SeedSequence(self.SEED).spawn(len(self.jobs))
+
+		# Only the settings are sent with each job
+		job = functools.partial(
+			run_job,
+			self.mode,
+			self.mode_params,
+			self.global_params,
+			self.input_structure,
+			self.output_structure,
+			self.log_file,
+			self.SEED is not None
+		)
+
+		# Forking shares the loaded structures and calculator modules
+		context = multiprocessing.get_context('fork')
+		with context.Pool(
+				self.WORKERS,
+				initializer=share_atoms,
+				initargs=(atoms,)
+			) as pool:
+			rows = []
+			for n, elapsed, results in pool.imap_unordered(
+					job, zip(itertools.count(1), self.jobs, seeds)):
+				print(f'Job {n} (of {len(self.jobs)}) completed after {elapsed}', flush=True)
+				for structure, row in results.items():
+					rows.append({
+						'job':n,
+						'structure':structure,
+						**self.jobs[n-1],
+						'elapsed':elapsed,
+						**row
+					})
+
+		import pandas as pd
+		self.out = pd.DataFrame(rows).sort_values(['job', 'structure'])
+		self.out = self.out.set_index(['job', 'structure'])
+		print('\nSweep summary:')
+		print(self.out.to_string())
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\nSweep summary:', file=f)
+				print(self.out.to_string(), file=f)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+import sys
+import copy
+import time
+import datetime
+
+from ase.io import write
+
+import asemd.modes as modes
+from asemd.configure import Configure
+
+
+class Workflow(object):
+	"""Runs several modes in sequence on the same structures, e.g.
+
+		WORKFLOW:
+		  name: relax_and_heat
+		  stages: EMIN NVT NPT
+		  output: final.xyz
+
+	Each stage reads its parameters from the section of its mode in the input
+	file. A stage may also be given as {MODE: {parameters}}, which overrides
+	the parameters of that section. Other parameters in the WORKFLOW section
+	(e.g. structures) apply to every stage.
+
+	The structures are passed from stage to stage in memory and every
+	calculator is only loaded once. Stages only write outputs if their section
+	sets one, and the final structures are written to the output of the
+	workflow. MD stages that follow another MD stage keep the velocities of the
+	previous stage, unless 'keep velocities' is set to False in their 
+	section."""
+	error_msg = Configure.error_msg
+	output_name = Configure.output_name
+
+	def __init__(self,
+			mode_params,
+			global_params,
+			stage_params,
+			input_structure,
+			output_structure,
+			log_file,
+			test=False,
+			atoms=None
+		):
+		self.mode_params = mode_params
+		self.global_params = global_params
+		self.input_structure = input_structure
+		self.output_structure = output_structure
+		self.log_file = log_file
+		self.test = test
+		self.atoms = atoms
+
+		# Previous final outputs are only replaced if overwrite is set
+		self.overwrite = self.global_params.get('overwrite', False)
+
+		if 'stages' in self.mode_params:
+			stages = self.mode_params['stages']
+		else:
+			self.error_msg(
+				'CRITICAL ERROR',
+				'No workflow stages given!',
+				'Set the modes run in sequence by including:',
+				'WORKFLOW:\n  stages: EMIN NVT NPT',
+				'in the YAML input file.'
+			)
+			sys.exit()
+
+		if isinstance(stages, str):
+			stages = stages.split()
+
+		# Parameters shared by all stages
+		shared = {
+			key:val for key, val in self.mode_params.items()
+			if key not in ('stages', 'name', 'output')
+		}
+
+		self.stages = []
+		for stage in stages:
+			if isinstance(stage, dict):
+				(mode, overrides), = stage.items()
+			else:
+				mode, overrides = stage, {}
+			mode = mode.upper()
+
+			if mode not in modes.modes or mode in ('WORKFLOW', 'CH'):
+				self.error_msg(
+					'CRITICAL ERROR',
+					f'Unknown workflow stage: {mode}',
+					'Choose stages between EMIN, SP, EOS, NVE, NVT, NPT, RESPA and REMD.'
+				)
+				sys.exit()
+
+			params = copy.deepcopy(stage_params.get(mode) or {})
+			params.update(copy.deepcopy(shared))
+			params.update({key.lower():val for key, val in (overrides or {}).items()})
+			self.stages.append((mode, params))
+
+		# Calculators that have been loaded, by name
+		self.calculators = {}
+
+	def results(self):
+		"""Returns the time spent in each stage."""
+		return self.out
+
+	def calculator_name(self, params):
+		"""Returns the name of the calculator of a stage."""
+		if 'calculator' in params:
+			return params['calculator']
+		return self.global_params.get('calculator', False)
+
+	def run(self):
+		"""Runs all stages in sequence."""
+		atoms = self.atoms
+		previous = None
+		timings = {}
+
+		for n, (mode, params) in enumerate(self.stages, start=1):
+			print(f'\nStage {n} (of {len(self.stages)}): {mode} ({modes.modes[mode]})', flush=True)
+			if self.log_file:
+				with open(self.log_file, 'a') as f:
+					print(f'\nStage {n} (of {len(self.stages)}): {mode}', file=f)
+
+			if self.test:
+				output_structure = False
+				if params.get('analysis'):
+					params['analysis']['output'] = False
+			else:
+				output_structure = params.get('output', False)
+
+			if (mode in modes.ensemble_methods) and (previous in modes.ensemble_methods):
+				params.setdefault('keep velocities', True)
+
+			name = self.calculator_name(params)
+
+			start = time.perf_counter()
+			setup = modes.initialise(
+				mode,
+				params,
+				copy.deepcopy(self.global_params),
+				self.input_structure,
+				output_structure,
+				self.log_file,
+				atoms=atoms,
+				calc=self.calculators.get(name)
+			)
+
+			# The bare calculator is shared, since the cache of a stage is
+			# closed when the stage has finished
+			if name and (name not in self.calculators):
+				self.calculators[name] = setup.load_calc(name)
+				setup.shared_calc = self.calculators[name]
+
+			setup.run()
+			setup.report_cache()
+			elapsed = datetime.timedelta(seconds=round(time.perf_counter() - start, 2))
+			timings[f'{n} {mode}'] = {'elapsed':elapsed}
+
+			# The next stage continues from the structures of this one
+			atoms = setup.atoms
+			previous = mode
+
+		self.atoms = atoms
+		if self.output_structure:
+			self.output_structure = self.output_name(self.output_structure)
+			write(self.output_structure, atoms)
+
+		import pandas as pd
+		self.out = pd.DataFrame.from_dict(timings, orient='index')
+		print('\nStage timings:')
+		print(self.out.to_string())
+
+		if self.log_file:
+			with open(self.log_file, 'a') as f:
+				print('\nStage timings:', file=f)
+				print(self.out.to_string(), file=f)